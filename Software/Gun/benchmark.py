@@ -0,0 +1,243 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# benchmark.py
+# Microbenchmarks for the gun firmware, run on the host under emulation.
+# CPython is much faster than MicroPython on the ESP32, so compare the
+# numbers with each other rather than with the device's timings.
+#
+# Usage: python benchmark.py [name ...]
+# With no names, runs them all.
+# ----------------------------------------------------------------------
+import sys, io, timeit, contextlib
+import emulation
+emulation.install()
+
+def report(label, seconds, ops):
+    """
+    Prints the time per operation.
+
+    label: what was measured
+    seconds: the total time taken
+    ops: the number of operations in that time
+    """
+    print("{:<48} {:>10.3f} us/op".format(label, seconds * 1000000 / ops))
+
+def measure(label, fn, ops, repeat=5):
+    """
+    Times fn (which performs ops operations) and reports the best of several
+    runs. The firmware's debug output is discarded while it runs.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+    report(label, best, ops)
+    return best
+
+def make_player(playerid, teamnumber, playernumber):
+    from player import Player, Team
+    from fx import FX
+    with contextlib.redirect_stdout(io.StringIO()):
+        player = Player(playerid)
+        player.fx = FX() # no effects: they're measured separately
+        player.assign(Team(teamnumber, playernumber, (128, 0, 0), "Team"))
+        player.joingame("Benchmark")
+        player.up()
+    return player
+
+# ------------------------------------------------------------------------------
+# FIRE
+# ------------------------------------------------------------------------------
+def bench_fire():
+    from gun import Gun
+
+    count = 1000
+    emulation.reset()
+    player = make_player("shooter", 2, 3)
+    gun = Gun(12, 13, 14, player.fx, player, count, 5)
+    button = emulation.board.pins[12]
+
+    def fire():
+        gun.ammo = count
+        for i in range(count):
+            gun._fire()
+
+    def press():
+        gun.ammo = count
+        for i in range(count):
+            button.press(60)
+
+    print("Firing (encoding and sending a NEC frame)")
+    measure("Gun._fire", fire, count)
+    measure("fire button press, debounced", press, count)
+
+# ------------------------------------------------------------------------------
+# HIT
+# ------------------------------------------------------------------------------
+def bench_hit():
+    from gun import Gun
+    from sensor import Sensor
+
+    count = 200
+    emulation.reset()
+    shooter = make_player("shooter", 2, 3)
+    victim = make_player("victim", 4, 1)
+    gun = Gun(12, 13, 14, shooter.fx, shooter, 1, 5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        gun._fire()
+    pulses = emulation.board.rmts[0].sent[-1][2]
+    sensor = Sensor(15, 1, "gun", victim, victim.fx)
+    pin = emulation.board.pins[15]
+    clock = emulation.board.clock
+
+    def receive():
+        for i in range(count):
+            pin.pulses(pulses)
+            clock.advance(100)
+
+    def handle():
+        for i in range(count):
+            sensor.handle_ir(3, 2, 0)
+
+    print("Being hit")
+    measure("NEC frame received and decoded", receive, count)
+    measure("Sensor.handle_ir", handle, count)
+
+# ------------------------------------------------------------------------------
+# RGB
+# ------------------------------------------------------------------------------
+def bench_rgb():
+    import math
+    from fx import RGB, BROWN, RED, WHITE, LOG_QUICK, EASE_STEPS, LAYER_ANIMATION, LAYER_SHIELD, LAYER_FIRE
+
+    count = 1000
+    for pixels in (4, 16, 64):
+        emulation.reset()
+        player = make_player("player", 2, 3)
+        rgb = RGB(17, pixels, player)
+        team = player.team.colour
+        table = rgb._fade_table(team, BROWN, LOG_QUICK)
+
+        def set_all():
+            for i in range(count):
+                rgb._set_all((i & 255, 0, 0))
+
+        def set_all_unchanged():
+            for i in range(count):
+                rgb._set_all(team)
+
+        def update():
+            for i in range(count):
+                rgb.np.fill(team)
+                rgb.np.write()
+
+        def fade_log():
+            # as the fades were rendered: a log and a new colour each frame
+            for i in range(count):
+                progress = math.log(i % 500 + 1, 500)
+                rgb._set_all(tuple(int(team[j] + (BROWN[j] - team[j]) * progress) for j in range(3)))
+
+        def fade_table():
+            for i in range(count):
+                rgb.strip.fill(table, i % (EASE_STEPS + 1))
+                rgb.strip.show()
+
+        def wheel():
+            for i in range(count):
+                for p in range(pixels):
+                    rgb.np[p] = rgb._wheel((p * 256 // pixels + i) & 255)
+                rgb.np.write()
+
+        def wheel_table():
+            for i in range(count):
+                for p in range(pixels):
+                    rgb.strip.put(p, rgb.wheel, (rgb.offsets[p] + i) & 255)
+                rgb.strip.show()
+
+        def compose_base():
+            for i in range(count):
+                rgb.compositor.compose()
+
+        def compose_layers():
+            # a reload, the shield shimmer and the fire pulse all showing
+            rgb.layers[LAYER_ANIMATION].fill(rgb.wheel, 0)
+            for p in range(pixels):
+                rgb.layers[LAYER_SHIELD].set_pixel(p, WHITE, p * 8 & 127)
+            rgb.layers[LAYER_FIRE].set_pixel(0, RED)
+            for i in range(count):
+                rgb.compositor.compose()
+            for layer in rgb.layers:
+                layer.clear()
+
+        print("Rendering frames on a {}-pixel strip".format(pixels))
+        measure("RGB._set_all", set_all, count)
+        measure("state change, rewriting an unchanged frame", update, count)
+        measure("state change, unchanged frame skipped", set_all_unchanged, count)
+        measure("log fade frame, computed", fade_log, count)
+        measure("log fade frame, from its table", fade_table, count)
+        measure("rainbow cycle frame, computed", wheel, count)
+        measure("rainbow cycle frame, from the wheel table", wheel_table, count)
+        measure("frame composed, base only", compose_base, count)
+        measure("frame composed, base and 3 layers", compose_layers, count)
+
+# ------------------------------------------------------------------------------
+# FX
+# ------------------------------------------------------------------------------
+def bench_fx():
+    from fx import FXScheduler, RGB, Laser
+
+    seconds = 5
+    for pixels in (4, 16, 64):
+        emulation.reset()
+        player = make_player("player", 2, 3)
+        scheduler = FXScheduler()
+        laser = Laser(16, 1000, player, scheduler)
+        rgb = RGB(17, pixels, player, scheduler)
+        rgb.reload_time = seconds
+        clock = emulation.board.clock
+
+        def reload_and_hit():
+            # a reload, pre-empted by a hit half way through, with shots
+            # fired around it
+            rgb.reload()
+            for i in range(seconds * 4):
+                if i == seconds * 2:
+                    rgb.hit()
+                laser.fire()
+                clock.advance(250)
+            clock.advance(1000)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            reload_and_hit()
+        stats = scheduler.stats()
+        print("Reloading for {}s on a {}-pixel strip: {} frames in {} timer callbacks".format(
+            seconds, pixels, stats["frames"], stats["ticks"]))
+        measure("scheduler timer callback", reload_and_hit, stats["ticks"])
+
+benchmarks = {
+    "fire": bench_fire,
+    "hit": bench_hit,
+    "rgb": bench_rgb,
+    "fx": bench_fx
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks.keys())
+    for name in names:
+        print("=" * 64)
+        print(name)
+        print("=" * 64)
+        benchmarks[name]()
@@ -0,0 +1,226 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/__init__.py
+# Emulates the ESP32's MicroPython modules on CPython, so the gun firmware
+# can be run, tested and benchmarked on a dev box, unmodified:
+#
+#     import emulation
+#     emulation.install()
+#     from gun import Gun  # etc
+#
+# install() makes machine, neopixel, esp32, network, micropython and
+# usocket importable, aliases utime, ujson, ustruct and ubinascii to their
+# CPython equivalents, and adds MicroPython's ticks functions to time.
+# CPython's own _thread stands in for MicroPython's.
+#
+# The emulated hardware hangs off emulation.board, which tests poke at:
+# injecting edges into input pins (board.pins), reading the PWM duty log,
+# the frames written to the NeoPixels and the pulses sent through the RMT,
+# and adding access points for the WLAN to find. reset() gives a fresh
+# board.
+#
+# The board's clock runs in real time, but can be wound forward with
+# board.clock.advance(ms). Timer callbacks (and functions passed to
+# micropython.schedule) only run while the clock is being advanced or
+# polled (machine.idle() polls it), in the thread doing so - much as
+# interrupts on the device break into whatever the firmware is doing.
+# ----------------------------------------------------------------------
+import sys, time, threading, heapq
+from collections import deque
+
+# MicroPython's ticks wrap round at 2**30 on the ESP32
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+SCHEDULE_DEPTH = 4 # MicroPython's default scheduler queue depth
+
+class Clock:
+    """
+    The board's clock: real time since the board was created, plus however
+    far it has been wound forward. Runs the machine.Timers.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.wound = 0          # us the clock has been wound forward
+        self.timers = []        # heap of (due us, seq, Timer)
+        self.seq = 0
+        self.scheduled = deque() # (function, arg) from micropython.schedule
+        self.lock = threading.RLock()
+
+    def now(self):
+        """
+        Returns the time (us) since boot.
+        """
+        return int((time.perf_counter() - self.started) * 1000000) + self.wound
+
+    def start(self, timer, due):
+        """
+        Arms a timer to expire at the given time (us).
+        """
+        with self.lock:
+            self.seq += 1
+            timer.due = due
+            timer.seq = self.seq
+            heapq.heappush(self.timers, (due, self.seq, timer))
+
+    def stop(self, timer):
+        timer.seq = None # its entry in the heap is ignored from now on
+
+    def schedule(self, function, arg):
+        if len(self.scheduled) >= SCHEDULE_DEPTH:
+            raise RuntimeError("schedule queue full")
+        self.scheduled.append((function, arg))
+
+    def advance(self, ms):
+        """
+        Winds the clock forward, running each timer as its time comes, and
+        any scheduled functions after it.
+
+        ms: how far to wind the clock (may be fractional)
+        """
+        with self.lock:
+            target = self.now() + int(ms * 1000)
+            self._run_scheduled()
+            timer = self._next(target)
+            while timer != None:
+                gap = timer.due - self.now()
+                if gap > 0:
+                    self.wound += gap
+                timer._expire()
+                self._run_scheduled()
+                timer = self._next(target)
+            gap = target - self.now()
+            if gap > 0:
+                self.wound += gap
+
+    def poll(self):
+        """
+        Runs the timers which are due, without winding the clock.
+        """
+        self.advance(0)
+
+    def _next(self, limit):
+        # pops the earliest armed timer due by limit, skipping stale entries
+        timers = self.timers
+        while len(timers) > 0:
+            due, seq, timer = timers[0]
+            if timer.seq != seq:
+                heapq.heappop(timers)
+            elif due > limit:
+                return None
+            else:
+                heapq.heappop(timers)
+                return timer
+        return None
+
+    def _run_scheduled(self):
+        scheduled = self.scheduled
+        while len(scheduled) > 0:
+            function, arg = scheduled.popleft()
+            function(arg)
+
+class AccessPoint:
+    def __init__(self, ssid, key, rssi, channel):
+        self.ssid = ssid
+        self.key = key
+        self.rssi = rssi
+        self.channel = channel
+        self.bssid = bytes([0x02, 0, 0, 0, 0, channel])
+
+class Board:
+    """
+    The emulated hardware.
+    """
+    def __init__(self):
+        self.clock = Clock()
+        self.freq = 160000000
+        self.unique_id = b"\x24\x0a\xc4\x00\x00\x01"
+        self.pins = {}           # pin id: machine.Pin
+        self.pwms = {}           # pin id: machine.PWM
+        self.neopixels = {}      # pin id: neopixel.NeoPixel
+        self.rmts = {}           # channel: esp32.RMT
+        self.wlans = {}          # interface: network.WLAN
+        self.access_points = []  # AccessPoints in range of the WLAN
+
+    def add_access_point(self, ssid, key=None, rssi=-60, channel=1):
+        """
+        Puts an access point in range of the board's WLAN.
+        """
+        self.access_points.append(AccessPoint(ssid, key, rssi, channel))
+
+board = Board()
+
+def reset():
+    """
+    Replaces the board with a fresh one (eg between tests).
+    """
+    global board
+    board = Board()
+    return board
+
+# ------------------------------------------------------------------------------
+# MicroPython's additions to time
+# ------------------------------------------------------------------------------
+def ticks_ms():
+    return (board.clock.now() // 1000) & TICKS_MAX
+
+def ticks_us():
+    return board.clock.now() & TICKS_MAX
+
+def ticks_cpu():
+    return board.clock.now() & TICKS_MAX
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+def sleep_us(us):
+    time.sleep(us / 1000000)
+
+TIME_FUNCTIONS = (ticks_ms, ticks_us, ticks_cpu, ticks_add, ticks_diff, sleep_ms, sleep_us)
+
+EMULATED = ("machine", "neopixel", "esp32", "network", "micropython", "usocket")
+ALIASES = {"utime": "time", "ujson": "json", "ustruct": "struct", "ubinascii": "binascii"}
+
+def install():
+    """
+    Makes the emulated MicroPython modules importable in their place.
+    """
+    import importlib
+    for function in TIME_FUNCTIONS:
+        setattr(time, function.__name__, function)
+    for name in EMULATED:
+        sys.modules[name] = importlib.import_module("emulation." + name)
+    for name, module in ALIASES.items():
+        sys.modules[name] = importlib.import_module(module)
+
+    # the IR transmitter picks its backend by platform when it's imported,
+    # so import it as it would be on the ESP32 (ie driving the RMT)
+    if "ir_tx" not in sys.modules:
+        platform = sys.platform
+        sys.platform = "esp32"
+        try:
+            importlib.import_module("ir_tx")
+        finally:
+            sys.platform = platform
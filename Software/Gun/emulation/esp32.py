@@ -0,0 +1,73 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/esp32.py
+# Emulates MicroPython's esp32 module: the RMT, which sends the gun's IR.
+# ----------------------------------------------------------------------
+import emulation
+from collections import deque
+from emulation.machine import Pin
+
+class RMT:
+    """
+    An RMT (remote control) channel. Nothing is transmitted: the pulse
+    trains written are kept in sent, as (ms, start level, durations), where
+    they can be checked, or fed into a receiver with Pin.pulses().
+    """
+    SENT = 1024 # the most recent pulse trains kept
+
+    def __init__(self, channel, *, pin=None, clock_div=8, idle_level=False, tx_carrier=None):
+        if clock_div < 1 or clock_div > 255:
+            raise ValueError("clock_div must be from 1 to 255")
+        self.channel = channel
+        self.pin = Pin(pin)
+        self.pin.init(Pin.OUT)
+        self._clock_div = clock_div
+        self.idle_level = idle_level
+        self.tx_carrier = tx_carrier # (frequency, duty %, level)
+        self.looping = False
+        self.sent = deque(maxlen=RMT.SENT)
+        emulation.board.rmts[channel] = self
+
+    @staticmethod
+    def source_freq():
+        return 80000000
+
+    def clock_div(self):
+        return self._clock_div
+
+    def write_pulses(self, duration, data=True):
+        """
+        Sends a pulse train: duration is the length of each pulse, in ticks
+        of the channel's clock, and data the level of the first (the levels
+        alternating from there).
+        """
+        if len(duration) == 0:
+            raise ValueError("no pulses")
+        for d in duration:
+            if d < 1 or d > 32767:
+                raise ValueError("pulse duration out of range")
+        self.sent.append((emulation.ticks_ms(), 1 if data else 0, tuple(duration)))
+
+    def wait_done(self, *, timeout=0):
+        return True # transmission is instantaneous
+
+    def loop(self, enable_loop):
+        self.looping = bool(enable_loop)
+
+    def deinit(self):
+        emulation.board.rmts.pop(self.channel, None)
@@ -0,0 +1,258 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/machine.py
+# Emulates MicroPython's machine module (Pin, PWM, Timer) for the ESP32.
+# ----------------------------------------------------------------------
+import emulation
+from collections import deque
+
+class Pin:
+    """
+    A GPIO pin. As on the ESP32, there is one Pin object per pin: Pin(n)
+    returns the same object each time, reconfigured by any arguments.
+
+    Tests drive input pins from outside with inject(), press() and pulses().
+    """
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_DOWN = 1
+    PULL_UP = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __new__(cls, id, *args, **kwargs):
+        if isinstance(id, Pin):
+            return id
+        pins = emulation.board.pins
+        pin = pins.get(id)
+        if pin == None:
+            pin = object.__new__(cls)
+            pin.id = id
+            pin.mode = None
+            pin.pull = None
+            pin.level = 0
+            pin.handler = None
+            pin.trigger = 0
+            pins[id] = pin
+        return pin
+
+    def __init__(self, id, mode=-1, pull=-1, *, value=None):
+        self.init(mode, pull, value=value)
+
+    def init(self, mode=-1, pull=-1, *, value=None):
+        if mode != -1:
+            self.mode = mode
+        if pull != -1:
+            self.pull = pull
+            if pull == Pin.PULL_UP:
+                self.level = 1
+            elif pull == Pin.PULL_DOWN:
+                self.level = 0
+        if value != None:
+            self._set(value)
+
+    def __repr__(self):
+        return "Pin(" + str(self.id) + ")"
+
+    def value(self, x=None):
+        if x == None:
+            return self.level
+        self._set(x)
+
+    def __call__(self, x=None):
+        return self.value(x)
+
+    def on(self):
+        self._set(1)
+
+    def off(self):
+        self._set(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, *, priority=1, wake=None, hard=False):
+        """
+        Sets (or with handler None, clears) the pin's interrupt handler.
+        """
+        self.handler = handler
+        self.trigger = trigger if handler != None else 0
+
+    def _set(self, level):
+        level = 1 if level else 0
+        if level == self.level:
+            return
+        self.level = level
+        edge = Pin.IRQ_RISING if level else Pin.IRQ_FALLING
+        if self.trigger & edge:
+            self.handler(self)
+
+    # --------------------------------------------------------------------------
+    # Driving the pin from outside
+    # --------------------------------------------------------------------------
+    def inject(self, level):
+        """
+        Drives the pin to a level, raising its interrupt on a change.
+        """
+        with emulation.board.clock.lock:
+            self._set(level)
+
+    def press(self, ms=100):
+        """
+        Presses a button (wired to ground, with a pull-up) for a time, then
+        releases it.
+        """
+        clock = emulation.board.clock
+        with clock.lock:
+            self._set(0)
+            clock.advance(ms)
+            self._set(1)
+
+    def pulses(self, durations, level=0):
+        """
+        Drives a pulse train into the pin from idle (the opposite level):
+        level, then alternate levels for each duration (us) in turn, then back
+        to idle. An IR receiver's output idles high and goes low while it sees
+        the carrier, so the pulses an RMT sends (marks first) arrive with
+        level 0.
+        """
+        clock = emulation.board.clock
+        with clock.lock:
+            self.level = level ^ 1
+            self._set(level)
+            for duration in durations:
+                clock.advance(duration / 1000)
+                level ^= 1
+                self._set(level)
+
+class PWM:
+    """
+    A PWM output. Every change of frequency or duty is kept, with the time
+    (ms) it was made, in log.
+    """
+    LOG_SIZE = 4096
+
+    def __init__(self, pin, freq=5000, duty=512, *, duty_u16=None):
+        self.pin = Pin(pin)
+        self.pin.init(Pin.OUT)
+        self._freq = freq
+        self._duty = duty if duty_u16 == None else duty_u16 >> 6
+        self.active = True
+        self.log = deque(maxlen=PWM.LOG_SIZE) # (ms, freq, duty)
+        self._log()
+        emulation.board.pwms[self.pin.id] = self
+
+    def _log(self):
+        self.log.append((emulation.ticks_ms(), self._freq, self._duty if self.active else 0))
+
+    def freq(self, value=None):
+        if value == None:
+            return self._freq
+        self._freq = value
+        self._log()
+
+    def duty(self, value=None):
+        """
+        Gets or sets the duty cycle (0-1023).
+        """
+        if value == None:
+            return self._duty
+        if value < 0 or value > 1023:
+            raise ValueError("duty must be from 0 to 1023")
+        self._duty = value
+        self.active = True
+        self._log()
+
+    def duty_u16(self, value=None):
+        if value == None:
+            return self._duty << 6
+        self.duty(value >> 6)
+
+    def deinit(self):
+        self.active = False
+        self._log()
+
+class Timer:
+    """
+    A timer, driven by the board's clock.
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        self.mode = Timer.PERIODIC
+        self.period = 0 # us
+        self.callback = None
+        self.due = None
+        self.seq = None
+        if len(kwargs) > 0:
+            self.init(**kwargs)
+
+    def init(self, *, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        clock = emulation.board.clock
+        if freq > 0:
+            self.period = int(1000000 / freq)
+        else:
+            self.period = int(period * 1000)
+        self.mode = mode
+        self.callback = callback
+        clock.start(self, clock.now() + self.period)
+
+    def deinit(self):
+        emulation.board.clock.stop(self)
+
+    def value(self):
+        """
+        Returns the time (ms) until the timer next expires.
+        """
+        if self.seq == None:
+            return 0
+        return max(0, self.due - emulation.board.clock.now()) // 1000
+
+    def _expire(self):
+        # called by the clock when the timer's time comes
+        if self.mode == Timer.PERIODIC:
+            emulation.board.clock.start(self, self.due + max(self.period, 1))
+        else:
+            self.seq = None
+        if self.callback != None:
+            self.callback(self)
+
+def freq(hz=None):
+    if hz == None:
+        return emulation.board.freq
+    emulation.board.freq = hz
+
+def idle():
+    emulation.board.clock.poll()
+
+def unique_id():
+    return emulation.board.unique_id
+
+def disable_irq():
+    emulation.board.clock.lock.acquire()
+    return True
+
+def enable_irq(state=True):
+    if state:
+        emulation.board.clock.lock.release()
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+def soft_reset():
+    raise SystemExit("machine.soft_reset()")
@@ -0,0 +1,51 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/micropython.py
+# Emulates MicroPython's micropython module.
+# ----------------------------------------------------------------------
+import emulation
+
+def const(expr):
+    return expr
+
+def native(fn):
+    return fn
+
+def viper(fn):
+    return fn
+
+def schedule(function, arg):
+    """
+    Queues function(arg) to run once the current interrupt handler returns.
+    """
+    emulation.board.clock.schedule(function, arg)
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def opt_level(level=None):
+    return 0 if level == None else None
+
+def mem_info(verbose=False):
+    pass
+
+def heap_lock():
+    return 0
+
+def heap_unlock():
+    return 0
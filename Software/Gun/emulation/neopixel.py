@@ -0,0 +1,73 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/neopixel.py
+# Emulates MicroPython's neopixel module, recording the frames written.
+# ----------------------------------------------------------------------
+import emulation
+from collections import deque
+from emulation.machine import Pin
+
+class NeoPixel:
+    """
+    A strip of WS2812B LEDs. As in MicroPython, the pixels are kept in buf,
+    bpp bytes each in the order the LEDs take them (GRB); write() records a
+    copy of buf, with the time (ms) it was written, in frames.
+    """
+    ORDER = (1, 0, 2, 3)
+    FRAMES = 4096 # the most recent frames kept
+
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = Pin(pin)
+        self.pin.init(Pin.OUT)
+        self.n = n
+        self.bpp = bpp
+        self.timing = timing
+        self.buf = bytearray(n * bpp)
+        self.frames = deque(maxlen=NeoPixel.FRAMES) # (ms, bytes)
+        self.writes = 0
+        emulation.board.neopixels[self.pin.id] = self
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, i, v):
+        offset = i * self.bpp
+        for j in range(self.bpp):
+            self.buf[offset + self.ORDER[j]] = v[j]
+
+    def __getitem__(self, i):
+        offset = i * self.bpp
+        return tuple(self.buf[offset + self.ORDER[j]] for j in range(self.bpp))
+
+    def fill(self, v):
+        for i in range(self.n):
+            self[i] = v
+
+    def write(self):
+        self.writes += 1
+        self.frames.append((emulation.ticks_ms(), bytes(self.buf)))
+
+    def pixels(self, frame=-1):
+        """
+        Returns the colours of the pixels in a recorded frame (by default the
+        last), as (r, g, b) tuples.
+        """
+        buf = self.frames[frame][1]
+        bpp = self.bpp
+        order = self.ORDER
+        return [tuple(buf[i * bpp + order[j]] for j in range(bpp)) for i in range(self.n)]
@@ -0,0 +1,107 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/network.py
+# Emulates MicroPython's network module: a WLAN which finds the access
+# points added with board.add_access_point(), and connects to them at once.
+# The connection is only notional - sockets go through the host's network.
+# ----------------------------------------------------------------------
+import emulation
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+
+AUTH_OPEN = 0
+AUTH_WPA2_PSK = 3
+
+class WLAN:
+    """
+    A WiFi interface. As on the ESP32, there is one per interface.
+    """
+    def __new__(cls, interface_id=STA_IF):
+        wlans = emulation.board.wlans
+        wlan = wlans.get(interface_id)
+        if wlan == None:
+            wlan = object.__new__(cls)
+            wlan.interface = interface_id
+            wlan._active = False
+            wlan._status = STAT_IDLE
+            wlan.ap = None # the access point we're connected to
+            wlans[interface_id] = wlan
+        return wlan
+
+    def active(self, is_active=None):
+        if is_active == None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self.disconnect()
+
+    def scan(self):
+        """
+        Returns (ssid, bssid, channel, rssi, authmode, hidden) for each access
+        point in range.
+        """
+        if not self._active:
+            raise OSError("STA must be active")
+        return [(ap.ssid.encode("utf-8"), ap.bssid, ap.channel, ap.rssi,
+            AUTH_OPEN if ap.key == None else AUTH_WPA2_PSK, False)
+            for ap in emulation.board.access_points]
+
+    def connect(self, ssid=None, key=None, *, bssid=None):
+        if not self._active:
+            raise OSError("STA must be active")
+        self.ap = None
+        self._status = STAT_NO_AP_FOUND
+        for ap in emulation.board.access_points:
+            if ap.ssid == ssid:
+                if ap.key != None and ap.key != key:
+                    self._status = STAT_WRONG_PASSWORD
+                else:
+                    self.ap = ap
+                    self._status = STAT_GOT_IP
+                break
+
+    def disconnect(self):
+        self.ap = None
+        self._status = STAT_IDLE
+
+    def isconnected(self):
+        return self._status == STAT_GOT_IP
+
+    def status(self, param=None):
+        if param == "rssi":
+            return self.ap.rssi if self.ap != None else 0
+        return self._status
+
+    def ifconfig(self, config=None):
+        if self.isconnected():
+            return ("192.168.4.2", "255.255.255.0", "192.168.4.1", "192.168.4.1")
+        return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    def config(self, param):
+        if param == "mac":
+            return emulation.board.unique_id
+        if param == "essid":
+            return self.ap.ssid if self.ap != None else ""
+        raise ValueError("unknown config param")
@@ -0,0 +1,110 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# emulation/usocket.py
+# Emulates MicroPython's usocket module over the host's sockets, adding the
+# stream methods (read, write, readinto, readline) MicroPython's have, so
+# the MQTT client can talk to a broker on the dev box.
+# ----------------------------------------------------------------------
+import socket as _socket
+
+AF_INET = _socket.AF_INET
+SOCK_STREAM = _socket.SOCK_STREAM
+SOCK_DGRAM = _socket.SOCK_DGRAM
+IPPROTO_TCP = _socket.IPPROTO_TCP
+SOL_SOCKET = _socket.SOL_SOCKET
+SO_REUSEADDR = _socket.SO_REUSEADDR
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    # the ESP32 port is IPv4 only
+    return _socket.getaddrinfo(host, port, AF_INET, type or SOCK_STREAM, proto, flags)
+
+class socket:
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0, sock=None):
+        self.sock = sock if sock != None else _socket.socket(af, type, proto)
+
+    def read(self, size=-1):
+        """
+        Reads size bytes (or until the connection closes). In non-blocking
+        mode, returns what's there - or None if nothing is.
+        """
+        data = b""
+        while size < 0 or len(data) < size:
+            try:
+                chunk = self.sock.recv(size - len(data) if size >= 0 else 4096)
+            except BlockingIOError:
+                return data if len(data) > 0 else None
+            if chunk == b"":
+                break
+            data += chunk
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(len(buf) if nbytes == None else nbytes)
+        if data == None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        line = b""
+        while not line.endswith(b"\n"):
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+        return line
+
+    def write(self, buf, length=None):
+        if length != None:
+            buf = memoryview(buf)[:length]
+        self.sock.sendall(buf)
+        return len(buf)
+
+    def recv(self, bufsize):
+        return self.sock.recv(bufsize)
+
+    def send(self, data):
+        return self.sock.send(data)
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def connect(self, address):
+        self.sock.connect(address)
+
+    def bind(self, address):
+        self.sock.bind(address)
+
+    def listen(self, backlog=0):
+        self.sock.listen(backlog)
+
+    def accept(self):
+        sock, address = self.sock.accept()
+        return socket(sock=sock), address
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def settimeout(self, value):
+        self.sock.settimeout(value)
+
+    def setsockopt(self, level, optname, value):
+        self.sock.setsockopt(level, optname, value)
+
+    def close(self):
+        self.sock.close()
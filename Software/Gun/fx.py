@@ -17,6 +17,23 @@
 # ----------------------------------------------------------------------
 # fx.py
 # deals with special effects - laser, RGB, sound
+#
+# Effects are generators: each renders a frame, then yields the time (ms)
+# until its next frame. They're all run by one FXScheduler, off a single
+# machine.Timer, rather than a thread apiece - threads cost stack RAM, and
+# the jitter of switching between them upsets IR decoding. Each device
+# (laser, RGB) runs one effect at a time; an effect started while another
+# is running waits its turn in a small queue, unless it has a higher
+# priority, in which case it pre-empts the running one (eg a hit pre-empts
+# the reload animation), which resumes once it's done. When a device has
+# no more effects to run, it goes back to its default state (update()).
+#
+# The RGB's frame is built by a Compositor: the colour for the player's
+# state underneath, with layers on top for effects to draw on (animations,
+# the shield shimmer, the fire pulse, the hit fade). Each layer is a device
+# to the scheduler, so effects on different layers run side by side, and
+# the frame is composed and sent to the LEDs once per tick, however many
+# effects drew on it.
 # ----------------------------------------------------------------------
 
 # Handy Colour Constants
@@ -36,8 +53,8 @@ FORWARD = 1
 BACKWARD = -1
 
 from time import sleep
-from machine import Pin, PWM
-import sys, _thread, time
+from machine import Pin, PWM, Timer, disable_irq, enable_irq
+import sys, time
 from utils import dbg
 from neopixel import NeoPixel
 import random
@@ -46,12 +63,264 @@ import math
 
 DEFAULT_RELOAD_TIME = 5
 
+# Effect priorities: a higher priority effect pre-empts a lower one
+FX_LOW = 0      # state changes: bootup, connected, activate, deactivate
+FX_NORMAL = 1   # fire, firefail, reload
+FX_HIGH = 2     # hit
+
+FX_TIMER = 2        # the timer to use (the IR receiver has -1, the buttons 4)
+FX_QUEUE_SIZE = 4   # effects which can wait for each device
+FX_MIN_FRAME = 10   # ms: effects are rendered at no more than 100 frames/sec
+
+# The RGB's layers, bottom to top, over the colour for the player's state
+LAYER_ANIMATION = 0 # bootup, connected, firefail, reload, activate, deactivate
+LAYER_SHIELD = 1    # the shield shimmer
+LAYER_FIRE = 2      # the fire pulse
+LAYER_HIT = 3       # the hit fade
+LAYERS = 4
+
+# Easing curves, as lookup tables of the progress (0-255) at each of
+# EASE_STEPS+1 steps through a fade. Fades are worked out from them into
+# frame tables before they run, so rendering a frame is just copying bytes.
+EASE_STEPS = 64
+EASE_LOG_BASE = 500 # the log curves are those of a 500ms fade
+LINEAR = 0
+LOG_QUICK = 1 # changes quickly at the start, then slowly at the end
+LOG_SLOW = 2  # changes slowly at the start, then quickly at the end
+
+def _ease_table(curve):
+    return bytearray(int(curve(k / EASE_STEPS) * 255 + 0.5) for k in range(EASE_STEPS + 1))
+
+EASES = (
+    _ease_table(lambda x: x),
+    _ease_table(lambda x: math.log(1 + x * (EASE_LOG_BASE - 1), EASE_LOG_BASE)),
+    _ease_table(lambda x: 1 - math.log(1 + (1 - x) * (EASE_LOG_BASE - 1), EASE_LOG_BASE))
+)
+
+def _ms(seconds):
+    return int(seconds * 1000)
+
+class Effect:
+    """
+    An effect running, or waiting to run, on a device.
+    """
+    __slots__ = ("device", "frames", "priority", "wake")
+
+    def __init__(self, device, frames, priority):
+        self.device = device
+        self.frames = frames     # generator: renders a frame, yields ms to the next
+        self.priority = priority
+        self.wake = 0            # ticks_ms when its next frame is due
+
+class FXScheduler:
+    """
+    Runs the effects for all the FX devices, cooperatively, from one timer.
+    The timer only runs while there are effects to render, and is set for
+    when the next frame is due. The timer's callback walks the running
+    effects and queues, so the main thread changes them with interrupts off.
+    """
+    def __init__(self, timer_id=FX_TIMER, queue_size=FX_QUEUE_SIZE, min_frame=FX_MIN_FRAME):
+        """
+        timer_id: the id of the machine.Timer to use
+        queue_size: the number of effects which can wait for each device
+        min_frame: the shortest time (ms) between one effect's frames
+        """
+        self.timer = Timer(timer_id)
+        self.queue_size = queue_size
+        self.min_frame = min_frame
+        self.running = [] # the running Effects - one per busy device
+        self.queues = {}  # device: waiting Effects, highest priority first
+        self.rendering = False
+        self.redraws = [] # Compositors to redraw once this tick's frames are rendered
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0       # timer callbacks
+        self.frames = 0      # frames rendered
+        self.total_us = 0    # time spent rendering
+        self.max_us = 0      # longest timer callback
+        self.late = 0        # frames rendered a whole frame late or more
+        self.preempted = 0   # effects pre-empted by higher priority ones
+        self.dropped = 0     # effects dropped because their queue was full
+
+    def stats(self):
+        """
+        Returns the frame timing statistics since the last reset_stats().
+        """
+        return {
+            "ticks": self.ticks,
+            "frames": self.frames,
+            "mean_us": self.total_us // self.ticks if self.ticks > 0 else 0,
+            "max_us": self.max_us,
+            "late": self.late,
+            "preempted": self.preempted,
+            "dropped": self.dropped
+        }
+
+    def current(self, device):
+        """
+        Returns the Effect running on a device, or None.
+        """
+        for effect in self.running:
+            if effect.device is device:
+                return effect
+        return None
+
+    def busy(self, device):
+        return self.current(device) != None
+
+    def start(self, device, frames, priority=FX_NORMAL):
+        """
+        Starts an effect on a device - at once if the device is idle, or the
+        effect pre-empts what's running - or else queues it.
+
+        device: the FX object the effect is for
+        frames: the effect's generator
+        priority: FX_LOW, FX_NORMAL or FX_HIGH
+        """
+        effect = Effect(device, frames, priority)
+        irq = disable_irq()
+        try:
+            current = self.current(device)
+            if current == None:
+                self._run(effect)
+            elif priority > current.priority:
+                self.preempted += 1
+                self.running.remove(current)
+                self._enqueue(current, True)
+                self._run(effect)
+            else:
+                self._enqueue(effect, False)
+            self._arm()
+        finally:
+            enable_irq(irq)
+
+    def cancel(self, device):
+        """
+        Stops a device's effects, running and queued.
+        """
+        irq = disable_irq()
+        try:
+            current = self.current(device)
+            if current != None:
+                self.running.remove(current)
+            queue = self.queues.pop(device, ())
+            self._arm()
+        finally:
+            enable_irq(irq)
+        # closing runs the effects' own code, so not with interrupts off
+        if current != None:
+            current.frames.close()
+        for effect in queue:
+            effect.frames.close()
+
+    def redraw(self, compositor):
+        """
+        Has a Compositor compose its frame and show it: at once, or if the
+        effects are rendering their frames, once they've all done so.
+        """
+        if not self.rendering:
+            compositor.compose()
+        elif compositor not in self.redraws:
+            self.redraws.append(compositor)
+
+    def _run(self, effect):
+        effect.wake = time.ticks_ms() # its first frame is due now
+        self.running.append(effect)
+
+    def _enqueue(self, effect, resuming):
+        # waiting effects are kept highest priority first, and in the order
+        # they arrived within a priority - except that a pre-empted effect
+        # goes ahead of the others of its priority, to resume first
+        queue = self.queues.get(effect.device)
+        if queue == None:
+            queue = self.queues[effect.device] = []
+        i = 0
+        while i < len(queue) and (queue[i].priority > effect.priority or
+                (queue[i].priority == effect.priority and not resuming)):
+            i += 1
+        queue.insert(i, effect)
+        if len(queue) > self.queue_size:
+            self.dropped += 1
+            queue.pop().frames.close() # the lowest priority, most recent
+
+    def _finish(self, effect):
+        self.running.remove(effect)
+        queue = self.queues.get(effect.device)
+        if queue:
+            self._run(queue.pop(0))
+        else:
+            effect.device.update() # back to the default state
+
+    def _arm(self):
+        # set the timer for the next frame due, or stop it if there is none
+        if len(self.running) == 0:
+            self.timer.deinit()
+            return
+        now = time.ticks_ms()
+        wait = None
+        for effect in self.running:
+            delay = time.ticks_diff(effect.wake, now)
+            if wait == None or delay < wait:
+                wait = delay
+        self.timer.init(mode=Timer.ONE_SHOT, period=max(wait, 1), callback=self._tick)
+
+    def _tick(self, timer=None):
+        # render a frame of each effect which is due one
+        started = time.ticks_us()
+        now = time.ticks_ms()
+        self.rendering = True
+        i = len(self.running) - 1
+        while i >= 0:
+            effect = self.running[i]
+            lateness = time.ticks_diff(now, effect.wake)
+            if lateness >= 0:
+                if lateness >= self.min_frame:
+                    self.late += 1
+                try:
+                    delay = next(effect.frames)
+                    effect.wake = time.ticks_add(now, max(delay, self.min_frame))
+                    self.frames += 1
+                except StopIteration:
+                    self._finish(effect)
+            i -= 1
+        self.rendering = False
+        while len(self.redraws) > 0:
+            self.redraws.pop().compose()
+        elapsed = time.ticks_diff(time.ticks_us(), started)
+        self.ticks += 1
+        self.total_us += elapsed
+        if elapsed > self.max_us:
+            self.max_us = elapsed
+        self._arm()
+
+# the scheduler the FX devices share, unless they're given another
+scheduler = FXScheduler()
+
 class FX_Base():
     """
     Base class for all special FX. Subclassed by Laser, RGB and one day Sound.
     It provides methods like fire, reload, hit which can be invoked by events 
-    and which deliver the FX in a threaded fashion.
+    and which deliver the FX through the scheduler.
     """
+    scheduler = scheduler
+
+    @property
+    def fx_busy(self):
+        """
+        Is an effect running on this device?
+        """
+        return self.scheduler.busy(self)
+
+    def play(self, frames, priority=FX_NORMAL):
+        """
+        Starts (or queues) an effect on this device.
+
+        frames: the effect's generator
+        priority: FX_LOW, FX_NORMAL or FX_HIGH
+        """
+        self.scheduler.start(self, frames, priority)
+
     def fire(self):
         pass
     def firefail(self):
@@ -70,6 +339,8 @@ class FX_Base():
         pass
     def unshield(self):
         pass
+    def compile(self):
+        pass
     def update(self):
         pass
     def close(self):
@@ -77,24 +348,26 @@ class FX_Base():
 
 class Laser(FX_Base):
     """
-    Provides 'fire-and-forget' threaded methods to do laser special effects.
+    Provides 'fire-and-forget' methods to do laser special effects.
     """
-    def __init__(self, laser_pin, max_brightness, player):
+    def __init__(self, laser_pin, max_brightness, player, scheduler=None):
         """
         Initialises the PWM for the laser
 
         laser_pin: the GPIO pin for the laser
         max_brightness: the max brightness (ie PWM duty cycle, 0-1023)
         player: the current player
+        scheduler: the FXScheduler to run its effects (by default, the shared one)
         """
 
         self.laser_pin = laser_pin 
         self.max_brightness = max_brightness
         self.player = player
+        if scheduler != None:
+            self.scheduler = scheduler
 
         self.laser_pwm = PWM(Pin(laser_pin), 500)
         self.off()
-        self.fx_busy = False
 
     def off(self):
         """
@@ -122,51 +395,48 @@ class Laser(FX_Base):
 
     def _blip(self, duration):
         """
-        Thread execution method to blip the laser.
+        Effect to blip the laser.
 
         duration: the duration (seconds) for the blip
         """
-        self.fx_busy = True
         self.on()
-        sleep(duration)
+        yield _ms(duration)
         self.off()
-        self.fx_busy = False
 
     def blip(self, duration):
         """
-        Initiates a thread to blip the laser.
+        Starts an effect to blip the laser.
 
         duration: the duration (seconds) for the blip
         """
-        _thread.start_new_thread(self._blip, (duration,))
+        self.play(self._blip(duration))
     
     def _strobe(self, frequency, duration):
         """
-        Thread execution method to strobe the laser.
+        Effect to strobe the laser.
 
         frequency: the frequency (in Hz) for the strobe
         duration: the duration (seconds) to strobe the laser
         """
-        self.fx_busy = True
         self.laser_pwm.freq(frequency * 2) # double for cycle of on/off
         self.laser_pwm.duty(self.max_brightness)
-        sleep(duration)
+        yield _ms(duration)
         self.off()
-        self.fx_busy = False
 
     def strobe(self, frequency, duration):
         """
-        Initiates a thread to strobe the laser.
+        Starts an effect to strobe the laser.
 
         frequency: the frequency (in Hz) for the strobe
         duration: the duration (seconds) to strobe the laser
         """
-        _thread.start_new_thread(self._strobe, (frequency,duration))
+        self.play(self._strobe(frequency, duration))
 
     def close(self):
         """
         Deactivates the laser PWM
         """
+        self.scheduler.cancel(self)
         self.off()
         self.laser_pwm.deinit()
 
@@ -230,34 +500,292 @@ class FX(FX_Base):
         self.trigger_all("shield")
     def unshield(self):
         self.trigger_all("unshield")
+    def compile(self):
+        self.trigger_all("compile")
     def update(self):
         self.trigger_all("update")
+    def close(self):
+        self.trigger_all("close")
 
     
 
         
+class Strip:
+    """
+    Renders frames onto a strip of WS2812B LEDs. Colours are written as bytes
+    straight into the NeoPixel's buffer, in the order the LEDs take them, so
+    rendering allocates nothing; and a frame is only sent to the LEDs if it
+    differs from the last one sent. Sending is bit-banged with interrupts
+    disabled, which upsets IR timing, so it's worth skipping when it can be.
+    """
+    def __init__(self, np):
+        """
+        Initialises the strip.
+
+        np: the NeoPixel driving the LEDs
+        """
+        self.np = np
+        self.num_pixels = np.n
+        self.order = np.ORDER
+        self.buf = memoryview(np.buf)
+        self.last = bytearray(len(np.buf)) # the frame last sent to the LEDs
+        self.sent = False # whether anything has been (the LEDs' state is unknown until then)
+        self.writes = 0   # frames sent to the LEDs
+        self.skipped = 0  # frames not sent, as they hadn't changed
+
+    def fill(self, table, step):
+        """
+        Sets all the pixels to a colour from a frame table (without sending
+        them to the LEDs).
+
+        table: the frame table
+        step: the index of the colour in the table
+        """
+        i = step * 3
+        a = table[i]
+        b = table[i + 1]
+        c = table[i + 2]
+        buf = self.buf
+        for j in range(0, self.num_pixels * 3, 3):
+            buf[j] = a
+            buf[j + 1] = b
+            buf[j + 2] = c
+
+    def put(self, pixel, table, step):
+        """
+        Sets one pixel to a colour from a frame table (without sending it to
+        the LEDs).
+        """
+        i = step * 3
+        j = pixel * 3
+        buf = self.buf
+        buf[j] = table[i]
+        buf[j + 1] = table[i + 1]
+        buf[j + 2] = table[i + 2]
+
+    def show(self):
+        """
+        Sends the frame to the LEDs, unless they're already showing it.
+        Returns whether it was sent.
+        """
+        if self.sent and self.np.buf == self.last:
+            self.skipped += 1
+            return False
+        self.np.write()
+        self.last[:] = self.np.buf
+        self.sent = True
+        self.writes += 1
+        return True
+
+    def stats(self):
+        """
+        Returns the frames sent to the LEDs and skipped as unchanged.
+        """
+        return {"writes": self.writes, "skipped": self.skipped}
+
+class Layer(FX_Base):
+    """
+    A layer of a Compositor's frame, for effects to draw on: a colour and an
+    opacity (0-255) for each pixel. Where nothing's drawn, the layer is
+    transparent. It's a device to the scheduler, running its own effects,
+    and is cleared when they're done.
+    """
+    def __init__(self, compositor, scheduler):
+        self.compositor = compositor
+        self.scheduler = scheduler
+        self.num_pixels = compositor.num_pixels
+        self.order = compositor.order
+        self.frame = bytearray(self.num_pixels * 3) # in the order the LEDs take them
+        self.alpha = bytearray(self.num_pixels)
+        self.visible = False # whether anything is drawn on it
+
+    def set_all(self, colour, alpha=255):
+        """
+        Sets all the pixels to a colour.
+        """
+        for i in range(self.num_pixels):
+            self.set_pixel(i, colour, alpha)
+
+    def set_pixel(self, pixel, colour, alpha=255):
+        """
+        Sets one pixel to a colour.
+        """
+        order = self.order
+        j = pixel * 3
+        self.frame[j + order[0]] = colour[0]
+        self.frame[j + order[1]] = colour[1]
+        self.frame[j + order[2]] = colour[2]
+        self.alpha[pixel] = alpha
+        self.visible = True
+
+    def fill(self, table, step, alpha=255):
+        """
+        Sets all the pixels to a colour from a frame table.
+        """
+        i = step * 3
+        a = table[i]
+        b = table[i + 1]
+        c = table[i + 2]
+        frame = self.frame
+        for j in range(0, self.num_pixels * 3, 3):
+            frame[j] = a
+            frame[j + 1] = b
+            frame[j + 2] = c
+        for pixel in range(self.num_pixels):
+            self.alpha[pixel] = alpha
+        self.visible = True
+
+    def put(self, pixel, table, step, alpha=255):
+        """
+        Sets one pixel to a colour from a frame table.
+        """
+        i = step * 3
+        j = pixel * 3
+        frame = self.frame
+        frame[j] = table[i]
+        frame[j + 1] = table[i + 1]
+        frame[j + 2] = table[i + 2]
+        self.alpha[pixel] = alpha
+        self.visible = True
+
+    def clear(self):
+        """
+        Makes all the pixels transparent.
+        """
+        for pixel in range(self.num_pixels):
+            self.alpha[pixel] = 0
+        self.visible = False
+
+    def show(self):
+        """
+        Shows the frame, with this layer as it is now.
+        """
+        self.compositor.show()
+
+    def update(self):
+        """
+        Clears the layer, once its effects are done.
+        """
+        if not self.fx_busy:
+            self.clear()
+            self.show()
+
+class Compositor:
+    """
+    Builds a strip's frame from layers: the base - the colour for the
+    player's state - with the Layers drawn over it, bottom to top. Layers
+    with nothing on them are skipped, so it costs a pass over the pixels
+    plus one for each layer in use; and the frame is only sent to the LEDs
+    once per scheduler tick (and then only if it's changed).
+    """
+    def __init__(self, strip, layers, scheduler):
+        """
+        strip: the Strip to show the frame on
+        layers: the number of layers over the base
+        scheduler: the FXScheduler running the layers' effects
+        """
+        self.strip = strip
+        self.scheduler = scheduler
+        self.num_pixels = strip.num_pixels
+        self.order = strip.order
+        self.base = bytearray(self.num_pixels * 3)
+        self.layers = [Layer(self, scheduler) for i in range(layers)]
+        self.composed = 0 # frames composed
+
+    def set_base(self, colour, pixel=None):
+        """
+        Sets the base (or one pixel of it) to a colour, and shows the frame.
+        """
+        order = self.order
+        base = self.base
+        a = order[0]
+        b = order[1]
+        c = order[2]
+        start = 0
+        end = self.num_pixels * 3
+        if pixel != None:
+            start = pixel * 3
+            end = start + 3
+        for j in range(start, end, 3):
+            base[j + a] = colour[0]
+            base[j + b] = colour[1]
+            base[j + c] = colour[2]
+        self.show()
+
+    def show(self):
+        """
+        Has the frame composed and shown, once the effects have rendered.
+        """
+        self.scheduler.redraw(self)
+
+    def compose(self):
+        """
+        Composes the frame into the strip's buffer, and shows it.
+        """
+        buf = self.strip.buf
+        buf[:] = self.base
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+            frame = layer.frame
+            alpha = layer.alpha
+            j = 0
+            for pixel in range(self.num_pixels):
+                a = alpha[pixel]
+                if a == 255:
+                    buf[j] = frame[j]
+                    buf[j + 1] = frame[j + 1]
+                    buf[j + 2] = frame[j + 2]
+                elif a != 0:
+                    buf[j] += (frame[j] - buf[j]) * a // 255
+                    buf[j + 1] += (frame[j + 1] - buf[j + 1]) * a // 255
+                    buf[j + 2] += (frame[j + 2] - buf[j + 2]) * a // 255
+                j += 3
+        self.composed += 1
+        self.strip.show()
+
 class RGB(FX_Base):
     """
     Provides special effects through a collection of WS2812B addressable LEDs.
     """
-    def __init__(self, rgb_pin, num_pixels, player):
+    def __init__(self, rgb_pin, num_pixels, player, scheduler=None):
         """
         Initialises the RGB.
 
         rgb_pin: the GPIO pin connecting the LEDs.
         num_pixels: the number of connected WS2812B addressable LEDs.
         player: the current player
+        scheduler: the FXScheduler to run its effects (by default, the shared one)
         """
         self.rgb_pin = rgb_pin 
         self.num_pixels = num_pixels 
         self.reload_time = DEFAULT_RELOAD_TIME
         self.base_colour = (0,0,0)
-        self.fx_busy = False # TODO: queue up special effects?
         self.player = player
+        if scheduler != None:
+            self.scheduler = scheduler
 
         self.np = NeoPixel(Pin(rgb_pin), num_pixels)
+        self.strip = Strip(self.np)
+        self.compositor = Compositor(self.strip, LAYERS, self.scheduler)
+        self.layers = self.compositor.layers
+        # the rainbow, and each pixel's place in it when cycling the rainbow
+        self.wheel = self._table([self._wheel(pos) for pos in range(256)])
+        self.offsets = bytearray(i * 256 // num_pixels for i in range(num_pixels))
+        self.compiled = None # the colour the frame tables were compiled for
+        self.tables = {}     # (start colour, end colour, curve): frame table
         self._set_all(self.base_colour)
 
+    @property
+    def fx_busy(self):
+        """
+        Is an effect running on any of the layers?
+        """
+        for layer in self.layers:
+            if layer.fx_busy:
+                return True
+        return False
+
     ############################################################################
     # Code implementing the special effects
     ############################################################################
@@ -267,9 +795,7 @@ class RGB(FX_Base):
 
         colour: the colour to set the pixels.
         """
-        for i in range(0,self.num_pixels):
-            self.np[i] = colour
-        self.np.write()
+        self.compositor.set_base(colour)
 
     def _set_pixel(self, colour, pixel):
         """
@@ -279,221 +805,199 @@ class RGB(FX_Base):
 
         pixel: the number of the pixel.
         """
-        self.np[pixel] = colour
-        self.np.write()
+        self.compositor.set_base(colour, pixel)
 
-    def _blip_all(self, duration, colour, lastfx):
+
+    def _table(self, colours):
+        """
+        Returns a frame table: the given colours, 3 bytes each, in the order
+        the LEDs take them.
+        """
+        order = self.strip.order
+        table = bytearray(len(colours) * 3)
+        for i in range(len(colours)):
+            for j in range(3):
+                table[i * 3 + order[j]] = colours[i][j]
+        return table
+
+    def _fade_table(self, start, end, curve):
+        """
+        Returns the frame table for a fade from one colour to another: the
+        colour at each of EASE_STEPS+1 steps.
+
+        start: the starting colour
+        end: the ending colour
+        curve: LINEAR, LOG_QUICK or LOG_SLOW
+        """
+        table = self.tables.get((start, end, curve))
+        if table == None:
+            ease = EASES[curve]
+            table = self._table([tuple(start[j] + (end[j] - start[j]) * e // 255 for j in range(3)) for e in ease])
+        return table
+
+    def compile(self):
+        """
+        Compiles the frame tables for the fades to and from the team colour,
+        once it's known (ie on joining a game or team), so that effects don't
+        have to work them out as they run.
+        """
+        colour = self.base_colour
+        if self.player != None and self.player.team != None:
+            colour = self.player.team.colour
+        if colour == self.compiled:
+            return
+        self.compiled = colour
+        tables = {}
+        for key in ((colour, BROWN, LOG_QUICK), (BROWN, colour, LOG_SLOW), # hit
+                (BLACK, colour, LOG_SLOW),                                  # activate
+                (colour, BLACK, LINEAR)):                                   # deactivate
+            tables[key] = self._fade_table(*key)
+        self.tables = tables
+
+    def _blip_all(self, layer, duration, colour):
         """
         Blips all the pixels on one colour, then off.
 
+        layer: the Layer to draw on
         duration: the time (seconds) for the pixels to be lit.
         colour: the colour for the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
-        self._set_all(colour)
-        sleep(duration)
-        self._set_all((0,0,0))
-
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        layer.set_all(colour)
+        layer.show()
+        yield _ms(duration)
+        layer.clear()
+        layer.show()
 
-    def _strobe_all(self, frequency, duration, colour, lastfx):
+    def _strobe_all(self, layer, frequency, duration, colour):
         """"
         Strobes all the pixels one colour.
 
+        layer: the Layer to draw on
         frequency: strobe rate (Hz)
         duration: the time (seconds) to keep strobing 
         colour: the colour for the pixels
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
-        halfcycle = (1/frequency)/2
+        halfcycle = _ms((1/frequency)/2)
+        table = self._table([colour, BLACK])
 
-        duration_ms = int(duration * 1000)
+        duration_ms = _ms(duration)
         start = time.ticks_ms()
-        end = time.ticks_add(start, duration_ms)
-        while (time.ticks_ms() < end):
-            self._set_all(colour)
-            sleep(halfcycle)
-            self._set_all((0,0,0))
-            sleep(halfcycle)
-        
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        while time.ticks_diff(time.ticks_ms(), start) < duration_ms:
+            layer.fill(table, 0)
+            layer.show()
+            yield halfcycle
+            layer.fill(table, 1)
+            layer.show()
+            yield halfcycle
 
-    def _calc_colour(self, start, end, progress):
+    def _fade(self, layer, duration, table, frequency):
         """
-        Calculates the colour for a given 'frame' fading from one colour to another.
+        Plays a fade from a frame table.
 
-        start: the starting colour
-        end: the ending colour 
-        progress: the progress made so far (float: 0=just starting, 1=finished)
+        layer: the Layer to draw on
+        duration: the time (seconds) to take for the fade
+        table: the fade's frame table (see _fade_table)
+        frequency: the rate (Hz) at which to update the pixels.
         """
-        r_dist = int(((end[0]-start[0]) * progress))
-        g_dist = int(((end[1]-start[1]) * progress))
-        b_dist = int(((end[2]-start[2]) * progress))
+        cycle = _ms(1/frequency)
+        duration_ms = _ms(duration)
+        start = time.ticks_ms()
+        spent = 0
+        while spent < duration_ms:
+            layer.fill(table, spent * EASE_STEPS // duration_ms)
+            layer.show()
+            yield cycle
+            spent = time.ticks_diff(time.ticks_ms(), start)
         
-        r = start[0] + r_dist
-        g = start[1] + g_dist
-        b = start[2] + b_dist
-        return (r,g,b)
+        layer.fill(table, EASE_STEPS)
+        layer.show()
 
-    def _fade_all(self, duration, start_colour, end_colour, frequency, lastfx):
+    def _fade_all(self, layer, duration, start_colour, end_colour, frequency):
         """
         Fade all pixels from one colour to another.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fade
         start_colour: the starting colour for the pixels
         end_colour: the ending colour for the pixels
         frequency: the rate (Hz) at which to update the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
-        cycle = 1/frequency 
-
-        self._set_all(start_colour)
-        duration_ms = int(duration * 1000)
-        start = time.ticks_ms()
-        end = time.ticks_add(start, duration_ms)
-        now = time.ticks_ms()
-        while (now < end):
-            spent = time.ticks_diff(now, start)
-            progress = spent/duration_ms
-            
-            new_colour = self._calc_colour(start_colour, end_colour, progress)
-            
-            self._set_all(new_colour)
-            time.sleep(cycle)
-            now = time.ticks_ms()
-        
-        self._set_all(end_colour)
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        yield from self._fade(layer, duration, self._fade_table(start_colour, end_colour, LINEAR), frequency)
     
-    def _fade_all_log(self, duration, start_colour, end_colour, frequency, lastfx, quickstart):
+    def _fade_all_log(self, layer, duration, start_colour, end_colour, frequency, quickstart):
         """
         Fade all pixels from one colour to another. Logarithmic
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fade
         start_colour: the starting colour for the pixels
         end_colour: the ending colour for the pixels
         frequency: the rate (Hz) at which to update the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         quickstart: True - will change quickly at the start, then slowly at the end.
             False - will change slowly at the start, then quickly at the end.
         """
-        self.fx_busy = True
-        cycle = 1/frequency 
-
-        self._set_all(start_colour)
-        duration_ms = int(duration * 1000)
-        start = time.ticks_ms()
-        end = time.ticks_add(start, duration_ms)
-        now = time.ticks_ms()
-        while (now < end):
-            spent = time.ticks_diff(now, start)
-            
-
-            linear = now - start + 1
-            if quickstart:
-                progress = math.log(linear, duration_ms)# * duration_ms
-            else:
-                n = duration_ms-linear 
-                progress = 1-math.log(duration_ms-linear+1, duration_ms)# * duration_ms
-            
-            
-            new_colour = self._calc_colour(start_colour, end_colour, progress)
-            
-            self._set_all(new_colour)
-            time.sleep(cycle)
-            now = time.ticks_ms()
-        
-        self._set_all(end_colour)
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
-    
-    
+        curve = LOG_QUICK if quickstart else LOG_SLOW
+        yield from self._fade(layer, duration, self._fade_table(start_colour, end_colour, curve), frequency)
 
-    def _fade_inout_all(self, duration, start_colour, target_colour, frequency, lastfx):
+    def _fade_inout_all(self, layer, duration, start_colour, target_colour, frequency):
         """
         Fade all pixels from one colour to another and back again.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fade
         start_colour: the starting colour for the pixels
         target_colour: the colour to fade the pixels to
         frequency: the rate (Hz) at which to update the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
-        self._fade_all(duration/2, start_colour, target_colour, frequency, False)
-        self._fade_all(duration/2, target_colour, start_colour, frequency, False)
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        yield from self._fade_all(layer, duration/2, start_colour, target_colour, frequency)
+        yield from self._fade_all(layer, duration/2, target_colour, start_colour, frequency)
 
-    def _fade_inout_all_log(self, duration, start_colour, target_colour, frequency, lastfx):
+    def _fade_inout_all_log(self, layer, duration, start_colour, target_colour, frequency):
         """
         Fade all pixels from one colour to another and back again. Logarithmic.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fade
         start_colour: the starting colour for the pixels
         target_colour: the colour to fade the pixels to
         frequency: the rate (Hz) at which to update the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
-        """
-        self.fx_busy = True
-        self._fade_all_log(duration/2, start_colour, target_colour, frequency, False, True)
-        self._fade_all_log(duration/2, target_colour, start_colour, frequency, False, False)
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        """
+        yield from self._fade_all_log(layer, duration/2, start_colour, target_colour, frequency, True)
+        yield from self._fade_all_log(layer, duration/2, target_colour, start_colour, frequency, False)
     
-    def _pulse_fade(self, duration, start_colour, target_colour, times, frequency, lastfx):
+    def _pulse_fade(self, layer, duration, start_colour, target_colour, times, frequency):
         """
         Fade all pixels from one colour to another and back, a specified number of times.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fade
         start_colour: the starting colour for the pixels.
         target_colour: the colour to fade the pixels to.
         times: the number of cycles to perform.
         frequency: the rate (Hz) at which to update the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
         for i in range(0,times):
-            self._fade_inout_all(duration/times, start_colour, target_colour, frequency, False)
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+            yield from self._fade_inout_all(layer, duration/times, start_colour, target_colour, frequency)
 
-    def _crossfade_random(self, duration, start_colour, end_colour, pulses, frequency, lastfx):
+    def _crossfade_random(self, layer, duration, start_colour, end_colour, pulses, frequency):
         """
         Fades from start to end, through a given number of random colours
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the effect
         start_colour: the starting colour for the pixels
         end_colour: the ending colour for the pixels
         pulses: the number of colours to fade through
         frequency: the number of times/second the RGB is updated
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
         for i in range(0,pulses):
             if i == pulses - 1:
                 # last time, go to the end colour
                 target = end_colour
             else:
                 target = (random.randint(0,255), random.randint(0,255), random.randint(0,255))
-            self._fade_all(duration/pulses, start_colour, target, frequency, False)
+            yield from self._fade_all(layer, duration/pulses, start_colour, target, frequency)
             start_colour = target
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
 
     def _wheel(self, pos):
         """
@@ -510,192 +1014,192 @@ class RGB(FX_Base):
         pos -= 170
         return (pos * 3, 0, 255 - pos * 3)
     
-    def _rainbow_all(self, duration, cycles, frequency, lastfx):
+    def _rainbow_all(self, layer, duration, cycles, frequency):
         """
         Cycles through the rainbow (red > green > blue) a specified number of times.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the effect
         cycles: the number of times to cycle through the full rainbow.
         frequency: the number of times/second the RGB is updated
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
-        self.fx_busy = True
-
+        cycle = _ms(1/frequency)
+        duration_ms = _ms(duration/cycles)
         for i in range(0,cycles):
-            cycle = 1/frequency
-
-            start_colour = (255,0,0) 
-
-            self._set_all(start_colour)
-            duration_ms = int(duration * 1000/cycles)
             start = time.ticks_ms()
-            end = time.ticks_add(start, duration_ms)
-            now = time.ticks_ms()
-            while (now < end):
-                spent = time.ticks_diff(now, start)
-                progress = spent/duration_ms
-                
-                new_colour = self._wheel(int(progress*255))
-                
-                self._set_all(new_colour)
-                time.sleep(cycle)
-                now = time.ticks_ms()
+            spent = 0
+            while spent < duration_ms:
+                layer.fill(self.wheel, spent * 255 // duration_ms)
+                layer.show()
+                yield cycle
+                spent = time.ticks_diff(time.ticks_ms(), start)
             
-        self._set_all((0,0,0))
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        layer.clear()
+        layer.show()
 
-    def _rainbow_cycle_all(self, duration, frequency, lastfx):
+    def _rainbow_cycle_all(self, layer, duration, frequency):
         """
-        Cycles through the rainbow (red > green > blue) a specified number of times.
+        Cycles the rainbow (red > green > blue) along the pixels, moving one
+        step every 1/frequency seconds.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the effect
-        cycles: the number of times to cycle through the full rainbow.
-        frequency: the number of times/second the RGB is updated
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
+        frequency: the number of steps/second the rainbow moves
         """
-        self.fx_busy = True
-
-        ctr = 0
-
-        j = 0
-
-        duration_ms = duration * 1000
+        duration_ms = _ms(duration)
         start = time.ticks_ms()
-        end = time.ticks_add(start, duration_ms)
-        now = start
-
-        wait = 1/frequency
-        while (now < end):
+        spent = 0
+
+        wait = _ms(1/frequency)
+        wheel = self.wheel
+        offsets = self.offsets
+        while spent < duration_ms:
+            # frames may come less often than steps, so go by the time spent
+            j = spent * frequency // 1000
             for i in range(self.num_pixels):
-                rc_index = (i * 256 // self.num_pixels) + j
-                self.np[i] = self._wheel(rc_index & 255)
-            self.np.write()
-            time.sleep(wait)
-            now = time.ticks_ms()
-            j += 1
-            if j > 255:
-                j = 0
-            
+                layer.put(i, wheel, (offsets[i] + j) & 255)
+            layer.show()
+            yield wait
+            spent = time.ticks_diff(time.ticks_ms(), start)
             
-        self._set_all((0,0,0))
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        layer.clear()
+        layer.show()
 
-    def _linear_fill(self, duration, direction, start_colour, end_colour, lastfx):
+    def _linear_fill(self, layer, duration, direction, start_colour, end_colour):
         """
         Sequentially changes the pixels, like a wipe or progress bar effect.
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fill.
         direction: 1 for forward, -1 for backward
         start_colour: the start colour of all the pixels.
         end_colour: the end colour of all the pixels.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
         # frequency: how many x per second do we update the colour
-        self.fx_busy = True
         # TODO: the actual linear fill...
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+        yield from ()
 
-    def _linear_pulse(self, duration, direction, background_colour, pixel_colour, lastfx)    :
+    def _linear_pulse(self, layer, duration, direction, background_colour, pixel_colour):
         """
         Sequentially 'moves' a lit pixel across a fixed background. 
 
+        layer: the Layer to draw on
         duration: the time (seconds) to take for the fill.
         direction: 1 for forward, -1 for backward
-        background_colour: the background colour of all the pixels.
+        background_colour: the background colour of all the pixels (None to
+            leave the layers beneath showing).
         pixel_colour: the colour of the lit pixel.
-        lastfx: indicates if this is the 'outer' effect - if true, self.fx_busy is turned Off at the end.
         """
+        duration_ms = _ms(duration)
+        time_per_pixel = duration_ms // self.num_pixels
+        table = self._table([background_colour or BLACK, pixel_colour])
 
-        self.fx_busy = True
-
-        time_per_pixel = duration / self.num_pixels 
-        # all on 
-        if direction == 1:
-            start = 0
-            step = 1
-            stop = self.num_pixels
+        start = time.ticks_ms()
+        spent = 0
+        while spent < duration_ms:
+            # frames may come less often than pixels, so go by the time spent
+            pixel = spent * self.num_pixels // duration_ms
+            if direction != FORWARD:
+                pixel = self.num_pixels - 1 - pixel
+            if background_colour == None:
+                layer.clear()
+            else:
+                layer.fill(table, 0)
+            layer.put(pixel, table, 1)
+            layer.show()
+            yield time_per_pixel
+            spent = time.ticks_diff(time.ticks_ms(), start)
+        if background_colour == None:
+            layer.clear()
         else:
-            start = self.num_pixels-1
-            step = -1
-            stop = -1
-
-        self._set_all(background_colour)
-        for i in range(start,stop,step):
-            self._set_pixel(pixel_colour,i)
-            sleep(time_per_pixel)
-            self._set_pixel(background_colour,i)
-            
-        if lastfx: 
-            self.fx_busy = False
-            self.update()
+            layer.fill(table, 0)
+        layer.show()
+
+    def _shimmer(self, layer, colour, frequency):
+        """
+        Shimmers the pixels with a colour, at random strengths, over the
+        layers beneath - for as long as the player is shielded.
+
+        layer: the Layer to draw on
+        colour: the colour to shimmer with
+        frequency: the rate (Hz) at which to update the pixels.
+        """
+        cycle = _ms(1/frequency)
+        while self.player != None and self.player.state & SHIELDED == SHIELDED:
+            for i in range(self.num_pixels):
+                layer.set_pixel(i, colour, random.getrandbits(7))
+            layer.show()
+            yield cycle
 
 
     ############################################################################
     # Externally-invoked methods
     ############################################################################
-    # TODO: should each of these not check self.fx_busy first?
     def fire(self):
         """
-        RGB effect for when the gun is fired. A quick linear pulse, background
-        is the team colour, the 'lit' pixel is black.
+        RGB effect for when the gun is fired. A quick linear pulse of a red
+        pixel, over whatever's showing.
         """
-        # a quick _linear_pulse as described
-        fx_time = 0.05
-        _thread.start_new_thread(self._linear_pulse, (0.05, FORWARD, self.player.team.colour, RED,True))
+        layer = self.layers[LAYER_FIRE]
+        layer.play(self._linear_pulse(layer, 0.05, FORWARD, None, RED), FX_NORMAL)
     
     def bootup(self):
         """
         RGB effect for when the gun boots up. Strobes white for one second
         """
-        _thread.start_new_thread(self._strobe_all, (10, 1, WHITE, True))
+        layer = self.layers[LAYER_ANIMATION]
+        layer.play(self._strobe_all(layer, 10, 1, WHITE), FX_LOW)
 
     def connected(self):
         """
         RGB effect for when the gun is connected to the network. Strobes green 
         for one second
         """
-        _thread.start_new_thread(self._strobe_all, (10, 1, GREEN, True))
+        layer = self.layers[LAYER_ANIMATION]
+        layer.play(self._strobe_all(layer, 10, 1, GREEN), FX_LOW)
 
     def firefail(self):
         """
         RGB effect for when firing fails (eg out of ammo). Strobes red for 
         half a second.
         """
-        _thread.start_new_thread(self._strobe_all, (10, 0.5, RED, True))
+        layer = self.layers[LAYER_ANIMATION]
+        layer.play(self._strobe_all(layer, 10, 0.5, RED), FX_NORMAL)
         
     def reload(self):
         """
-        RGB effect for while the gun is reloading. Cycles through the rainbow
-        five times.
+        RGB effect for while the gun is reloading. Cycles the rainbow along
+        the pixels for the reload time.
         """
-        start_colour = (0,0,0)
-        end_colour = (0, 0, 0)
-
-        _thread.start_new_thread(self._rainbow_cycle_all, (self.reload_time, 1000, True))
-        pass
+        layer = self.layers[LAYER_ANIMATION]
+        layer.play(self._rainbow_cycle_all(layer, self.reload_time, 1000), FX_NORMAL)
     def hit(self):
-        _thread.start_new_thread(self._fade_inout_all_log, (1, self.player.team.colour, BROWN, 50, True))
+        self.compile()
+        layer = self.layers[LAYER_HIT]
+        layer.play(self._fade_inout_all_log(layer, 1, self.player.team.colour, BROWN, 50), FX_HIGH)
     def powerup(self):
         # TODO: implement powerup sfx - not needed for prototype?
         pass
     def activate(self):
-        _thread.start_new_thread(self._fade_all_log, (1, BLACK, self.player.team.colour, 50, True, False))
-        pass
+        self.compile()
+        layer = self.layers[LAYER_ANIMATION]
+        layer.play(self._fade_all_log(layer, 1, BLACK, self.player.team.colour, 50, False), FX_LOW)
     def deactivate(self):
-        _thread.start_new_thread(self._fade_all, (1, self.player.team.colour, BLACK, 50, True))
-        pass
+        self.compile()
+        layer = self.layers[LAYER_ANIMATION]
+        layer.play(self._fade_all(layer, 1, self.player.team.colour, BLACK, 50), FX_LOW)
     def shield(self):
-        # TODO: implement shield SFX - pulsating with white/team colour?
-        pass
+        """
+        RGB effect for while the player is shielded: a white shimmer over
+        the shield colour.
+        """
+        layer = self.layers[LAYER_SHIELD]
+        if not layer.fx_busy:
+            layer.play(self._shimmer(layer, WHITE, 20), FX_LOW)
     def unshield(self):
-        # TODO: implement unshield SFX
-        pass
+        layer = self.layers[LAYER_SHIELD]
+        self.scheduler.cancel(layer)
+        layer.update()
     
     def handlestatechange(self, state):
         self.update()
@@ -703,34 +1207,34 @@ class RGB(FX_Base):
     def update(self):
         """
         Called on state changes to ensure we are showing the right colour.
-        Does nothing if fx_busy is True; the effect will call update again
-        when it is finished.
+        Sets the base of the frame, so it shows beneath any effects running,
+        and once they're done.
 
         player: the player object (for access to current state)
         """
-        if not self.fx_busy:
-            if self.player == None:
-                self._set_all(self.base_colour)
-            elif self.player.team == None:
-                self._set_all(self.base_colour)
-            else:
-                colour = self.player.team.colour
+        if self.player == None:
+            self._set_all(self.base_colour)
+        elif self.player.team == None:
+            self._set_all(self.base_colour)
+        else:
+            colour = self.player.team.colour
 
-                # check for state-specific colour changes
-                if self.player.state & UP == 0: # not up, no colour
-                    colour = BLACK
+            # check for state-specific colour changes
+            if self.player.state & UP == 0: # not up, no colour
+                colour = BLACK
 
-                if self.player.state & ALIVE == 0: # not alive, no colour
-                    colour = BLACK
-                
-                if self.player.state & KICKED == KICKED: # kicked, no colour
-                    colour = BLACK
+            if self.player.state & ALIVE == 0: # not alive, no colour
+                colour = BLACK
+            
+            if self.player.state & KICKED == KICKED: # kicked, no colour
+                colour = BLACK
 
-                if self.player.state & SHIELDED == SHIELDED: # shielded - orange
-                    colour = ORANGE
-                self._set_all(colour)
-        else:
-            pass
+            if self.player.state & SHIELDED == SHIELDED: # shielded - orange
+                colour = ORANGE
+            self._set_all(colour)
 
     def close(self):
-        self._set_all(BLACK)
\ No newline at end of file
+        for layer in self.layers:
+            self.scheduler.cancel(layer)
+            layer.clear()
+        self._set_all(BLACK)
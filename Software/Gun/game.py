@@ -26,7 +26,8 @@
 # ALL network comms to be handled by the Game
 # TODO Free-For-All Game class
 ########################################################################
-        
+import hitcodec
+
 class Hit:
     """
     Represents a hit
@@ -48,20 +49,34 @@ class Hit:
         msg = "["+str(self.shooterteam)+","+str(self.shooter)+","+str(self.victimteam)+","+str(self.victim)+","+str(self.sensor)+"]"
         return msg
 
+    def packed(self, seq, timestamp):
+        """
+        Returns the hit in the binary encoding (see hitcodec.py)
+
+        seq: the message sequence number
+        timestamp: the time of the hit (ms)
+        """
+        return hitcodec.pack_hit(self.shooterteam, self.shooter, self.victimteam, self.victim, self.sensor, seq, timestamp)
+
 class Game:
     """
     Base class for implementing a Game. To create a specific Game, subclass this.
     """
-    def __init__(self, stramash):
+    def __init__(self, stramash, gameid=None, name=None):
         """
         Initialises the game. Subclasses should invoke this via super().__init__()
         in order to get the networking etc hooked up.
+
+        stramash: the StramashClient
+        gameid: the unique identifier of the game
+        name: the name of the game
         """
+        self.stramash = stramash
+        self.id = gameid
+        self.name = name
         # TODO: hookup callbacks to stramash
         # TODO: kick off a thread to sleep until game end, and then call the game end code
 
-        pass 
-
 
     ############################################################################
     # Pre Game Start
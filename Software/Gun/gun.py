@@ -56,6 +56,7 @@ class Gun:
         self.onfire = None # set this to get called back when the fire button is pressed
         self.onreload = None # set this to get called back when the reload button is pressed
         self.onoutofammo = None # set this to get called back when the gun is out of ammo
+        self.onreloadcomplete = None # set this to get called back when reloading is done
 
         # configure hardware
         self.activate_buttons(fire_pin, reload_pin)
@@ -0,0 +1,402 @@
+# guntest.py
+# Tests of the gun firmware, run on the host under emulation:
+# python -m unittest guntest
+
+import unittest
+import emulation
+emulation.install()
+
+from player import *
+from fx import *
+from gun import Gun
+from sensor import Sensor
+from wifi import WiFi
+from ir_rx.nec import NEC_8
+
+FIRE_PIN = 12
+RELOAD_PIN = 13
+IR_SEND_PIN = 14
+SENSOR_PIN = 15
+LASER_PIN = 16
+RGB_PIN = 17
+
+BLOCK_TIME = 100 # ms, longer than the NEC receiver takes to decode a frame
+
+def make_player(playerid, teamnumber, playernumber, colour=(128,0,0)):
+    player = Player(playerid)
+    player.fx = FX()
+    player.assign(Team(teamnumber, playernumber, colour, "Team "+str(teamnumber)))
+    player.joingame("Test Game")
+    player.up()
+    return player
+
+class GunTests(unittest.TestCase):
+    def setUp(self):
+        self.board = emulation.reset()
+        self.shooter = make_player("shooter", 2, 3)
+        self.gun = Gun(FIRE_PIN, RELOAD_PIN, IR_SEND_PIN, self.shooter.fx, self.shooter, 3, 0.01)
+
+    def fire(self):
+        self.board.pins[FIRE_PIN].press()
+
+    def sent(self):
+        return self.board.rmts[0].sent
+
+    def target(self, teamnumber, playernumber, pin=SENSOR_PIN):
+        victim = make_player("victim"+str(pin), teamnumber, playernumber)
+        sensor = Sensor(pin, 1, "gun", victim, victim.fx)
+        return victim, sensor
+
+    def beam(self, pulses, pin=SENSOR_PIN):
+        # the IR from a gun arriving at a sensor, and the receiver's block
+        # timer running out
+        self.board.pins[pin].pulses(pulses)
+        self.board.clock.advance(BLOCK_TIME)
+
+    # --------------------------------------------------------------------------
+    # EMULATION TESTS
+    # --------------------------------------------------------------------------
+    def test_emulated_timer(self):
+        from machine import Timer
+        ticks = []
+        periodic = Timer(0)
+        periodic.init(period=10, callback=lambda t: ticks.append("periodic"))
+        Timer(1).init(mode=Timer.ONE_SHOT, period=25, callback=lambda t: ticks.append("once"))
+        self.board.clock.advance(45)
+        self.assertEqual(ticks, ["periodic", "periodic", "once", "periodic", "periodic"])
+        periodic.deinit()
+        self.board.clock.advance(100)
+        self.assertEqual(len(ticks), 5)
+
+    def test_emulated_ticks(self):
+        import time
+        start = time.ticks_ms()
+        self.board.clock.advance(1000)
+        self.assertGreaterEqual(time.ticks_diff(time.ticks_ms(), start), 1000)
+        self.assertEqual(time.ticks_diff(time.ticks_add(emulation.TICKS_MAX, 5), emulation.TICKS_MAX), 5)
+
+    def test_wifi(self):
+        self.board.add_access_point("Stramash", "secret", rssi=-40)
+        wifi = WiFi("Stramash", "secret")
+        wifi.connect()
+        self.assertTrue(wifi.sta_if.isconnected())
+        self.assertEqual(wifi.sta_if.config("essid"), "Stramash")
+
+    # --------------------------------------------------------------------------
+    # FIRE TESTS
+    # --------------------------------------------------------------------------
+    def test_fire(self):
+        fired = []
+        self.gun.onfire = lambda: fired.append(True)
+        self.fire()
+        self.assertEqual(self.gun.ammo, 2)
+        self.assertEqual(self.gun.firecounter, 1)
+        self.assertEqual(len(fired), 1)
+
+        # one NEC frame: leader, 32 bits and a stop burst, marks first
+        self.assertEqual(len(self.sent()), 1)
+        ms, level, pulses = self.sent()[-1]
+        self.assertEqual(level, 1)
+        self.assertEqual(len(pulses), 67)
+        self.assertEqual(pulses[:2], (9000, 4500))
+
+    def test_fire_not_allowed(self):
+        self.shooter.down()
+        self.fire()
+        self.assertEqual(self.gun.ammo, 3)
+        self.assertEqual(len(self.sent()), 0)
+
+    def test_out_of_ammo(self):
+        empty = []
+        self.gun.onoutofammo = lambda: empty.append(True)
+        for i in range(4):
+            self.fire()
+        self.assertEqual(self.gun.ammo, 0)
+        self.assertEqual(len(self.sent()), 3)
+        self.assertEqual(len(empty), 1)
+
+    def test_reload(self):
+        import time
+        done = []
+        self.gun.onreloadcomplete = lambda: done.append(True)
+        self.fire()
+        self.board.pins[RELOAD_PIN].press()
+        self.assertTrue(self.gun.reloading)
+        self.fire() # can't fire while reloading
+        self.assertEqual(self.gun.ammo, 2)
+        deadline = time.time() + 2
+        while len(done) == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.gun.reloading)
+        self.assertEqual(self.gun.ammo, 3)
+
+    # --------------------------------------------------------------------------
+    # HIT TESTS
+    # --------------------------------------------------------------------------
+    def test_hit(self):
+        victim, sensor = self.target(4, 1)
+        hits = []
+        sensor.onhit = hits.append
+        self.fire()
+        self.beam(self.sent()[-1][2])
+        self.assertEqual(len(hits), 1)
+        hit = hits[0]
+        self.assertEqual((hit.shooterteam, hit.shooter), (2, 3))
+        self.assertEqual((hit.victimteam, hit.victim, hit.sensor), (4, 1, 1))
+        self.assertEqual(len(sensor.hits), 1)
+
+    def test_friendly_fire(self):
+        victim, sensor = self.target(2, 1)
+        hits = []
+        friendly = []
+        sensor.onhit = hits.append
+        sensor.onfriendlyfire = friendly.append
+        self.fire()
+        self.beam(self.sent()[-1][2])
+        self.assertEqual(len(hits), 0)
+        self.assertEqual(len(friendly), 1)
+
+    def test_hit_shielded(self):
+        victim, sensor = self.target(4, 1)
+        hits = []
+        sensor.onhit = hits.append
+        victim.shield()
+        self.fire()
+        self.beam(self.sent()[-1][2])
+        self.assertEqual(len(hits), 0)
+        victim.unshield()
+        self.beam(self.sent()[-1][2])
+        self.assertEqual(len(hits), 1)
+
+    def test_rejoin(self):
+        player = Player("rejoiner")
+        player.fx = FX()
+        changes = []
+        player.onstatechanged = changes.append
+        snapshot = {"game": {"id": "g1", "name": "Game"}, "team": {"name": "Reds"},
+                    "player": {"name": "P", "teamnumber": 2, "playernumber": 4, "colour": [128, 0, 0]},
+                    "condition": "shielded"}
+        player.rejoin(snapshot)
+        self.assertEqual((player.team.team, player.team.player, player.team.teamname), (2, 4, "Reds"))
+        self.assertEqual(player.game, "g1")
+        self.assertEqual(player.state & (INGAME | INTEAM | UP | SHIELDED), INGAME | INTEAM | UP | SHIELDED)
+        # a republish of the same snapshot changes nothing
+        count = len(changes)
+        player.rejoin(snapshot)
+        self.assertEqual(len(changes), count)
+        snapshot["condition"] = "down"
+        player.rejoin(snapshot)
+        self.assertEqual(player.state & UP, 0)
+        self.assertEqual(player.team.team, 2)
+
+    def test_hit_corrupted(self):
+        victim, sensor = self.target(4, 1)
+        hits = []
+        errors = []
+        sensor.onhit = hits.append
+        sensor.ir.error_function(errors.append)
+        self.fire()
+        pulses = list(self.sent()[-1][2])
+        pulses[41] = 1687 if pulses[41] < 1000 else 563 # flip a bit of the data
+        self.beam(pulses)
+        self.beam(pulses[:40]) # truncated
+        self.assertEqual(len(hits), 0)
+        self.assertEqual(errors, [NEC_8.BADDATA, NEC_8.BADBLOCK])
+
+    # --------------------------------------------------------------------------
+    # FX TESTS
+    # --------------------------------------------------------------------------
+    def test_laser(self):
+        laser = Laser(LASER_PIN, 1000, self.shooter)
+        pwm = self.board.pwms[LASER_PIN]
+        self.assertEqual(pwm.duty(), 0)
+        laser.on()
+        self.assertEqual(pwm.duty(), 1000)
+        laser.off()
+        self.assertEqual([duty for ms, freq, duty in pwm.log][-2:], [1000, 0])
+
+    def test_rgb(self):
+        rgb = RGB(RGB_PIN, 4, self.shooter)
+        np = self.board.neopixels[RGB_PIN]
+        rgb.update()
+        self.assertEqual(np.pixels(), [(128,0,0)] * 4)
+        self.assertEqual(np.buf[:3], bytearray((0,128,0))) # GRB
+        self.shooter.state |= SHIELDED
+        rgb.update()
+        self.assertEqual(np.pixels(), [ORANGE] * 4)
+
+    def test_rgb_unchanged(self):
+        rgb = RGB(RGB_PIN, 4, self.shooter)
+        np = self.board.neopixels[RGB_PIN]
+        writes = np.writes
+        rgb.update()
+        self.assertEqual(np.writes, writes + 1)
+
+        # state changes that leave the colour as it is aren't sent to the LEDs
+        self.shooter.state |= INGAME
+        rgb.update()
+        rgb.update()
+        self.assertEqual(np.writes, writes + 1)
+        self.assertEqual(rgb.strip.stats(), {"writes": writes + 1, "skipped": 2})
+        rgb._set_pixel(RED, 2)
+        self.assertEqual(np.writes, writes + 2)
+        self.assertEqual(np.pixels()[1:3], [(128,0,0), RED])
+
+    def test_fx_scheduler(self):
+        scheduler = FXScheduler()
+        laser = Laser(LASER_PIN, 1000, self.shooter, scheduler)
+        rgb = RGB(RGB_PIN, 4, self.shooter, scheduler)
+        rgb.reload_time = 2
+        np = self.board.neopixels[RGB_PIN]
+        pwm = self.board.pwms[LASER_PIN]
+        clock = self.board.clock
+        rgb.update() # as the player's state changes do
+
+        # the laser and RGB effects run side by side, from one timer
+        laser.fire()
+        rgb.reload()
+        clock.advance(100)
+        self.assertTrue(laser.fx_busy)
+        self.assertTrue(rgb.fx_busy)
+        self.assertEqual(pwm.duty(), 1000)
+        self.assertNotEqual(np.pixels(), [(128,0,0)] * 4)
+        clock.advance(200)
+        self.assertFalse(laser.fx_busy)
+        self.assertEqual(pwm.duty(), 0)
+
+        # a hit is drawn over the reload animation, which carries on beneath
+        animation = rgb.layers[LAYER_ANIMATION]
+        hit = rgb.layers[LAYER_HIT]
+        rgb.hit()
+        clock.advance(100)
+        self.assertTrue(hit.fx_busy)
+        self.assertTrue(animation.fx_busy)
+        self.assertEqual(np.buf, hit.frame)
+        clock.advance(1000)
+        self.assertFalse(hit.fx_busy)
+        self.assertTrue(rgb.fx_busy)
+
+        # within a layer, effects queue, or pre-empt lower priority ones
+        rgb.bootup()
+        rgb.hit()
+        rgb.hit()
+        self.assertEqual(len(scheduler.queues[animation]), 1)
+        self.assertEqual(len(scheduler.queues[hit]), 1)
+        self.assertEqual(scheduler.stats()["preempted"], 0)
+        clock.advance(2500)
+        rgb.activate()
+        rgb.reload()
+        self.assertEqual(scheduler.stats()["preempted"], 1)
+        clock.advance(3500)
+
+        # and once the effects are done, the player's state shows through
+        self.assertFalse(rgb.fx_busy)
+        self.assertEqual(np.pixels(), [(128,0,0)] * 4)
+        stats = scheduler.stats()
+        self.assertGreater(stats["frames"], 50)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertIsNone(scheduler.timer.seq) # the timer stops when idle
+
+    def test_fx_tables(self):
+        for ease in EASES:
+            self.assertEqual((ease[0], ease[EASE_STEPS]), (0, 255))
+            self.assertEqual(list(ease), sorted(ease))
+        middle = EASE_STEPS // 4
+        self.assertGreater(EASES[LOG_QUICK][middle], EASES[LINEAR][middle])
+        self.assertGreater(EASES[LINEAR][middle], EASES[LOG_SLOW][middle])
+
+        # the tables are compiled when the team colour is known
+        scheduler = FXScheduler()
+        rgb = RGB(RGB_PIN, 4, self.shooter, scheduler)
+        self.shooter.fx.add(rgb)
+        self.shooter.assign(Team(5, 1, (0,0,200), "Blue"))
+        self.assertEqual(rgb.compiled, (0,0,200))
+        hit = rgb.tables[((0,0,200), BROWN, LOG_QUICK)]
+        self.assertEqual(rgb._fade_table((0,0,200), BROWN, LOG_QUICK), hit)
+        self.assertEqual(hit[:3], bytearray((0,0,200))) # GRB
+        self.assertEqual(hit[-3:], bytearray((10,32,0)))
+
+        # effects are played from them
+        np = self.board.neopixels[RGB_PIN]
+        rgb.hit()
+        self.board.clock.advance(100)
+        frames = [hit[i:i+3] for i in range(0, len(hit), 3)]
+        self.assertIn(np.buf[:3], frames)
+        self.assertNotIn(np.buf[:3], (hit[:3], hit[-3:]))
+        self.board.clock.advance(1000)
+        self.assertEqual(np.pixels(), [(0,0,200)] * 4)
+
+        frames = rgb._rainbow_cycle_all(rgb.layers[LAYER_ANIMATION], 1, 100)
+        next(frames)
+        self.assertEqual(np.pixels(), [rgb._wheel(i * 64) for i in range(4)])
+
+    def test_rgb_layers(self):
+        scheduler = FXScheduler()
+        rgb = RGB(RGB_PIN, 4, self.shooter, scheduler)
+        np = self.board.neopixels[RGB_PIN]
+        clock = self.board.clock
+        rgb.update()
+
+        # the fire pulse is drawn over the team colour, rather than blanking it
+        rgb.fire()
+        clock.advance(FX_MIN_FRAME)
+        self.assertEqual(np.pixels(), [RED] + [(128,0,0)] * 3)
+
+        # the base follows the player's state, even while effects run over it,
+        # and the shield shimmers over it
+        self.shooter.shield()
+        rgb.shield()
+        rgb.update()
+        self.assertEqual(rgb.compositor.base[:3], bytearray((128,255,0))) # GRB
+        clock.advance(100)
+        self.assertFalse(rgb.layers[LAYER_FIRE].fx_busy)
+        for r, g, b in np.pixels():
+            self.assertEqual(r, 255)
+            self.assertGreaterEqual(g, 128)
+            self.assertEqual(g - 128, b * 127 // 255)
+
+        # however many effects draw on it, the frame's sent once a tick
+        rgb.hit()
+        rgb.fire()
+        rgb.reload()
+        writes = rgb.strip.writes
+        composed = rgb.compositor.composed
+        ticks = scheduler.ticks
+        clock.advance(200)
+        self.assertEqual(rgb.compositor.composed - composed, scheduler.ticks - ticks)
+        self.assertLessEqual(rgb.strip.writes - writes, scheduler.ticks - ticks)
+
+        self.shooter.unshield()
+        rgb.unshield()
+        rgb.update()
+
+        # a blip draws on its layer, and leaves it transparent when it's done
+        clock.advance(5000)
+        self.assertFalse(rgb.fx_busy)
+        layer = rgb.layers[LAYER_ANIMATION]
+        scheduler.start(layer, rgb._blip_all(layer, 0.05, WHITE))
+        clock.advance(FX_MIN_FRAME)
+        self.assertEqual(np.pixels(), [WHITE] * 4)
+        clock.advance(100)
+        self.assertFalse(layer.visible)
+        self.assertEqual(np.pixels(), [(128,0,0)] * 4)
+
+        rgb.close()
+        self.assertFalse(rgb.fx_busy)
+        self.assertEqual(np.pixels(), [BLACK] * 4)
+
+    def test_fx_queue(self):
+        scheduler = FXScheduler(queue_size=2)
+        laser = Laser(LASER_PIN, 1000, self.shooter, scheduler)
+        for i in range(4):
+            laser.blip(0.1)
+        self.assertEqual(scheduler.stats()["dropped"], 1)
+        self.board.clock.advance(250)
+        self.assertTrue(laser.fx_busy)
+        self.board.clock.advance(100)
+        self.assertFalse(laser.fx_busy)
+        blips = [duty for ms, freq, duty in self.board.pwms[LASER_PIN].log if duty == 1000]
+        self.assertEqual(len(blips), 3)
+
+if __name__ == '__main__':
+    unittest.main()
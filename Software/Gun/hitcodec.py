@@ -0,0 +1,88 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# hitcodec.py
+# Fixed-width binary encoding for the high-frequency hit and fire messages.
+#
+# hit (12 bytes):  0xB1, shooterteam, shooter, victimteam, victim, sensor,
+#                  seq (uint16), timestamp (uint32, ms)
+# fire (9 bytes):  0xB2, team, player, seq (uint16), timestamp (uint32, ms)
+#
+# All multi-byte fields are big-endian. The first byte can never start a
+# JSON message, so binary and JSON messages can share a topic.
+#
+# This file is shared by the server and the gun (MicroPython), so keep it
+# to the subset of Python both support.
+# ----------------------------------------------------------------------
+import struct
+
+HIT_MAGIC = 0xB1
+FIRE_MAGIC = 0xB2
+
+HIT_FORMAT = ">BBBBBBHI"
+FIRE_FORMAT = ">BBBHI"
+HIT_SIZE = struct.calcsize(HIT_FORMAT)
+FIRE_SIZE = struct.calcsize(FIRE_FORMAT)
+
+# the encodings the server accepts, as announced on stramash/server/encodings
+JSON = "json"
+BINARY = "binary"
+
+def is_binary(payload):
+    """
+    Returns True if the message is binary-encoded, False for JSON.
+    """
+    return len(payload) > 0 and payload[0] >= 0x80
+
+def pack_hit(shooterteam, shooter, victimteam, victim, sensor, seq, timestamp):
+    """
+    Encodes a hit.
+
+    seq: the sender's message sequence number (wraps at 65536)
+    timestamp: the sender's clock (ms) when the hit was recorded
+    """
+    return struct.pack(HIT_FORMAT, HIT_MAGIC, shooterteam, shooter, victimteam, victim, sensor,
+        seq & 0xFFFF, timestamp & 0xFFFFFFFF)
+
+def unpack_hit(payload):
+    """
+    Decodes a hit, returning (shooterteam, shooter, victimteam, victim,
+    sensor, seq, timestamp). Raises ValueError if it isn't a binary hit.
+    """
+    if len(payload) != HIT_SIZE or payload[0] != HIT_MAGIC:
+        raise ValueError("Not a binary hit")
+    return struct.unpack(HIT_FORMAT, payload)[1:]
+
+def pack_fire(team, player, seq, timestamp):
+    """
+    Encodes a fire.
+
+    team: the team number of the player who fired
+    player: the player number of the player who fired
+    seq: the sender's message sequence number (wraps at 65536)
+    timestamp: the sender's clock (ms) when the gun was fired
+    """
+    return struct.pack(FIRE_FORMAT, FIRE_MAGIC, team, player, seq & 0xFFFF, timestamp & 0xFFFFFFFF)
+
+def unpack_fire(payload):
+    """
+    Decodes a fire, returning (team, player, seq, timestamp). Raises
+    ValueError if it isn't a binary fire.
+    """
+    if len(payload) != FIRE_SIZE or payload[0] != FIRE_MAGIC:
+        raise ValueError("Not a binary fire")
+    return struct.unpack(FIRE_FORMAT, payload)[1:]
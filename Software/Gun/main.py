@@ -91,6 +91,14 @@ stramash = StramashClient(id, server_address, wifi_ssid, wifi_key)
 # TODO: hook ongamejoined callback from stramash client and use it to 
 # 'save' the game and populate its gun, sensor, player
 
+def rehydrate(snapshot):
+    # pick up where we left off (eg after a reboot) from the snapshot the
+    # server keeps for us; the client has already rejoined its game
+    player.rejoin(snapshot)
+stramash.onsnapshot = rehydrate
+# our snapshot is cleared when the game (or we) are deleted
+stramash.ongamedeleted = player.leavegame
+
 # indicate network connected
 rgb.base_colour = GREEN
 rgb.connected()
@@ -45,6 +45,7 @@ class Player:
         self.playerid = playerid 
         self.name = ""
         self.team = None
+        self.game = None
         self.state = ALIVE
         self.onstatechanged = None
         self.fx = None
@@ -91,6 +92,8 @@ class Player:
         """
         self.game = game
         self.state |= INGAME
+        if self.fx != None:
+            self.fx.compile() # ready the effects for our team colour
         self._triggerstatechange() # trigger state change callback
 
     def leavegame(self):
@@ -117,6 +120,8 @@ class Player:
         """
         self.team = team 
         self.state |= INTEAM
+        if self.fx != None:
+            self.fx.compile() # ready the effects for our team colour
         self._triggerstatechange() # trigger state change callback
 
     def up(self):
@@ -155,3 +160,33 @@ class Player:
             self.fx.activate()
         self._triggerstatechange() # trigger state change callback
 
+    def rejoin(self, snapshot):
+        """
+        Picks up where we left off (eg after a reboot) from the snapshot the
+        server keeps for us. The server republishes it as the game goes on,
+        so only what has changed is applied.
+
+        snapshot: our player snapshot (see NetworkProtocol.md), as a dict
+        """
+        state = snapshot["player"]
+        teamname = snapshot["team"]["name"] if snapshot["team"] != None else state["name"]
+        team = (state["teamnumber"], state["playernumber"], tuple(state["colour"]), teamname)
+        if self.team == None or (self.team.team, self.team.player, self.team.colour, self.team.teamname) != team:
+            self.assign(Team(*team))
+        gameid = snapshot["game"]["id"]
+        if (self.state & INGAME) == 0 or self.game != gameid:
+            self.joingame(gameid)
+
+        # the condition is as for the server's up and down messages
+        condition = snapshot.get("condition", "up")
+        if condition == "up" or condition == "shielded":
+            if (self.state & UP) == 0:
+                self.up()
+            shielded = (self.state & SHIELDED) == SHIELDED
+            if condition == "shielded" and not shielded:
+                self.shield()
+            elif condition == "up" and shielded:
+                self.unshield()
+        elif (self.state & UP) == UP:
+            self.down()
+
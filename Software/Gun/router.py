@@ -0,0 +1,99 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# router.py
+# Provides TopicRouter, which maps MQTT topics onto their handlers.
+#
+# Topic patterns are written as in NetworkProtocol.md, eg
+#     stramash/game/<gameid>/hit
+# and compiled into a trie with one level per topic level, so matching a
+# topic costs one dict lookup per level however many patterns (or games)
+# there are. Each <name> level matches any single topic level, and is
+# returned as a parameter.
+#
+# This file is shared by the server and the gun (MicroPython), so keep it
+# to the subset of Python both support.
+# ----------------------------------------------------------------------
+
+class _Node:
+    def __init__(self):
+        self.children = {} # literal topic level -> _Node
+        self.param = None # name of the <param> level below this one
+        self.param_node = None
+        self.handler = None
+
+class TopicRouter:
+    """
+    Maps MQTT topics to handlers, extracting <param> levels on the way.
+    """
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, pattern, handler):
+        """
+        Adds a route.
+
+        pattern: the topic pattern, eg "stramash/game/<gameid>/hit"
+        handler: the handler for topics matching the pattern
+        """
+        node = self.root
+        for level in pattern.split("/"):
+            if level.startswith("<") and level.endswith(">"):
+                name = level[1:-1]
+                if node.param_node == None:
+                    node.param = name
+                    node.param_node = _Node()
+                elif node.param != name:
+                    raise ValueError("Conflicting parameter names in "+pattern)
+                node = node.param_node
+            else:
+                child = node.children.get(level)
+                if child == None:
+                    child = _Node()
+                    node.children[level] = child
+                node = child
+        node.handler = handler
+
+    def match(self, topic):
+        """
+        Finds the handler for a topic. Literal levels take precedence over
+        <param> levels. Returns (handler, params), or (None, None) if no
+        route matches.
+
+        topic: the MQTT topic
+        """
+        params = {}
+        node = self._match(self.root, topic.split("/"), 0, params)
+        if node == None:
+            return (None, None)
+        return (node.handler, params)
+
+    def _match(self, node, levels, i, params):
+        if i == len(levels):
+            return node if node.handler != None else None
+        level = levels[i]
+        child = node.children.get(level)
+        if child != None:
+            found = self._match(child, levels, i + 1, params)
+            if found != None:
+                return found
+        if node.param_node != None:
+            found = self._match(node.param_node, levels, i + 1, params)
+            if found != None:
+                params[node.param] = level
+                return found
+        return None
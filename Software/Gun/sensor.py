@@ -33,6 +33,7 @@ from machine import Pin, freq
 from ir_rx.print_error import print_error  # Optional print of error codes
 from ir_rx.nec import NEC_8, NEC_16
 from game import Hit
+from hitlog import HitLog
 from utils import inttohexstring, dbg
 
 
@@ -62,7 +63,7 @@ class Sensor:
         self.excludefriendly = excludefriendly
         self.onhit = None
         self.onfriendlyfire = None
-        self.hits = []
+        self.hits = HitLog()
         self.fx = fx
 
     # handle received IR code
@@ -76,7 +77,7 @@ class Sensor:
                 hit = Hit(addr, data, myteam, myplayer, self.sensorid)
                 friendlyfire = (addr == myteam)
                 if (not friendlyfire) or (not self.excludefriendly): # no friendly fire!
-                    self.hits.append(hit)
+                    self.hits.append(hit.shooterteam, hit.shooter, hit.victimteam, hit.victim, hit.sensor, time.ticks_ms())
                     dbg("hit: counter=" + str(len(self.hits)))
                     self.fx.hit()
                     if self.onhit != None:
@@ -24,10 +24,15 @@
 # mosquitto_sub -h 192.168.1.2 -t "#" -v
 # Send a message:
 # mosquitto_pub -h 192.168.1.2 -t <topic> -m <message>
+import time
+import ujson
 from wifi import WiFi
 from umqttsimple import *
-from game import Hit
+from game import Hit, Game
+from router import TopicRouter
 from utils import *
+import hitcodec
+from statedelta import StateApplier
 
 class StramashProtocolError(Exception):
     """
@@ -53,6 +58,11 @@ class StramashClient:
         self.playerid = playerid
         self.game = None # will get set when we get joined
         self.onmessage = None # message handler for MQTT messages received
+        self.binary = False # send hits/fires binary-encoded? (if the server supports it)
+        self.seq = 0 # sequence number for binary hits/fires
+        self.gamestate = StateApplier() # the game's state, from its gamedelta stream
+        self.keyframe_wanted = False # have we asked the server for a keyframe?
+        self.snapshot = None # our retained snapshot from the server, if we're in a game
 
         dbg("Connecting to WiFi...")
         self.wifi = WiFi(wifi_ssid, wifi_key)
@@ -70,22 +80,29 @@ class StramashClient:
         self.mqtt_client = None
         dbg('MQTT not connected')
 
-        # setup a dictionary of topics and their handler methods 
-        self.topic_handlers = {
-            "stramash/player/"+self.playerid+"/gamejoined": self._gamejoined,
-            "stramash/player/"+self.playerid+"/assigned": self._assigned,
-            "stramash/player/"+self.playerid+"/unassigned": self._unassigned,
-            "stramash/player/"+self.playerid+"/deleted": self._deleted,
-            "stramash/player/"+self.playerid+"/kicked": self._kicked,
-            "stramash/player/"+self.playerid+"/up": self._up,
-            "stramash/player/"+self.playerid+"/down": self._down
+        # route our topics to their handler methods
+        self.router = TopicRouter()
+        player_handlers = {
+            "gamejoined": self._gamejoined,
+            "assigned": self._assigned,
+            "unassigned": self._unassigned,
+            "deleted": self._deleted,
+            "kicked": self._kicked,
+            "up": self._up,
+            "down": self._down,
+            "snapshot": self._snapshot
         }
-        # Note: we can't add gamestarted, gameended and gamedeleted because
-        # we won't know their topics until we have a game ID
-        
-        # subscribe to the topics
-        for topic in self.topic_handlers.keys():
+        for action, handler in player_handlers.items():
+            topic = "stramash/player/"+self.playerid+"/"+action
+            self.router.add(topic, handler)
             self.subscribe(topic)
+        # Note: we can't subscribe to gamestarted, gameended and gamedeleted
+        # because we won't know their topics until we have a game ID - but if
+        # we're in one, the broker sends our snapshot (retained) straight away
+
+        # the server tells us (in a retained message) which encodings it accepts
+        self.router.add("stramash/server/encodings", self._encodings)
+        self.subscribe("stramash/server/encodings")
         
         # blank all the event handlers
         self.ongamejoined = None
@@ -99,6 +116,8 @@ class StramashClient:
         self.ongamestarted = None
         self.ongameended = None
         self.ongamedeleted = None
+        self.ongamestate = None
+        self.onsnapshot = None
 
     def subscribe(self, topic):
         """
@@ -126,8 +145,8 @@ class StramashClient:
             self.onmessage(topic, msg)
         
         # call the code to deal with the message
-        if topic in self.topic_handlers:
-            handler = self.topic_handlers[topic]
+        handler, params = self.router.match(topic)
+        if handler != None:
             handler(topic, msg)
         else:
             # Invalid message - log, raise exception
@@ -158,14 +177,24 @@ class StramashClient:
         if self.mqtt_client != None:
             self.mqtt_client.check_msg()
 
-    def sendfire(self):
+    def _next_seq(self):
+        self.seq = (self.seq + 1) & 0xFFFF
+        return self.seq
+
+    def sendfire(self, team=None):
         """
         Tell the server we have fired.
+
+        team: our Team, needed for the binary encoding (which identifies us 
+        by team and player number rather than playerid)
         """
         # NB: This is not used in the prototype. 
         # TODO: Might be better to send the /total/ fired each time?
-        topic = "stramash/"+self.game.id+"/fire"
-        self.send(topic, self.playerid)
+        topic = "stramash/game/"+self.game.id+"/fire"
+        if self.binary and team != None:
+            self.send(topic, hitcodec.pack_fire(team.team, team.player, self._next_seq(), time.ticks_ms()))
+        else:
+            self.send(topic, self.playerid)
         
 
     def sendhit(self, hit):
@@ -175,22 +204,86 @@ class StramashClient:
         # NB: this is not used in the prototype.
         # send hit message to the server
         topic = "stramash/game/"+self.game.id+"/hit"
-        self.send(topic, hit.message)
+        if self.binary:
+            self.send(topic, hit.packed(self._next_seq(), time.ticks_ms()))
+        else:
+            self.send(topic, hit.message)
+
+    def _encodings(self, topic, msg):
+        """
+        Notes the encodings the server accepts, so we use binary hit and fire
+        messages only if the server can read them.
+        """
+        try:
+            self.binary = hitcodec.BINARY in ujson.loads(msg)
+        except ValueError:
+            self.binary = False
+        dbg("stramashclient: binary="+str(self.binary))
         
 
 
             
+    def watchgame(self, gameid):
+        """
+        Follows a game's gamedelta stream, calling ongamestate with the game's
+        state (see statedelta.py) whenever it changes.
+
+        gameid: the id of the game
+        """
+        topic = "stramash/game/"+gameid+"/gamedelta"
+        self.router.add(topic, self._gamedelta)
+        self.subscribe(topic)
+        self.gamestate = StateApplier()
+        self._request_keyframe(gameid)
+
+    def _request_keyframe(self, gameid):
+        if not self.keyframe_wanted:
+            self.keyframe_wanted = True
+            self.send("stramash/game/"+gameid+"/keyframe", "")
+
+    def _gamedelta(self, topic, msg):
+        if self.gamestate.apply(msg):
+            self.keyframe_wanted = False
+            if self.ongamestate != None:
+                self.ongamestate(self.gamestate.state)
+        else:
+            # we've missed something: catch up from a keyframe
+            self._request_keyframe(topic.split("/")[2])
+
     ############################################################################
     # Implement Actions for Server Messages: Pre Game Start
     ############################################################################
+    def _snapshot(self, topic, msg):
+        # the server keeps our snapshot (game, team and player state) retained,
+        # so after a reboot we're back in the game in one round trip
+        if msg == "":
+            # we, or the game, have been deleted
+            self.snapshot = None
+            if self.game != None:
+                self.game = None
+                if self.ongamedeleted != None:
+                    self.ongamedeleted()
+            return
+        try:
+            self.snapshot = ujson.loads(msg)
+        except ValueError:
+            dbg("stramashclient: bad snapshot")
+            return
+        game = self.snapshot["game"]
+        dbg("stramashclient: _snapshot, game="+game["id"])
+        if self.game == None or self.game.id != game["id"]:
+            self.game = Game(self, game["id"], game["name"])
+        if self.onsnapshot != None:
+            self.onsnapshot(self.snapshot)
+
     def _gamejoined(self, topic, msg):
         dbg("stramashclient: _gamejoined")
         # TODO: stramash/player/<playerid>/gamejoined - create the appropriate Game
         # object and feed it gun, fx, player
         
         # TODO: set these topic names and subscribe to them
-        # TODO append to self.topic_handlers 
-        # self.topic_handlers["topic"] = self._gamestarted
+        # TODO add them to self.router
+        # self.router.add("stramash/game/<gameid>/gamestarted", self._gamestarted)
         #self.topic_gamestarted = ""
         #self.topic_gameended = ""
         #self.topic_gamedeleted = ""
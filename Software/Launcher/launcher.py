@@ -22,6 +22,7 @@
 import os, random, json
 import paho.mqtt.client as mqtt
 from utils import *
+from statedelta import StateApplier
 
 game_ready = False 
 teams_ready = False 
@@ -38,13 +39,13 @@ def unique_id(length=8):
 
 # TODO colour options should be in config file
 colours = {
-    "Red": "[255,0,0]",
-    "Orange": "[255,128,0]",
-    "Yellow": "[255,255,0]",
-    "Green": "[0,255,0]",
-    "Blue": "[0,0,255]",
-    "Purple": "[255,0,255]",
-    "Pink": "[255,128,255]"
+    "Red": [255,0,0],
+    "Orange": [255,128,0],
+    "Yellow": [255,255,0],
+    "Green": [0,255,0],
+    "Blue": [0,0,255],
+    "Purple": [255,0,255],
+    "Pink": [255,128,255]
 }
 
 class Game:
@@ -100,12 +101,13 @@ class Player:
             "gunid": self.gunid
         }
         if self.team == None:
-            jso["colour"] == colours[self.colour]
+            jso["colour"] = colours[self.colour]
         return jso
 
 game = Game()
 teams = {}
 players = {}
+gamestates = {} # game id: StateApplier following its gamedelta stream
 
 
 # The callback for when the client receives a CONNACK response from the server.
@@ -118,7 +120,27 @@ def on_connect(client, userdata, flags, rc):
 
 # The callback for when a PUBLISH message is received from the server.
 def on_message(client, userdata, msg):
-    print(msg.topic+" "+str(msg.payload))
+    levels = msg.topic.split("/")
+    # stramash/game/<gameid>/gamedelta, or the game's snapshot (not a player's)
+    if len(levels) == 4 and levels[1] == "game" and levels[3] in ("gamedelta", "snapshot"):
+        # the retained snapshot is a keyframe, which gets us going at once
+        if len(msg.payload) > 0:
+            on_gamedelta(levels[2], msg.payload)
+        else:
+            gamestates.pop(levels[2], None) # deleted
+    else:
+        print(msg.topic+" "+str(msg.payload))
+
+def on_gamedelta(gameid, payload):
+    # keep track of each game's state from its gamedelta stream, asking for
+    # a keyframe if we've missed anything
+    applier = gamestates.setdefault(gameid, StateApplier())
+    if not applier.apply(payload):
+        client.publish("stramash/game/"+gameid+"/keyframe", "")
+        return
+    state = applier.state["game"]
+    print("Game [{0}] {1} {2}, {3} players".format(state["name"], state["status"], state["runtime"],
+        len(applier.state["players"])))
 
 
 def cls():
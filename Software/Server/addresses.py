@@ -0,0 +1,150 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# addresses.py
+# Provides the AddressBook, which hands out the IR addresses in a game.
+#
+# A gun's IR shot carries its team number (the NEC address) and player
+# number (the NEC command), a byte each. Each game has a pool of team
+# numbers, and each team a pool of player numbers; a player without a team
+# is given a team number of their own, and is player 1 in it. Number 0 is
+# never given out. A pool is a 256-bit bitmap of the numbers still free, so
+# taking the lowest free number and giving one back are each a couple of
+# integer operations, and numbers are reused once they've been given back.
+#
+# The address book also indexes the players by address, so that a hit can
+# be resolved to its shooter and victim with a dict lookup each.
+# ----------------------------------------------------------------------
+
+FIRST = 1
+LAST = 255
+ALL = ((1 << (LAST + 1)) - 1) & ~((1 << FIRST) - 1) # bits FIRST-LAST set
+
+class AddressError(Exception):
+    """
+    Exception raised when an address is out of range, in use already, or
+    there are none left.
+    """
+    pass
+
+class NumberPool:
+    """
+    The numbers (1-255) still free for one team, or for the teams of a game.
+    """
+    __slots__ = ("free",)
+
+    def __init__(self):
+        self.free = ALL # a bit set for each free number
+
+    def allocate(self):
+        """
+        Takes the lowest free number, and returns it.
+        """
+        free = self.free
+        if free == 0:
+            raise AddressError("No numbers left")
+        lowest = free & -free
+        self.free = free ^ lowest
+        return lowest.bit_length() - 1
+
+    def claim(self, number):
+        """
+        Takes a particular number, eg when restoring a game.
+        """
+        if type(number) is not int or number < FIRST or number > LAST:
+            raise AddressError("Number out of range: "+str(number))
+        bit = 1 << number
+        if not self.free & bit:
+            raise AddressError("Number in use: "+str(number))
+        self.free ^= bit
+
+    def release(self, number):
+        """
+        Gives a number back, to be reused.
+        """
+        if type(number) is int and FIRST <= number <= LAST:
+            self.free |= 1 << number
+
+    def in_use(self, number):
+        return FIRST <= number <= LAST and not self.free & (1 << number)
+
+    def available(self):
+        """
+        Returns how many numbers are free.
+        """
+        return bin(self.free).count("1")
+
+class AddressBook:
+    """
+    The IR addresses in use in a game, and the player at each.
+    """
+    __slots__ = ("teams", "players", "index")
+
+    def __init__(self):
+        self.teams = NumberPool()
+        self.players = {} # team number: NumberPool of its player numbers
+        self.index = {}   # (team number, player number): Player
+
+    def new_team(self, number=None):
+        """
+        Allocates a team number (or claims the given one), and returns it.
+        """
+        if number == None:
+            number = self.teams.allocate()
+        else:
+            self.teams.claim(number)
+        self.players[number] = NumberPool()
+        return number
+
+    def release_team(self, number):
+        """
+        Gives a team number back. Its players should have been removed first.
+        """
+        if self.players.pop(number, None) != None:
+            self.teams.release(number)
+
+    def add(self, player, number=None):
+        """
+        Allocates a player number in the player's team (or claims the given
+        one), and indexes the player by their address. Returns the number.
+
+        player: the Player, with its teamnumber set
+        """
+        pool = self.players.get(player.teamnumber)
+        if pool == None:
+            raise AddressError("No such team number: "+str(player.teamnumber))
+        if number == None:
+            number = pool.allocate()
+        else:
+            pool.claim(number)
+        self.index[(player.teamnumber, number)] = player
+        return number
+
+    def remove(self, player):
+        """
+        Gives a player's number back, and removes them from the index.
+        """
+        address = (player.teamnumber, player.playernumber)
+        if self.index.get(address) is player:
+            del self.index[address]
+            self.players[player.teamnumber].release(player.playernumber)
+
+    def find(self, teamnumber, playernumber):
+        """
+        Returns the player with the given address, or None.
+        """
+        return self.index.get((teamnumber, playernumber))
@@ -0,0 +1,702 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# benchmark.py
+# Microbenchmarks for the server.
+#
+# Usage: python benchmark.py [name ...]
+# With no names, runs them all.
+# ----------------------------------------------------------------------
+import sys, timeit, json
+from utils import unique_id
+
+def report(label, seconds, ops):
+    """
+    Prints the time per operation.
+
+    label: what was measured
+    seconds: the total time taken
+    ops: the number of operations in that time
+    """
+    print("{:<48} {:>10.3f} us/op".format(label, seconds * 1000000 / ops))
+
+def measure(label, fn, ops, repeat=5):
+    """
+    Times fn (which performs ops operations) and reports the best of several
+    runs.
+    """
+    best = min(timeit.repeat(fn, number=1, repeat=repeat))
+    report(label, best, ops)
+    return best
+
+# ------------------------------------------------------------------------------
+# ROUTER
+# ------------------------------------------------------------------------------
+def bench_router():
+    from router import TopicRouter
+
+    actions = ["delete", "startgame", "end", "check", "addteam", "addplayer", "fire", "hit"]
+    print("Routing a hit message (one lookup per op)")
+    for games in (10, 100, 500):
+        gameids = [unique_id() for i in range(games)]
+
+        # linear: an if-chain over every game's topics, as on_message does
+        linear = []
+        for gameid in gameids:
+            for action in actions:
+                linear.append(("stramash/game/"+gameid+"/"+action, action))
+
+        def linear_match(topic):
+            for candidate, handler in linear:
+                if topic == candidate:
+                    return handler
+            return None
+
+        router = TopicRouter()
+        router.add("stramash/newgame", "newgame")
+        for action in actions:
+            router.add("stramash/game/<gameid>/"+action, action)
+
+        # look up hits spread across all the games
+        topics = ["stramash/game/"+gameid+"/hit" for gameid in gameids]
+        ops = len(topics)
+        measure("linear, {} games".format(games), lambda: [linear_match(t) for t in topics], ops)
+        measure("trie, {} games".format(games), lambda: [router.match(t) for t in topics], ops)
+
+# ------------------------------------------------------------------------------
+# HIT PIPELINE
+# ------------------------------------------------------------------------------
+def make_game(players):
+    """
+    Returns an active free-for-all Game with the given number of players.
+    """
+    from game import Game
+    from colour import Colour
+    game = Game(None, "Benchmark", "ffa", "01:00:00")
+    for i in range(players):
+        game.addplayer("gun"+str(i), "Player "+str(i), None, Colour("Red", 255, 0, 0))
+    game.start()
+    return game
+
+def make_hits(game, count):
+    """
+    Returns count hit messages between random players of game.
+    """
+    import random
+    players = list(game.players.values())
+    messages = []
+    for i in range(count):
+        shooter, victim = random.sample(players, 2)
+        hit = [shooter.teamnumber, shooter.playernumber, victim.teamnumber, victim.playernumber, 0]
+        messages.append(json.dumps(hit, separators=(",", ":")).encode("utf-8"))
+    return messages
+
+def bench_hits():
+    from hits import parse_hits
+
+    game = make_game(32)
+    messages = make_hits(game, 10000)
+
+    def one_at_a_time():
+        for message in messages:
+            hit = json.loads(message)
+            game.hit(hit[0], hit[1], hit[2], hit[3], hit[4])
+
+    def batched(size):
+        for i in range(0, len(messages), size):
+            game.apply_hits(parse_hits(messages[i:i+size]))
+
+    print("Parsing and applying 10000 hits, 32 players")
+    best = measure("one message at a time", one_at_a_time, len(messages))
+    print("{:<48} {:>10.0f} hits/sec".format("", len(messages) / best))
+    for size in (16, 64, 256):
+        best = measure("batches of {}".format(size), lambda: batched(size), len(messages))
+        print("{:<48} {:>10.0f} hits/sec".format("", len(messages) / best))
+
+def bench_dedup():
+    import random
+    from hits import HitDedup
+
+    # 32 players, each shot seen by one to three sensors
+    hits = []
+    for i in range(10000):
+        shooter, victim = random.sample(range(1, 33), 2)
+        for sensor in range(random.randint(1, 3)):
+            hits.append([shooter, 1, victim, 1, sensor])
+    batches = [hits[i:i+64] for i in range(0, len(hits), 64)]
+    times = [[n] * len(batch) for n, batch in enumerate(batches)]
+
+    def run():
+        dedup = HitDedup()
+        for n, batch in enumerate(batches):
+            dedup.filter(batch, times[n])
+        return dedup
+
+    print("Collapsing {} hit reports from 10000 shots, in batches of 64".format(len(hits)))
+    measure("HitDedup.filter", run, len(hits))
+    print("{:<48} {:>10} collapsed".format("", run().collapsed))
+
+def bench_correlate():
+    import random
+    from hits import FireCorrelator
+
+    # 32 players; most shots hit someone, and some hits have no fire
+    events = []
+    for t in range(20000):
+        shooter = random.randint(1, 32)
+        events.append(("fire", shooter, t))
+        if random.random() < 0.8:
+            events.append(("hit", [shooter, 1, random.randint(1, 32), 1, 0], t + random.randint(0, 200)))
+        if random.random() < 0.1:
+            events.append(("hit", [random.randint(1, 32), 1, shooter, 1, 0], t))
+
+    def run():
+        correlator = FireCorrelator(500)
+        for kind, what, t in events:
+            if kind == "fire":
+                correlator.fire(what, 1, t)
+            else:
+                correlator.filter([what], [t])
+        return correlator
+
+    print("Correlating {} fire and hit messages".format(len(events)))
+    measure("FireCorrelator", run, len(events))
+    correlator = run()
+    print("{:<48} {:>10} matched, {} rejected".format("", correlator.matched, correlator.rejected))
+
+# ------------------------------------------------------------------------------
+# IR ADDRESSES
+# ------------------------------------------------------------------------------
+def bench_addresses():
+    import random
+
+    def linear(game, teamnumber, playernumber):
+        # as Game.find_player used to
+        for player in game.players.values():
+            if player.teamnumber == teamnumber and player.playernumber == playernumber:
+                return player
+        return None
+
+    ops = 10000
+    print("Resolving a hit's shooter and victim ({} per op)".format(ops))
+    for count in (8, 64, 250):
+        game = make_game(count)
+        players = list(game.players.values())
+        addresses = [(p.teamnumber, p.playernumber) for p in random.choices(players, k=ops)]
+        measure("{} players: scanning the players".format(count),
+            lambda: [linear(game, t, p) for t, p in addresses], ops)
+        measure("{} players: address index".format(count),
+            lambda: [game.find_player(t, p) for t, p in addresses], ops)
+
+    def churn():
+        game = make_game(250)
+        for i in range(250):
+            game.deleteplayer("gun"+str(i))
+            game.addplayer("new"+str(i), "New", None, None)
+    print("Adding 250 players, then replacing each")
+    measure("allocating and releasing numbers", churn, 500)
+
+# ------------------------------------------------------------------------------
+# HIT ENCODING
+# ------------------------------------------------------------------------------
+def bench_codec():
+    from hits import parse_hits
+    from hitcodec import pack_hit, unpack_hit
+
+    game = make_game(32)
+    messages = make_hits(game, 10000)
+    hits = [json.loads(message) for message in messages]
+    # JSON arrays carrying the same sequence number and timestamp as binary
+    timestamped = [json.dumps(hit + [i & 0xFFFF, 1000000 + i * 37], separators=(",", ":")).encode("utf-8")
+        for i, hit in enumerate(hits)]
+    binary = [pack_hit(hit[0], hit[1], hit[2], hit[3], hit[4], i, 1000000 + i * 37) for i, hit in enumerate(hits)]
+
+    print("Bytes per hit message")
+    for label, encoded in (("json", messages), ("json + seq + timestamp", timestamped), ("binary (with seq + timestamp)", binary)):
+        print("{:<48} {:>10.1f} bytes".format(label, sum(len(m) for m in encoded) / len(encoded)))
+
+    print("Decoding 10000 hits, one at a time")
+    measure("json", lambda: [json.loads(m) for m in messages], len(messages))
+    measure("json + seq + timestamp", lambda: [json.loads(m) for m in timestamped], len(messages))
+    measure("binary", lambda: [unpack_hit(m) for m in binary], len(messages))
+
+    print("Decoding 10000 hits, in batches of 256")
+    batches = lambda encoded: [parse_hits(encoded[i:i+256]) for i in range(0, len(encoded), 256)]
+    measure("json", lambda: batches(messages), len(messages))
+    measure("binary", lambda: batches(binary), len(messages))
+
+# ------------------------------------------------------------------------------
+# HIT LOG
+# ------------------------------------------------------------------------------
+class Hit:
+    """
+    A hit as an object, as the gun's Sensor used to keep them.
+    """
+    def __init__(self, shooterteam, shooter, victimteam, victim, sensor, timestamp):
+        self.shooterteam = shooterteam
+        self.shooter = shooter
+        self.victimteam = victimteam
+        self.victim = victim
+        self.sensor = sensor
+        self.timestamp = timestamp
+
+def bench_hitlog():
+    import random, tracemalloc
+    from hitlog import HitLog
+
+    # a busy 90 minute session: 32 players, each hit every 5 seconds or so
+    count = 32 * 90 * 12
+    hits = [(random.randint(1, 8), random.randint(1, 4), random.randint(1, 8), random.randint(1, 4),
+        random.randint(0, 3), i * 170) for i in range(count)]
+
+    def as_objects():
+        return [Hit(*hit) for hit in hits]
+
+    def as_hitlog():
+        log = HitLog()
+        for hit in hits:
+            log.append(*hit)
+        return log
+
+    print("Storing {} hits".format(count))
+    for label, fn in (("list of Hit objects", as_objects), ("HitLog", as_hitlog)):
+        tracemalloc.start()
+        stored = fn()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{:<48} {:>10.1f} bytes/hit".format(label, size / count))
+        measure(label, fn, count)
+
+    log = as_hitlog()
+    objects = as_objects()
+    print("Counting hits on victim 1, one pass")
+    measure("list of Hit objects", lambda: sum(1 for hit in objects if hit.victim == 1), count)
+    measure("HitLog view", lambda: log.view("victim").tolist().count(1), count)
+
+# ------------------------------------------------------------------------------
+# LEADERBOARD
+# ------------------------------------------------------------------------------
+def bench_leaderboard():
+    import random
+    from player import Player
+    from leaderboard import Leaderboard
+
+    print("Scoring a hit and finding the top 10 (one hit per op)")
+    for count in (32, 256, 2048):
+        players = [Player("gun"+str(i), "Player "+str(i), i // 256 + 1, i % 256) for i in range(count)]
+        leaders = Leaderboard()
+        for player in players:
+            leaders.add(player)
+        pairs = [random.sample(players, 2) for i in range(2000)]
+
+        def resort():
+            for shooter, victim in pairs:
+                shooter.handle_kill()
+                victim.handle_death()
+                sorted(players, key=lambda player: -player.score)[:10]
+
+        def leaderboard():
+            for shooter, victim in pairs:
+                shooter.handle_kill()
+                victim.handle_death()
+                leaders.update(shooter)
+                leaders.update(victim)
+                leaders.top(10)
+
+        measure("re-sort, {} players".format(count), resort, len(pairs), repeat=3)
+        measure("leaderboard, {} players".format(count), leaderboard, len(pairs), repeat=3)
+
+# ------------------------------------------------------------------------------
+# JOURNAL
+# ------------------------------------------------------------------------------
+def bench_journal():
+    import tempfile, time
+    from server import Server
+    from journal import Journal, recover
+
+    print("Handling 10000 hits in batches of 64, 32 players")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, journal in (("no journal", None), ("journal", Journal(directory))):
+            server = Server()
+            if journal != None:
+                server.resume(journal)
+            game = make_game(32)
+            server.track(game)
+            messages = make_hits(game, 10000)
+            batched = lambda: [server.hit_batch(game, messages[i:i+64]) for i in range(0, len(messages), 64)]
+            best = measure(label, batched, len(messages))
+            print("{:<48} {:>10.0f} hits/sec".format("", len(messages) / best))
+            if journal != None:
+                start = time.perf_counter()
+                journal.stop()
+                report("waiting for the writer to catch up", time.perf_counter() - start, len(messages) * 5)
+
+        games, events = recover(directory)
+        start = time.perf_counter()
+        Server().restore(games, events)
+        report("recovering ({} records replayed)".format(len(events)), time.perf_counter() - start, len(messages) * 5)
+
+# ------------------------------------------------------------------------------
+# REPLAY
+# ------------------------------------------------------------------------------
+def bench_replay():
+    import random
+    from replay import Replay
+
+    # a 60 minute game, 32 players: a batch of hits and a few shots a second
+    game = make_game(32)
+    created = game.to_dict()
+    events = []
+    game.onevent = events.append
+    players = list(game.players.values())
+    for second in range(3600):
+        for i in range(4):
+            game.fire(random.choice(players).id, second * 1000 + i * 250)
+        shooter, victim = random.sample(players, 2)
+        game.apply_hits([[shooter.teamnumber, shooter.playernumber, victim.teamnumber, victim.playernumber, 0]], second * 1000)
+
+    print("Seeking to minute 37 of a 60 minute game ({} events)".format(len(events)))
+    replay = Replay(created, events, len(events) + 1)
+    measure("no checkpoints (full replay)", lambda: replay.seek(replay.at(37 * 60000)), 1, repeat=3)
+    for interval in (1000, 100):
+        replay = Replay(created, events, interval)
+        measure("checkpoint every {} events".format(interval), lambda: replay.seek(replay.at(37 * 60000)), 1, repeat=3)
+
+# ------------------------------------------------------------------------------
+# DOMAIN MODEL
+# ------------------------------------------------------------------------------
+class PropertyColour:
+    """
+    Colour as it was, with a checked property for each attribute.
+    """
+    def __init__(self, name, red, green, blue):
+        self.name = name
+        self.red = red
+        self.green = green
+        self.blue = blue
+
+    @property
+    def name(self):
+        return self._name
+    @name.setter
+    def name(self, name):
+        self._name = name
+
+    @property
+    def red(self):
+        return self._red
+    @red.setter
+    def red(self, red):
+        if (red > 255) or (red < 0):
+            raise ValueError
+        self._red = red
+
+    @property
+    def green(self):
+        return self._green
+    @green.setter
+    def green(self, green):
+        if (green > 255) or (green < 0):
+            raise ValueError
+        self._green = green
+
+    @property
+    def blue(self):
+        return self._blue
+    @blue.setter
+    def blue(self, blue):
+        if (blue > 255) or (blue < 0):
+            raise ValueError
+        self._blue = blue
+
+class PropertyPlayer:
+    """
+    Player as it was, with checked properties and a __dict__.
+    """
+    @property
+    def id(self):
+        return self._id
+    @id.setter
+    def id(self, id):
+        if not isinstance(id, (int, str)):
+            raise TypeError
+        self._id = id
+
+    @property
+    def name(self):
+        return self._name
+    @name.setter
+    def name(self, name):
+        if not isinstance(name, str):
+            raise TypeError
+        self._name = name
+
+    @property
+    def colour(self):
+        return self._colour
+    @colour.setter
+    def colour(self, colour):
+        self._colour = colour
+
+    def __init__(self, id, name, teamnumber, playernumber, colour=None):
+        self.id = id
+        self.name = name
+        self.teamnumber = teamnumber
+        self.playernumber = playernumber
+        self.colour = colour
+        self.shots = 0
+        self.kills = 0
+        self.ffkills = 0
+        self.deaths = 0
+        self.score = 0
+        self.status = 5
+        self.last_death = None
+
+    def _update_score(self):
+        accuracy = self.kills / self.shots if self.shots > 0 else 0
+        self.score = (self.kills - self.deaths) + accuracy
+
+    def handle_fire(self):
+        self.shots += 1
+        self._update_score()
+
+def bench_model():
+    import tracemalloc
+    from colour import Colour
+    from player import Player
+
+    count = 10000
+    print("Memory for {} players, each with their own colour".format(count))
+    for label, player_class, colour_class in (("properties", PropertyPlayer, PropertyColour), ("slots", Player, Colour)):
+        tracemalloc.start()
+        players = [player_class("gun"+str(i), "Player", i // 256, i % 256, colour_class("Red", 255, 0, 0))
+            for i in range(count)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{:<48} {:>10.1f} bytes/player".format(label, size / count))
+
+    old = PropertyPlayer("gun", "Player", 1, 1, PropertyColour("Red", 255, 0, 0))
+    new = Player("gun", "Player", 1, 1, Colour("Red", 255, 0, 0))
+    ops = 100000
+    print("Attribute access ({} per op)".format(ops))
+    for label, player in (("properties", old), ("slots", new)):
+        measure(label+": read name and colour.red", lambda: [(player.name, player.colour.red) for i in range(ops)], ops)
+    for label, player in (("properties", old), ("slots", new)):
+        measure(label+": handle_fire", lambda: [player.handle_fire() for i in range(ops)], ops)
+    for label, player_class, colour_class in (("properties", PropertyPlayer, PropertyColour), ("slots", Player, Colour)):
+        measure(label+": create", lambda: [player_class("gun", "Player", 1, 1, colour_class("Red", 255, 0, 0))
+            for i in range(ops // 10)], ops // 10)
+
+# ------------------------------------------------------------------------------
+# STATE CACHE
+# ------------------------------------------------------------------------------
+def bench_statecache():
+    import random
+    import statecache
+
+    game = make_game(64)
+    players = list(game.players.values())
+    ops = 10000
+    print("Answering check and checkplayer ({} per op)".format(ops))
+    measure("gamestate, encoded each time", lambda: [statecache.encode_state(game.state()) for i in range(ops)], ops)
+    measure("gamestate, cached", lambda: [game.state_message() for i in range(ops)], ops)
+    measure("playerstate, encoded each time",
+        lambda: [statecache.encode_state(players[i % 64].state()) for i in range(ops)], ops)
+    measure("playerstate, cached", lambda: [players[i % 64].state_message() for i in range(ops)], ops)
+
+    # a monitor polling every player between hits: only the two players hit
+    # (and the game, if the leaders changed) need encoding again
+    hits = [random.sample(players, 2) for i in range(ops // 64)]
+    def poll():
+        for shooter, victim in hits:
+            game.hit(shooter.teamnumber, shooter.playernumber, victim.teamnumber, victim.playernumber, 0)
+            game.state_message()
+            for player in players:
+                player.state_message()
+    statecache.stats.reset()
+    measure("hit, then gamestate and 64 playerstates, cached", poll, len(hits) * 65)
+    print("cache hit ratio {:.3f}".format(statecache.stats.ratio))
+
+# ------------------------------------------------------------------------------
+# GAMEDELTA STREAM
+# ------------------------------------------------------------------------------
+def bench_delta():
+    from server import Server
+
+    for count, rate in ((64, 20), (250, 100)):
+        server = Server(lambda topic, msg, retain=False: None)
+        game = make_game(count)
+        server.games[game.id] = game
+        hits = make_hits(game, rate * 60)
+        # a minute of play, at rate hits/sec, with the stream published each second
+        start = timeit.default_timer()
+        for second in range(60):
+            server.hit_batch(game, hits[second * rate:(second + 1) * rate])
+            server.publish_deltas(second)
+        elapsed = timeit.default_timer() - start
+        stats = server.delta_stats
+        print("{} players, {} hits/sec: gamedelta {:.0f} bytes/sec, full state {:.0f} bytes/sec, saving {:.0f} bytes/sec ({:.0f}%), {:.2f} ms/sec".format(
+            count, rate, stats.sent / 60, stats.full / 60, stats.saved / 60, 100 * stats.saved / stats.full, elapsed * 1000 / 60))
+
+# ------------------------------------------------------------------------------
+# GAME TYPES
+# ------------------------------------------------------------------------------
+def bench_gametypes():
+    import gametypes
+    gametypes.discover(warm=True)
+
+    def imported(type):
+        # as Server.newgame used to find the class
+        return getattr(__import__("game_"+type), "Game_"+type)
+
+    ops = 100000
+    print("Finding the class for a newgame ({} per op)".format(ops))
+    measure("__import__ and getattr", lambda: [imported("ffa") for i in range(ops)], ops)
+    measure("registry", lambda: [gametypes.game_class("ffa") for i in range(ops)], ops)
+
+# ------------------------------------------------------------------------------
+# SCHEMA
+# ------------------------------------------------------------------------------
+def bench_schema():
+    import server
+    from colour import Colour
+
+    teams = [{"name": "Team "+str(t), "colour": [t * 4, 0, 255 - t * 4],
+        "players": [{"name": "Player "+str(p), "gunid": str(t * 8 + p)} for p in range(8)]} for t in range(64)]
+    message = json.dumps({"name": "Big", "type": "teams", "maxtime": "00:10:00", "teams": teams}).encode("utf-8")
+
+    def unchecked():
+        # as Server.newgame used to read it, building the colours as it went
+        obj = json.loads(message)
+        for t in obj["teams"]:
+            Colour(t["name"], t["colour"][0], t["colour"][1], t["colour"][2])
+            for p in t.get("players", []):
+                p["gunid"], p["name"]
+
+    def build(parse):
+        obj = parse(message)
+        game = server.game_class("teams")(unique_id(), obj["name"], obj["type"], obj["maxtime"])
+        for t in obj["teams"]:
+            team = game.addteam(t["name"], t["colour"])
+            for p in t["players"]:
+                game.addplayer(p["gunid"], p["name"], team)
+
+    ops = 20
+    print("Reading a newgame with 64 teams and 512 players ({} per op)".format(ops))
+    measure("json.loads only (unchecked)", lambda: [unchecked() for i in range(ops)], ops)
+    measure("schema: checked and converted", lambda: [server.NEWGAME.parse(message) for i in range(ops)], ops)
+    measure("schema and building the game", lambda: [build(server.NEWGAME.parse) for i in range(ops)], ops)
+
+# ------------------------------------------------------------------------------
+# TIMERS
+# ------------------------------------------------------------------------------
+class HeapTimers:
+    """
+    A heap-based scheduler, for comparison with the TimingWheel: cancelled
+    timers are marked, and dropped when they reach the top.
+    """
+    def __init__(self):
+        self.heap = []
+        self.seq = 0
+
+    def schedule(self, when, callback, *args):
+        import heapq
+        self.seq += 1
+        timer = [when, self.seq, callback, args]
+        heapq.heappush(self.heap, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    def advance(self, now):
+        import heapq
+        heap = self.heap
+        while len(heap) > 0 and heap[0][0] <= now:
+            when, seq, callback, args = heapq.heappop(heap)
+            if callback != None:
+                callback(*args)
+
+def bench_timers():
+    import random
+    from timers import TimingWheel
+
+    # players being hit again and again: each hit restarts their down timer,
+    # so most timers are cancelled
+    count = 50000
+    hits = [(random.randint(0, 9999), i * 3) for i in range(count)] # (player, time in ms)
+
+    def run(timers):
+        ran = []
+        pending = {}
+        for player, t in hits:
+            timers.advance(t)
+            timer = pending.get(player)
+            if timer != None:
+                timers.cancel(timer)
+            pending[player] = timers.schedule(t + 10000, ran.append, player)
+        timers.advance(hits[-1][1] + 20000)
+        return ran
+
+    print("{} hits on 10000 players, each (re)setting a 10s timer".format(count))
+    measure("heapq", lambda: run(HeapTimers()), count)
+    measure("TimingWheel", lambda: run(TimingWheel(0)), count)
+    # what each is holding on to, midway
+    heap, wheel = HeapTimers(), TimingWheel(0)
+    for timers in (heap, wheel):
+        pending = {}
+        for player, t in hits[:count // 2]:
+            timers.advance(t)
+            if player in pending:
+                timers.cancel(pending[player])
+            pending[player] = timers.schedule(t + 10000, len, ())
+    print("{:<48} {:>10} entries (heapq), {} (TimingWheel)".format("", len(heap.heap), len(wheel)))
+
+    def schedule_cancel(timers):
+        pending = [timers.schedule(random.randint(1, 3600000), len, ()) for i in range(count)]
+        for timer in pending:
+            timers.cancel(timer)
+    print("Scheduling and cancelling {} timers up to an hour ahead".format(count))
+    measure("heapq", lambda: schedule_cancel(HeapTimers()), count)
+    measure("TimingWheel", lambda: schedule_cancel(TimingWheel(0)), count)
+
+benchmarks = {
+    "router": bench_router,
+    "hits": bench_hits,
+    "dedup": bench_dedup,
+    "correlate": bench_correlate,
+    "addresses": bench_addresses,
+    "codec": bench_codec,
+    "hitlog": bench_hitlog,
+    "leaderboard": bench_leaderboard,
+    "journal": bench_journal,
+    "replay": bench_replay,
+    "model": bench_model,
+    "statecache": bench_statecache,
+    "delta": bench_delta,
+    "gametypes": bench_gametypes,
+    "schema": bench_schema,
+    "timers": bench_timers
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks.keys())
+    for name in names:
+        print("=" * 64)
+        print(name)
+        print("=" * 64)
+        benchmarks[name]()
@@ -3,60 +3,45 @@ import json
 class ColourOutOfRange(Exception):
     pass
 
+def check_component(value):
+    """
+    Returns a colour component (0-255), raising TypeError if it isn't an int,
+    or ColourOutOfRange if it's out of range.
+    """
+    if type(value) is not int:
+        raise TypeError
+    if (value > 255) or (value < 0):
+        raise ColourOutOfRange
+    return value
+
 class Colour:
+    # Colours are checked when they're created (or deserialised), and the
+    # attributes are plain slots after that
+    __slots__ = ("name", "red", "green", "blue")
+
     def __init__(self, name, red, green, blue):
+        if not isinstance(name, str):
+            raise TypeError
         self.name = name
-        self.red = red 
-        self.blue = blue 
-        self.green = green 
-
-    # name
-    @property
-    def name(self):
-        return self._name
-    @name.setter
-    def name(self, name):
-        self._name = name
-
-    # red
-    @property
-    def red(self):
-        return self._red
-    @red.setter
-    def red(self, red):
-        if (red > 255) or (red < 0):
-            raise ColourOutOfRange
-        self._red = red
-
-    # green
-    @property
-    def green(self):
-        return self._green
-    @green.setter
-    def green(self, green):
-        if (green > 255) or (green < 0):
-            raise ColourOutOfRange
-        self._green = green
-
-    # blue
-    @property
-    def blue(self):
-        return self._blue
-    @blue.setter
-    def blue(self, blue):
-        if (blue > 255) or (blue < 0):
-            raise ColourOutOfRange
-        self._blue = blue
-
-    # TODO methods
+        self.red = check_component(red)
+        self.green = check_component(green)
+        self.blue = check_component(blue)
+
     def serialise(self):
         return('["'+self.name+'",'+str(self.red)+','+str(self.green)+','+str(self.blue)+']')
-    
+
     @staticmethod
     def deserialise(serialised_colour):
         data = json.loads(serialised_colour)
         colour = Colour(data[0], data[1], data[2], data[3])
         return colour
 
-    # serialise (JSON)
-    # deserialise (JSON)
\ No newline at end of file
+    def to_list(self):
+        """
+        Returns the colour as a [name, red, green, blue] list, as serialised.
+        """
+        return [self.name, self.red, self.green, self.blue]
+
+    @staticmethod
+    def from_list(data):
+        return Colour(data[0], data[1], data[2], data[3])
@@ -1,27 +1,479 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# game.py
+# Provides the Game class, which models a game on the server. New game
+# types are implemented by subclassing Game in a game_<type>.py module,
+# which registers the subclass (see gametypes.py and game_ffa.py).
+# ----------------------------------------------------------------------
+import time, json, binascii
+from utils import unique_id
+from colour import *
+from player import *
+from team import *
+from hitlog import HitLog
+from leaderboard import Leaderboard
+from addresses import AddressBook, AddressError
+import statecache
+
+# game status
+UNSTARTED = 0
+ACTIVE = 1
+FINISHED = 2
+
+status_names = {
+    UNSTARTED: "unstarted",
+    ACTIVE: "active",
+    FINISHED: "finished"
+}
+
+# what happens to a player's gun after they're hit (ms), as in GameTypes.md,
+# unless a game type's rules say otherwise
+DOWN_TIME = 10000
+SHIELD_TIME = 5000
+
+class GameError(Exception):
+    """
+    Exception raised when a request can't be applied to a game.
+    """
+    pass
+
 class Game:
-    def __init__(self):
-        print("Initiating Game")
-    # TODO properties
-    # id - short GUID - 
-    #   generate using something like urlsafe_b64encode(os.urandom(6)) (import base64, os)
-    #   or better still
-    #       alphabet = string.ascii_letters + string.digits
-    #       >>> ''.join(random.choices(alphabet, k=8))
-    # name
-    # start_time
-    # players
-    # teams
-    # status: 0=Unstarted, 1=Active, 2=Finished
-    # state (MQTT state message)
-
-    # TODO methods
-    # serialise (JSON)
-    # deserialise (JSON)
-    # save
-    # load
-    # addplayer
-    # deleteplayer
-    # addteam
-    # deleteteam
-
-    
\ No newline at end of file
+    # subclasses should declare __slots__ too (if only an empty one)
+    __slots__ = ("id", "name", "type", "maxtime", "start_time", "end_time", "status", "teams", "players",
+        "hitlog", "leaderboard", "addresses", "onevent", "_state", "_state_key")
+
+    # the rules of the game, as class attributes; game types change them with
+    # RULES (see gametypes.py)
+    RULES = {}
+    down_time = DOWN_TIME     # how long a player's gun is down once hit (ms)
+    shield_time = SHIELD_TIME # and then shielded (ms)
+    lives = 0                 # deaths before a player is out of the game (0: no limit)
+
+    def __init__(self, id=None, name="", type="", maxtime=""):
+        """
+        Initialises the game.
+
+        id: unique identifier for the game (generated if not given)
+        name: descriptive name for the game
+        type: the game type (eg ffa, teams, royale)
+        maxtime: the maximum duration of the game (hh:mm:ss)
+        """
+        for value in (name, type, maxtime):
+            if not isinstance(value, str):
+                raise TypeError
+        if not (id == None or isinstance(id, str)):
+            raise TypeError
+        self.id = id if id != None else unique_id()
+        self.name = name
+        self.type = type
+        self.maxtime = maxtime
+        self.start_time = None
+        self.end_time = None
+        self.status = UNSTARTED
+        self.teams = {}
+        self.players = {}
+        self.hitlog = HitLog()
+        self.leaderboard = Leaderboard()
+        self.addresses = AddressBook() # the IR team and player numbers
+        self.onevent = None # callable(event), told of each change (see apply)
+        self._state = None     # the encoded gamestate message...
+        self._state_key = None # ...and what it was encoded from
+
+    ############################################################################
+    # Setup
+    ############################################################################
+    def addteam(self, name, colour, id=None):
+        """
+        Creates a team and adds it to the game, returning the new Team.
+
+        name: descriptive name for the team
+        colour: the team Colour
+        id: unique identifier for the team (generated if not given)
+        """
+        team = Team(name, colour, 0, id)
+        try:
+            team.number = self.addresses.new_team()
+        except AddressError:
+            raise GameError("No team numbers left")
+        self.teams[team.id] = team
+        self._event({"e": "addteam", "id": team.id, "name": name, "colour": colour.to_list() if colour != None else None})
+        return team
+
+    def deleteteam(self, teamid):
+        """
+        Removes a team, returning its players. They stay in the game, each
+        with a team number of their own (as players without a team have) and
+        the team's colour.
+
+        teamid: the id of the team
+        """
+        if teamid not in self.teams:
+            raise GameError("No such team: "+str(teamid))
+        team = self.teams[teamid]
+        if self.addresses.teams.available() < len(team.players):
+            raise GameError("No team numbers left for the players of team: "+team.name)
+        del self.teams[teamid]
+        players = list(team.players.values())
+        for player in players:
+            self.addresses.remove(player)
+            # the team's number is only given back afterwards, so that no
+            # player takes over the address of one of their old teammates
+            player.teamnumber = self.addresses.new_team()
+            player.playernumber = self.addresses.add(player)
+            if player.colour == None:
+                player.colour = team.colour
+            player.status &= ~INTEAM
+            player.changed()
+        self.addresses.release_team(team.number)
+        self._event({"e": "deleteteam", "id": teamid})
+        return players
+
+    def addplayer(self, id, name, team=None, colour=None):
+        """
+        Creates a player and adds it to the game, returning the new Player.
+        Players are given the lowest player number free in their team; those
+        without a team are given a team number of their own.
+
+        id: the unique id of the player's gun
+        name: descriptive name for the player
+        team: the Team the player belongs to, if any
+        colour: the player's Colour (ignored if the player is in a team)
+        """
+        if id in self.players:
+            raise GameError("Player already in game: "+str(id))
+        if team != None:
+            player = Player(id, name, team.number, 0)
+            try:
+                player.playernumber = self.addresses.add(player)
+            except AddressError:
+                raise GameError("No player numbers left in team: "+team.name)
+            team.addplayer(player)
+            player.status |= INTEAM
+            player.changed()
+        else:
+            player = Player(id, name, 0, 0, colour)
+            try:
+                player.teamnumber = self.addresses.new_team()
+            except AddressError:
+                raise GameError("No team numbers left")
+            player.playernumber = self.addresses.add(player)
+        self.players[player.id] = player
+        self.leaderboard.add(player)
+        self._event({"e": "addplayer", "id": id, "name": name, "team": team.id if team != None else None,
+            "colour": colour.to_list() if colour != None else None})
+        return player
+
+    def deleteplayer(self, playerid):
+        """
+        Removes a player from the game (and their team).
+
+        playerid: the id of the player
+        """
+        if playerid not in self.players:
+            raise GameError("No such player: "+str(playerid))
+        player = self.players.pop(playerid)
+        self.leaderboard.remove(playerid)
+        self.addresses.remove(player)
+        if not player.status & INTEAM:
+            # they had a team number of their own
+            self.addresses.release_team(player.teamnumber)
+        for team in self.teams.values():
+            if playerid in team.players:
+                team.deleteplayer(playerid)
+        self._event({"e": "deleteplayer", "id": playerid})
+
+    def find_player(self, teamnumber, playernumber):
+        """
+        Returns the player with the given IR team and player numbers, or None.
+        """
+        return self.addresses.index.get((teamnumber, playernumber))
+
+    ############################################################################
+    # Game Play
+    ############################################################################
+    def start(self):
+        if self.status != UNSTARTED:
+            raise GameError("Game has already been started")
+        self.status = ACTIVE
+        self.start_time = time.time()
+        self._event({"e": "start", "t": self.start_time})
+
+    def end(self):
+        if self.status != ACTIVE:
+            raise GameError("Game is not active")
+        self.status = FINISHED
+        self.end_time = time.time()
+        self._event({"e": "end", "t": self.end_time})
+
+    def fire(self, playerid, timestamp=None):
+        """
+        Records a shot fired. Returns the Player, or None if the shot doesn't
+        count.
+
+        playerid: the id of the player who fired
+        timestamp: when the shot arrived (ms since the game started); now, if
+        not given
+        """
+        if self.status != ACTIVE:
+            return None
+        player = self.players.get(playerid)
+        if player != None:
+            player.handle_fire()
+            self.leaderboard.update(player)
+            if timestamp == None:
+                timestamp = self._hittime()
+            self._event({"e": "fire", "id": playerid, "t": timestamp})
+        return player
+
+    def hit(self, shooterteam, shooter, victimteam, victim, sensor):
+        """
+        Records a hit. Returns a (shooter, victim) tuple of Players, or None if
+        the hit doesn't count.
+
+        shooterteam: team number of the shooter
+        shooter: player number of the shooter
+        victimteam: team number of the victim
+        victim: player number of the victim
+        sensor: id of the sensor recording the hit
+        """
+        if self.status != ACTIVE:
+            return None
+        timestamp = self._hittime()
+        self._event({"e": "hits", "t": timestamp, "hits": [[shooterteam, shooter, victimteam, victim, sensor]]})
+        return self._hit(shooterteam, shooter, victimteam, victim, sensor, timestamp)
+
+    def apply_hits(self, hits, timestamp=None):
+        """
+        Records a batch of hits. Returns a list of (shooter, victim) tuples of
+        Players, for the hits that count.
+
+        hits: a list of [shooterteam, shooter, victimteam, victim, sensor] hits
+        timestamp: when the hits arrived (ms since the game started); now, if
+        not given
+        """
+        if self.status != ACTIVE:
+            return []
+        counted = []
+        _hit = self._hit
+        if timestamp == None:
+            timestamp = self._hittime()
+        self._event({"e": "hits", "t": timestamp, "hits": hits})
+        for hit in hits:
+            result = _hit(hit[0], hit[1], hit[2], hit[3], hit[4], timestamp)
+            if result != None:
+                counted.append(result)
+        return counted
+
+    def _hittime(self):
+        """
+        The time since the game started (ms), for the hit log.
+        """
+        return int((time.time() - self.start_time) * 1000)
+
+    def _hit(self, shooterteam, shooter, victimteam, victim, sensor, timestamp):
+        index = self.addresses.index
+        shooting = index.get((shooterteam, shooter))
+        shot = index.get((victimteam, victim))
+        if shooting == None or shot == None or shooting is shot:
+            return None
+        if not shooting.status & shot.status & UP:
+            return None # one of them is out of the game
+        self.hitlog.append(shooterteam, shooter, victimteam, victim, sensor, timestamp)
+        if shooterteam == victimteam:
+            # friendly fire doesn't count as a hit
+            shooting.handle_ffkill()
+            return None
+        shooting.handle_kill()
+        shot.handle_death(timestamp)
+        if self.lives > 0 and shot.deaths >= self.lives:
+            shot.status &= ~UP
+            shot.changed()
+        self.leaderboard.update(shooting)
+        self.leaderboard.update(shot)
+        return (shooting, shot)
+
+    ############################################################################
+    # State
+    ############################################################################
+    @property
+    def runtime(self):
+        """
+        The time the game has been running (hh:mm:ss).
+        """
+        if self.start_time == None:
+            return "00:00:00"
+        finish = self.end_time if self.end_time != None else time.time()
+        elapsed = int(finish - self.start_time)
+        return "{:02d}:{:02d}:{:02d}".format(elapsed // 3600, (elapsed // 60) % 60, elapsed % 60)
+
+    def condition(self, player, timestamp):
+        """
+        Returns what a player's gun is doing at a given time: "up", "down"
+        (just hit), "shielded" (just back up again), "out" (of lives) or
+        "kicked".
+
+        player: the Player
+        timestamp: the time (ms since the game started)
+        """
+        if player.status & KICKED:
+            return "kicked"
+        if not player.status & UP:
+            return "out"
+        if player.last_death != None:
+            since = timestamp - player.last_death
+            if since < self.down_time:
+                return "down"
+            if since < self.down_time + self.shield_time:
+                return "shielded"
+        return "up"
+
+    def state(self):
+        """
+        Returns the game as a dict, ready to be JSONified for gamestate.
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "type": self.type,
+            "maxtime": self.maxtime,
+            "runtime": self.runtime,
+            "status": status_names[self.status],
+            "leaders": [player.id for player in self.leaderboard.top(3)]
+        }
+
+    ############################################################################
+    # Persistence
+    ############################################################################
+    def _event(self, event):
+        if self.onevent != None:
+            self.onevent(event)
+
+    def apply(self, event):
+        """
+        Applies a change, as passed to onevent. Replaying a game's events, in
+        order, onto the game as it was before them brings it up to date.
+
+        event: the change, a dict with "e" naming the kind of change
+        """
+        kind = event["e"]
+        if kind == "hits":
+            self.apply_hits(event["hits"], event["t"])
+        elif kind == "fire":
+            self.fire(event["id"], event.get("t"))
+        elif kind == "addplayer":
+            colour = Colour.from_list(event["colour"]) if event["colour"] != None else None
+            self.addplayer(event["id"], event["name"], self.teams.get(event["team"]), colour)
+        elif kind == "deleteplayer":
+            self.deleteplayer(event["id"])
+        elif kind == "addteam":
+            colour = Colour.from_list(event["colour"]) if event["colour"] != None else None
+            self.addteam(event["name"], colour, event["id"])
+        elif kind == "deleteteam":
+            self.deleteteam(event["id"])
+        elif kind == "start":
+            self.start()
+            self.start_time = event["t"]
+        elif kind == "end":
+            self.end()
+            self.end_time = event["t"]
+        else:
+            raise GameError("Unknown event: "+str(kind))
+
+    def state_message(self):
+        """
+        Returns the gamestate message (bytes), from the cache if possible.
+        """
+        # the name, type and maxtime never change; the leaders only change
+        # when the order of the players does
+        key = (self.status, self.runtime, self.leaderboard.version)
+        if key == self._state_key:
+            statecache.stats.hits += 1
+        else:
+            statecache.stats.misses += 1
+            self._state = statecache.encode_state(self.state())
+            self._state_key = key
+        return self._state
+
+    def to_dict(self, hitlog=True):
+        """
+        Returns everything needed to recreate the game, as a dict.
+
+        hitlog: whether to include the hit log (without it, the game is
+        recreated with an empty one)
+        """
+        data = {
+            "id": self.id,
+            "name": self.name,
+            "type": self.type,
+            "maxtime": self.maxtime,
+            "status": self.status,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "teams": [team.to_dict() for team in self.teams.values()],
+            # in the order they joined, which breaks ties on the leaderboard
+            "players": [player.to_dict() for player in self.players.values()]
+        }
+        if hitlog:
+            data["hitlog"] = binascii.b2a_base64(self.hitlog.serialise()).decode("ascii").strip()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Recreates a game from the dict returned by to_dict().
+        """
+        game = cls(data["id"], data["name"], data["type"], data["maxtime"])
+        if data["status"] not in status_names:
+            raise GameError("Bad status: "+str(data["status"]))
+        game.status = data["status"]
+        game.start_time = data["start_time"]
+        game.end_time = data["end_time"]
+        for p in data["players"]:
+            player = Player.from_dict(p)
+            game.players[player.id] = player
+            game.leaderboard.add(player)
+        for t in data["teams"]:
+            team = Team.from_dict(t, game.players)
+            game.teams[team.id] = team
+        game._readdress()
+        if "hitlog" in data:
+            game.hitlog = HitLog.deserialise(binascii.a2b_base64(data["hitlog"]))
+        return game
+
+    def _readdress(self):
+        """
+        Rebuilds the address book from the numbers of the teams and players,
+        raising GameError if two have the same address, or one is invalid.
+        """
+        addresses = self.addresses
+        try:
+            for team in self.teams.values():
+                addresses.new_team(team.number)
+            for player in self.players.values():
+                if not player.status & INTEAM:
+                    addresses.new_team(player.teamnumber)
+                addresses.add(player, player.playernumber)
+        except AddressError as e:
+            raise GameError("Bad IR address: "+str(e))
+
+    def serialise(self):
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def deserialise(cls, serialised_game):
+        return cls.from_dict(json.loads(serialised_game))
@@ -1,6 +1,7 @@
 from game import *
+from gametypes import gametype
 
+@gametype("ffa")
 class Game_ffa(Game):
-    def __init__(self):
-        super().__init__()
-        print("Initiating FFA")
\ No newline at end of file
+    # every player is their own team, playing to the standard rules
+    __slots__ = ()
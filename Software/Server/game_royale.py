@@ -0,0 +1,8 @@
+from game import *
+from gametypes import gametype
+
+@gametype("royale")
+class Game_royale(Game):
+    # as for ffa, but once hit, a player is out of the game
+    __slots__ = ()
+    RULES = {"lives": 1}
@@ -0,0 +1,13 @@
+from game import *
+from gametypes import gametype
+
+@gametype("teams")
+class Game_teams(Game):
+    # as for ffa, but every player is in a team - and friendly fire doesn't
+    # count, as in any game
+    __slots__ = ()
+
+    def addplayer(self, id, name, team=None, colour=None):
+        if team == None:
+            raise GameError("Player must be in a team: "+str(id))
+        return super().addplayer(id, name, team, colour)
@@ -0,0 +1,95 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# gametypes.py
+# The registry of game types (see GameTypes.md).
+#
+# Each game type is a Game subclass in a game_<type>.py module alongside
+# this one, registered with the @gametype decorator. The modules are all
+# imported once, by discover(), when the server starts; after that, finding
+# the class for a newgame's type is a dict lookup, and a type which isn't
+# registered is rejected without importing anything.
+#
+# A game type sets out how it differs from the standard rules in RULES
+# (see Game). Its rule table - the Game's rule attributes - is built when
+# it is first used, or for every type at once by warming up the registry.
+# ----------------------------------------------------------------------
+import os, importlib
+from game import Game, GameError
+
+# the rule attributes of Game which RULES may change
+RULE_NAMES = ("down_time", "shield_time", "lives")
+
+registry = {} # type: Game subclass
+_ready = set()  # types whose rule tables have been built
+_discovered = False
+
+def gametype(type):
+    """
+    Class decorator registering a Game subclass as the given game type.
+    """
+    def register(cls):
+        for name in cls.RULES:
+            if name not in RULE_NAMES:
+                raise ValueError("Unknown rule for "+type+": "+name)
+        registry[type] = cls
+        return cls
+    return register
+
+def discover(warm=False):
+    """
+    Imports the game_<type>.py modules, registering their game types. Only
+    does anything the first time it's called.
+
+    warm: if True, build every type's rule table now
+    """
+    global _discovered
+    if not _discovered:
+        _discovered = True
+        for filename in sorted(os.listdir(os.path.dirname(os.path.abspath(__file__)))):
+            if filename.startswith("game_") and filename.endswith(".py"):
+                importlib.import_module(filename[:-3])
+    if warm:
+        for type in registry:
+            _prepare(type)
+
+def _prepare(type):
+    cls = registry[type]
+    for name, value in cls.RULES.items():
+        setattr(cls, name, value)
+    _ready.add(type)
+
+def game_class(type):
+    """
+    Returns the Game subclass implementing a game type, raising GameError if
+    there's no such type.
+    """
+    if not _discovered:
+        discover()
+    cls = registry.get(type)
+    if cls == None:
+        raise GameError("Unknown game type: "+repr(type))
+    if type not in _ready:
+        _prepare(type)
+    return cls
+
+def rules(type):
+    """
+    Returns the rules of a game type, as a dict.
+    """
+    cls = game_class(type)
+    return {name: getattr(cls, name) for name in RULE_NAMES}
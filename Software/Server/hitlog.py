@@ -0,0 +1,165 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# hitlog.py
+# Provides HitLog, a compact record of the hits in a game.
+#
+# Rather than one object per hit, each field is stored in its own array
+# (one byte per hit for the team/player/sensor numbers, four for the
+# timestamp), which is about 9 bytes per hit. The arrays are grown by
+# doubling, so appending is cheap however long the game runs.
+#
+# This file is shared by the server and the gun (MicroPython), so keep it
+# to the subset of Python both support.
+# ----------------------------------------------------------------------
+from array import array
+import struct
+
+# column names, array typecodes and item sizes, in serialisation order
+# (MicroPython arrays have no typecode or itemsize attributes)
+COLUMNS = (
+    ("shooterteam", "B", 1),
+    ("shooter", "B", 1),
+    ("victimteam", "B", 1),
+    ("victim", "B", 1),
+    ("sensor", "B", 1),
+    ("timestamp", "I", 4)
+)
+
+MAGIC = b"LSHL"
+HEADER_FORMAT = "<4sBI" # magic, version, count
+VERSION = 1
+
+class HitLog:
+    """
+    Columnar store of hits.
+    """
+    def __init__(self, capacity=64):
+        """
+        capacity: the number of hits to make room for initially
+        """
+        self.count = 0
+        self.capacity = max(capacity, 1)
+        self._setcolumns([array(typecode, [0] * self.capacity) for name, typecode, size in COLUMNS])
+
+    def _setcolumns(self, columns):
+        self.columns = columns
+        (self.shooterteam, self.shooter, self.victimteam, self.victim,
+            self.sensor, self.timestamp) = columns
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        """
+        Doubles the capacity. Fails (on CPython) while a view() is held.
+        """
+        for i in range(len(COLUMNS)):
+            self.columns[i].extend(array(COLUMNS[i][1], [0] * self.capacity))
+        self.capacity *= 2
+
+    def append(self, shooterteam, shooter, victimteam, victim, sensor, timestamp):
+        """
+        Records a hit.
+
+        shooterteam: team number of the shooter
+        shooter: player number of the shooter
+        victimteam: team number of the victim
+        victim: player number of the victim
+        sensor: id of the sensor recording the hit
+        timestamp: the time of the hit (ms)
+        """
+        if self.count == self.capacity:
+            self._grow()
+        i = self.count
+        self.shooterteam[i] = shooterteam
+        self.shooter[i] = shooter
+        self.victimteam[i] = victimteam
+        self.victim[i] = victim
+        self.sensor[i] = sensor
+        self.timestamp[i] = timestamp & 0xFFFFFFFF
+        self.count = i + 1
+
+    def __getitem__(self, i):
+        """
+        Returns hit i as a (shooterteam, shooter, victimteam, victim, sensor,
+        timestamp) tuple.
+        """
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("hit index out of range")
+        return (self.shooterteam[i], self.shooter[i], self.victimteam[i],
+            self.victim[i], self.sensor[i], self.timestamp[i])
+
+    def view(self, name):
+        """
+        Returns a memoryview of one column, covering the hits recorded so far,
+        without copying. Release it before recording more hits.
+
+        name: the column name, eg "victim"
+        """
+        for i in range(len(COLUMNS)):
+            if COLUMNS[i][0] == name:
+                return memoryview(self.columns[i])[:self.count]
+        raise KeyError(name)
+
+    def head(self, count):
+        """
+        Returns a new HitLog holding a copy of the first count hits.
+        """
+        count = max(0, min(count, self.count))
+        log = HitLog()
+        if count > 0:
+            log._setcolumns([column[:count] for column in self.columns])
+            log.count = count
+            log.capacity = count
+        return log
+
+    def serialise(self):
+        """
+        Returns the log as bytes: a header, then each column in turn (in the
+        machine's byte order - little-endian on the ESP32 and x86).
+        """
+        parts = [struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.count)]
+        for column in self.columns:
+            parts.append(bytes(memoryview(column)[:self.count]))
+        return b"".join(parts)
+
+    @staticmethod
+    def deserialise(data):
+        """
+        Returns the HitLog serialised in data.
+        """
+        magic, version, count = struct.unpack_from(HEADER_FORMAT, data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a serialised HitLog")
+        log = HitLog()
+        if count == 0:
+            return log
+        offset = struct.calcsize(HEADER_FORMAT)
+        columns = []
+        for name, typecode, size in COLUMNS:
+            end = offset + count * size
+            if end > len(data):
+                raise ValueError("Truncated HitLog")
+            columns.append(array(typecode, data[offset:end]))
+            offset = end
+        log._setcolumns(columns)
+        log.count = count
+        log.capacity = count
+        return log
@@ -0,0 +1,353 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# hits.py
+# The fast path for hit messages, the highest-frequency topic we handle.
+#
+# Hit messages are JSON arrays: [shooterteam,shooter,victimteam,victim,sensor]
+# or the equivalent fixed-width binary messages (see hitcodec.py).
+# The Runtime drains them from a game's hit queue in batches, and the whole
+# batch is parsed in one go: each run of JSON arrays with a single
+# json.loads by joining them into one, and each run of binary hits with a
+# single iter_unpack, keeping the hits in the order they arrived.
+# A HitDedup then collapses the reports of a single shot from more than one
+# of the victim's sensors, and a FireCorrelator matches each hit to the
+# fire message for its shot.
+# ----------------------------------------------------------------------
+import json, struct, time
+from collections import deque
+from utils import dbg
+from hitcodec import *
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_DEDUP_WINDOW = 5   # ms
+DEFAULT_DEDUP_SIZE = 4096  # (shooter, victim) pairs remembered at once
+DEFAULT_FIRE_WINDOW = 0    # ms; 0 not to correlate hits with fires
+FIRE_RING_SIZE = 8         # fires remembered for each shooter
+HIT_PREFIX = bytes([HIT_MAGIC])
+
+def _valid_hit(hit):
+    if type(hit) is not list or len(hit) != 5:
+        return False
+    for value in hit:
+        # every field is a byte on the wire (and in the HitLog)
+        if type(value) is not int or value < 0 or value > 255:
+            return False
+    return True
+
+def parse_hit(payload):
+    """
+    Parses a single hit message, returning the hit as a list, or None if it
+    isn't a valid hit.
+
+    payload: the hit message (bytes)
+    """
+    try:
+        hit = json.loads(payload)
+    except ValueError:
+        return None
+    return hit if _valid_hit(hit) else None
+
+def parse_hits(payloads, arrivals=None):
+    """
+    Parses a batch of hit messages in one go, returning a list of hits. Any
+    invalid messages are dropped. If arrivals is given, returns (hits, times)
+    with the time each of the hits arrived.
+
+    payloads: a list of hit messages (bytes), JSON or binary
+    arrivals: the time (ms) each of the messages arrived
+    """
+    # the hits are applied in order (who is already down matters), so a
+    # batch mixing the encodings is parsed a run of each at a time
+    hits = []
+    times = [] if arrivals != None else None
+    start = 0
+    while start < len(payloads):
+        binary = payloads[start][:1] == HIT_PREFIX
+        end = start + 1
+        while end < len(payloads) and (payloads[end][:1] == HIT_PREFIX) == binary:
+            end += 1
+        parse = parse_binary_hits if binary else parse_json_hits
+        run = parse(payloads[start:end])
+        if times == None:
+            hits.extend(run)
+        elif len(run) == end - start:
+            hits.extend(run)
+            times.extend(arrivals[start:end])
+        else:
+            # some were dropped: find out which, to keep the times in step
+            for i in range(start, end):
+                hit = parse([payloads[i]])
+                if len(hit) > 0:
+                    hits.append(hit[0])
+                    times.append(arrivals[i])
+        start = end
+    return hits if times == None else (hits, times)
+
+def parse_binary_hits(payloads):
+    """
+    Parses a batch of binary hit messages, returning a list of hits. Any
+    invalid messages are dropped.
+
+    payloads: a list of binary hit messages, all starting with HIT_MAGIC
+    """
+    for payload in payloads:
+        if len(payload) != HIT_SIZE:
+            dbg("hits: dropped invalid hit "+repr(payload))
+            payloads = [payload for payload in payloads if len(payload) == HIT_SIZE]
+            break
+    return [list(hit[1:6]) for hit in struct.iter_unpack(HIT_FORMAT, b"".join(payloads))]
+
+def parse_json_hits(payloads):
+    """
+    Parses a batch of JSON hit messages, returning a list of hits. Any
+    invalid messages are dropped.
+
+    payloads: a list of JSON hit messages
+    """
+    # Each message should contribute exactly one array to the batch. If any
+    # message is malformed, the count (or the parse) comes out wrong, and we
+    # fall back to parsing the messages one at a time to weed it out.
+    hits = None
+    for payload in payloads:
+        if not (payload.startswith(b"[") and payload.endswith(b"]")):
+            break
+    else:
+        try:
+            hits = json.loads(b"[" + b",".join(payloads) + b"]")
+        except ValueError:
+            pass
+    if hits != None and len(hits) == len(payloads):
+        for hit in hits:
+            if not _valid_hit(hit):
+                break
+        else:
+            return hits
+
+    hits = []
+    for payload in payloads:
+        hit = parse_hit(payload)
+        if hit != None:
+            hits.append(hit)
+        else:
+            dbg("hits: dropped invalid hit "+repr(payload))
+    return hits
+
+class HitMeter:
+    """
+    Measures the sustained rate of hits, over intervals of a given length.
+    """
+    def __init__(self, interval=10):
+        """
+        interval: the length (seconds) of each measurement interval
+        """
+        self.interval = interval
+        self.total = 0
+        self.rate = 0.0
+        self._count = 0
+        self._start = time.monotonic()
+
+    def add(self, count):
+        """
+        Counts some hits. Returns the rate (hits/sec) over the interval just
+        finished, or None if the interval isn't over yet.
+
+        count: the number of hits
+        """
+        self.total += count
+        self._count += count
+        now = time.monotonic()
+        elapsed = now - self._start
+        if elapsed < self.interval:
+            return None
+        self.rate = self._count / elapsed
+        self._count = 0
+        self._start = now
+        return self.rate
+
+class HitDedup:
+    """
+    Collapses the reports of one IR shot from several of the victim's sensors
+    (eg their gun and their vest) into a single hit.
+
+    A report is collapsed if the same shooter hit the same victim on another
+    sensor within window ms of the first report. The same sensor reporting
+    again is a new shot. The pairs are remembered oldest first, and only for
+    the window - or until size of them are remembered, when the oldest are
+    forgotten early - so memory is bounded and each check is a dict lookup.
+    """
+    def __init__(self, window=DEFAULT_DEDUP_WINDOW, size=DEFAULT_DEDUP_SIZE):
+        """
+        window: the time (ms) within which reports are of the same shot; 0
+        to collapse nothing
+        size: the most (shooter, victim) pairs remembered
+        """
+        self.window = window
+        self.size = size
+        self.recent = {}     # (shooterteam, shooter, victimteam, victim): [first report, sensors]
+        self.order = deque() # (key, entry), oldest first
+        self.collapsed = 0
+
+    def filter(self, hits, times):
+        """
+        Returns (hits, times) for the hits which aren't duplicates, counting
+        the rest in collapsed.
+
+        hits: a list of [shooterteam, shooter, victimteam, victim, sensor] hits
+        times: the time (ms) each of the hits arrived, in order
+        """
+        if self.window <= 0:
+            return hits, times
+        recent = self.recent
+        order = self.order
+        window = self.window
+        kept = []
+        kept_times = []
+        for i in range(len(hits)):
+            hit = hits[i]
+            now = times[i]
+            # forget the pairs whose window has passed
+            horizon = now - window
+            while len(order) > 0 and order[0][1][0] < horizon:
+                self._forget()
+            key = (hit[0], hit[1], hit[2], hit[3])
+            sensor = 1 << hit[4]
+            entry = recent.get(key)
+            if entry != None and not entry[1] & sensor:
+                entry[1] |= sensor
+                self.collapsed += 1
+                continue
+            entry = [now, sensor]
+            recent[key] = entry
+            order.append((key, entry))
+            if len(order) > self.size:
+                self._forget()
+            kept.append(hit)
+            kept_times.append(now)
+        return kept, kept_times
+
+    def _forget(self):
+        key, entry = self.order.popleft()
+        if self.recent.get(key) is entry:
+            del self.recent[key]
+
+class FireRing:
+    """
+    The last few times a shooter fired, in a ring, with the victims each
+    shot has been matched to, and how many of their shots have hit someone.
+    """
+    __slots__ = ("times", "victims", "head", "fired", "matched")
+
+    def __init__(self, size):
+        self.times = [None] * size   # None if never used
+        self.victims = [None] * size # a set of (team number, player number), once matched
+        self.head = 0                # where the next fire goes
+        self.fired = 0
+        self.matched = 0
+
+class FireCorrelator:
+    """
+    Matches each hit to the shot which made it: the most recent of the
+    shooter's fires, not already matched to that victim, from no more than
+    window ms before. One shot may tag several victims, but counts once
+    towards the shooter's accuracy. Hits without one are rejected, as noise
+    or spoofing. Each shooter's fires are kept in a ring of a fixed size, so
+    a lookup checks at most that many.
+    """
+    def __init__(self, window, size=FIRE_RING_SIZE):
+        """
+        window: the time (ms) a hit may arrive after its fire
+        size: the fires remembered for each shooter
+        """
+        self.window = window
+        self.size = size
+        self.rings = {} # (team number, player number): FireRing
+        self.matched = 0
+        self.rejected = 0
+
+    def fire(self, teamnumber, playernumber, now):
+        """
+        Records a shot fired.
+
+        now: the time (ms) the fire message arrived
+        """
+        key = (teamnumber, playernumber)
+        ring = self.rings.get(key)
+        if ring == None:
+            ring = self.rings[key] = FireRing(self.size)
+        ring.times[ring.head] = now
+        ring.victims[ring.head] = None
+        ring.head = (ring.head + 1) % self.size
+        ring.fired += 1
+
+    def filter(self, hits, times):
+        """
+        Returns (hits, times) for the hits matched to a fire, counting the
+        rest in rejected.
+
+        hits: a list of [shooterteam, shooter, victimteam, victim, sensor] hits
+        times: the time (ms) each of the hits arrived, in order
+        """
+        window = self.window
+        kept = []
+        kept_times = []
+        for i in range(len(hits)):
+            hit = hits[i]
+            now = times[i]
+            ring = self.rings.get((hit[0], hit[1]))
+            slot = self._match(ring, (hit[2], hit[3]), now - window, now) if ring != None else -1
+            if slot >= 0:
+                victims = ring.victims[slot]
+                if victims == None:
+                    # the shot's first victim
+                    ring.victims[slot] = {(hit[2], hit[3])}
+                    ring.matched += 1
+                else:
+                    victims.add((hit[2], hit[3]))
+                self.matched += 1
+                kept.append(hit)
+                kept_times.append(now)
+            else:
+                self.rejected += 1
+        return kept, kept_times
+
+    def _match(self, ring, victim, horizon, now):
+        # returns the slot of the fire matching a hit on victim, or -1. Newest
+        # first: the fires are in time order, so stop at the first one too old
+        times = ring.times
+        victims = ring.victims
+        size = self.size
+        slot = ring.head
+        for i in range(size):
+            slot = slot - 1 if slot > 0 else size - 1
+            fired = times[slot]
+            if fired == None or fired > now:
+                continue
+            if fired < horizon:
+                return -1
+            if victims[slot] == None or victim not in victims[slot]:
+                return slot
+        return -1
+
+    def accuracy(self, teamnumber, playernumber):
+        """
+        Returns the proportion of a shooter's shots matched to hits so far.
+        """
+        ring = self.rings.get((teamnumber, playernumber))
+        if ring == None or ring.fired == 0:
+            return 0
+        return ring.matched / ring.fired
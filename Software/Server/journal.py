@@ -0,0 +1,275 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# journal.py
+# Provides the Journal class, which keeps the server's games on disk so
+# they survive the server crashing.
+#
+# Every change to a game is appended to the journal as an event (see
+# Game.apply). Now and then the server hands over a snapshot of all its
+# games; the snapshot is written out, and the journal starts a new segment
+# file, so recovery only ever has to replay the events since the last
+# snapshot onto it.
+#
+# Segments are memory-mapped, and each record is:
+#     length (uint32), crc32 (uint32), JSON [gameid, event]
+# A zero length marks the end of the segment; a record with a bad crc (ie
+# one that was being written when we crashed) is treated as the end too.
+#
+# Events and snapshots are queued, and written by a thread of their own, so
+# that journalling never holds up the hit path.
+#
+# Optionally, segments covered by a snapshot are moved to an archive
+# directory rather than deleted, keeping every game's complete history for
+# review (see replay.py).
+# ----------------------------------------------------------------------
+import json, mmap, os, queue, struct, threading, time, zlib
+from utils import dbg
+
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+DEFAULT_SNAPSHOT_INTERVAL = 60 # seconds
+FLUSH_INTERVAL = 1 # seconds between flushes to disk, while busy
+
+RECORD_HEADER = "<II"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+SNAPSHOT_FILE = "snapshot.json"
+ARCHIVE_DIRECTORY = "archive"
+SNAPSHOT_VERSION = 1
+
+def segment_name(number):
+    return "journal.{:08d}".format(number)
+
+def segment_numbers(directory):
+    """
+    Returns the numbers of the journal segments in a directory, in order.
+    """
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith("journal."):
+            try:
+                numbers.append(int(name[8:]))
+            except ValueError:
+                pass
+    return sorted(numbers)
+
+def read_records(path):
+    """
+    Yields the (gameid, event) records in a journal segment, stopping at the
+    end of the segment or the first damaged record.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD_HEADER_SIZE <= len(data):
+        length, crc = struct.unpack_from(RECORD_HEADER, data, offset)
+        if length == 0:
+            return
+        start = offset + RECORD_HEADER_SIZE
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            dbg("journal: damaged record at {} in {}".format(offset, path))
+            return
+        record = json.loads(payload)
+        yield record[0], record[1]
+        offset = start + length
+
+def history(directory, gameid):
+    """
+    Reads back a game's complete history from a journal directory, including
+    its archive. Returns the game as created (a Game.to_dict() dict) and a
+    list of its events since, or (None, []) if it isn't there.
+    """
+    segments = []
+    for folder in (os.path.join(directory, ARCHIVE_DIRECTORY), directory):
+        if os.path.isdir(folder):
+            for number in segment_numbers(folder):
+                segments.append((number, os.path.join(folder, segment_name(number))))
+    created = None
+    events = []
+    for number, path in sorted(segments):
+        for recordid, event in read_records(path):
+            if recordid != gameid:
+                continue
+            if event["e"] == "newgame":
+                created = event["game"]
+                events = []
+            elif created != None:
+                events.append(event)
+    return created, events
+
+def recover(directory):
+    """
+    Reads back what has been journalled in a directory. Returns the games as
+    at the last snapshot (a dict of Game.to_dict() dicts, by id), and a list
+    of the (gameid, event) records since.
+    """
+    games = {}
+    first = None
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            snapshot = json.load(f)
+        games = snapshot["games"]
+        first = snapshot["segment"]
+    events = []
+    if os.path.isdir(directory):
+        for number in segment_numbers(directory):
+            # older segments are left over from before the snapshot
+            if first == None or number >= first:
+                events.extend(read_records(os.path.join(directory, segment_name(number))))
+    return games, events
+
+class Journal:
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, archive=False):
+        """
+        Initialises the journal.
+
+        directory: where the journal segments and snapshot are kept
+        segment_size: the initial size of each segment (bytes); they grow if
+        needed
+        archive: if True, keep old segments in the archive subdirectory
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.archive = archive
+        self.segment = None
+        self.records = 0
+        self.snapshots = 0
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._file = None
+        self._map = None
+        self._offset = 0
+
+    def start(self):
+        """
+        Opens a new segment and starts the writer thread. Call after recover().
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        archive = os.path.join(self.directory, ARCHIVE_DIRECTORY)
+        if self.archive:
+            os.makedirs(archive, exist_ok=True)
+        # segment numbers keep on rising, even past the archived ones
+        numbers = segment_numbers(self.directory)
+        if os.path.isdir(archive):
+            numbers += segment_numbers(archive)
+        self._open(max(numbers) + 1 if len(numbers) > 0 else 1)
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def stop(self):
+        """
+        Writes anything still queued, and stops the writer thread.
+        """
+        self._queue.put(None)
+        self._writer.join()
+        self._close()
+
+    def append(self, gameid, event):
+        """
+        Queues an event to be journalled. Doesn't block.
+
+        gameid: the id of the game the event belongs to
+        event: the event (see Game.apply), or a server event such as newgame
+        """
+        self._queue.put((gameid, event))
+
+    def snapshot(self, games):
+        """
+        Queues a snapshot to be written. Everything appended before it is
+        covered by the snapshot; everything after goes into a new segment.
+
+        games: a dict of Game.to_dict() dicts, by id
+        """
+        self._queue.put(games)
+
+    ############################################################################
+    # Writer thread
+    ############################################################################
+    def _write(self):
+        flushed = time.monotonic()
+        while True:
+            item = self._queue.get()
+            if item == None:
+                return
+            try:
+                if isinstance(item, dict):
+                    self._write_snapshot(item)
+                else:
+                    self._write_record(json.dumps(item, separators=(",", ":")).encode("utf-8"))
+            except Exception as e:
+                dbg("journal: error writing: "+repr(e))
+            # flush once we've caught up, or every so often if we never do
+            now = time.monotonic()
+            if self._queue.empty() or now - flushed >= FLUSH_INTERVAL:
+                self._map.flush()
+                flushed = now
+
+    def _write_record(self, payload):
+        size = RECORD_HEADER_SIZE + len(payload)
+        # always leave room for the zero length marking the end
+        if self._offset + size + RECORD_HEADER_SIZE > len(self._map):
+            self._grow(self._offset + size + RECORD_HEADER_SIZE)
+        struct.pack_into(RECORD_HEADER, self._map, self._offset, len(payload), zlib.crc32(payload))
+        self._map[self._offset + RECORD_HEADER_SIZE:self._offset + size] = payload
+        self._offset += size
+        self.records += 1
+
+    def _write_snapshot(self, games):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        snapshot = {"version": SNAPSHOT_VERSION, "segment": self.segment + 1, "games": games}
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.snapshots += 1
+        # the old segments are covered by the snapshot now
+        old = self.segment
+        self._close()
+        self._open(old + 1)
+        for number in segment_numbers(self.directory):
+            if number <= old:
+                path = os.path.join(self.directory, segment_name(number))
+                if self.archive:
+                    os.replace(path, os.path.join(self.directory, ARCHIVE_DIRECTORY, segment_name(number)))
+                else:
+                    os.remove(path)
+
+    def _open(self, number):
+        self.segment = number
+        self._file = open(os.path.join(self.directory, segment_name(number)), "w+b")
+        self._file.truncate(self.segment_size)
+        self._map = mmap.mmap(self._file.fileno(), self.segment_size)
+        self._offset = 0
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def _close(self):
+        if self._map != None:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
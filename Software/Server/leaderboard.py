@@ -0,0 +1,260 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# leaderboard.py
+# Provides the Leaderboard class, which keeps a game's players ranked by
+# score as the game goes on.
+#
+# The ranking is an indexable skiplist: a skiplist whose links also record
+# how many entries they skip, so we can find the entry at a given position
+# (or the position of an entry) as quickly as we can find the entry itself.
+# Updating a player's score, and looking up their rank, take O(log n); the
+# top k players, or the k either side of a player, take O(log n + k).
+# ----------------------------------------------------------------------
+import math, random
+
+MAX_LEVELS = 16 # plenty for 65536 players
+
+class _End:
+    """
+    Sentinel value at the end of the skiplist, greater than any entry.
+    """
+    def __lt__(self, other):
+        return False
+    def __le__(self, other):
+        return False
+    def __gt__(self, other):
+        return True
+    def __ge__(self, other):
+        return True
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels  # the next node at each level
+        self.width = [1] * levels    # the number of positions each link skips
+
+class IndexableSkiplist:
+    """
+    A sorted collection of unique values, supporting access by position.
+    """
+    def __init__(self, end=None):
+        """
+        end: a value greater than any that will be inserted, if there is one
+        (comparing with it is quicker than with the default)
+        """
+        self.size = 0
+        self.levels = 1 # the number of levels in use
+        self.end = _Node(end if end != None else _End(), 0)
+        self.head = _Node(None, MAX_LEVELS)
+        self.head.next = [self.end] * MAX_LEVELS
+
+    def __len__(self):
+        return self.size
+
+    def _chain(self, value):
+        """
+        Returns the last node before value at each level in use, and the
+        position of each of those nodes (the head being at position -1).
+        """
+        chain = [self.head] * MAX_LEVELS
+        positions = [-1] * MAX_LEVELS
+        node = self.head
+        position = -1
+        for level in range(self.levels - 1, -1, -1):
+            following = node.next[level]
+            while following.value < value:
+                position += node.width[level]
+                node = following
+                following = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, value):
+        chain, positions = self._chain(value)
+        # a level for each halving of the size is enough; any more just slows
+        # every search down
+        limit = min(MAX_LEVELS, (self.size + 1).bit_length())
+        levels = 1
+        while levels < limit and random.getrandbits(1):
+            levels += 1
+        if levels > self.levels:
+            # bring the new levels into use: the head links straight to the end
+            for level in range(self.levels, levels):
+                self.head.next[level] = self.end
+                self.head.width[level] = self.size + 1
+            self.levels = levels
+        node = _Node(value, levels)
+        position = positions[0] + 1 # the new node's position
+        for level in range(levels):
+            before = chain[level]
+            node.next[level] = before.next[level]
+            before.next[level] = node
+            skipped = position - positions[level]
+            node.width[level] = before.width[level] - skipped + 1
+            before.width[level] = skipped
+        for level in range(levels, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain, positions = self._chain(value)
+        node = chain[0].next[0]
+        if node is self.end or node.value != value:
+            raise KeyError(value)
+        self._unlink(chain, node)
+
+    def replace(self, old, new):
+        """
+        Replaces one value with another: the same as removing old and
+        inserting new, but quicker if new belongs in the same position.
+        Returns True if the value moved, False if it stayed in place.
+        """
+        chain, positions = self._chain(old)
+        node = chain[0].next[0]
+        if node is self.end or node.value != old:
+            raise KeyError(old)
+        before = chain[0]
+        if (before is self.head or before.value < new) and new < node.next[0].value:
+            node.value = new
+            return False
+        self._unlink(chain, node)
+        self.insert(new)
+        return True
+
+    def _unlink(self, chain, node):
+        for level in range(len(node.next)):
+            before = chain[level]
+            before.width[level] += node.width[level] - 1
+            before.next[level] = node.next[level]
+        for level in range(len(node.next), self.levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, value):
+        """
+        Returns the position of value. Raises KeyError if it isn't present.
+        """
+        chain, positions = self._chain(value)
+        node = chain[0].next[0]
+        if node is self.end or node.value != value:
+            raise KeyError(value)
+        return positions[0] + 1
+
+    def _node(self, position):
+        node = self.head
+        remaining = position + 1
+        for level in range(self.levels - 1, -1, -1):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, position):
+        if position < 0 or position >= self.size:
+            raise IndexError("skiplist index out of range")
+        return self._node(position).value
+
+    def slice(self, start, count):
+        """
+        Returns a list of up to count values, starting at position start.
+        """
+        start = max(start, 0)
+        if start >= self.size:
+            return []
+        values = []
+        node = self._node(start)
+        while node is not self.end and len(values) < count:
+            values.append(node.value)
+            node = node.next[0]
+        return values
+
+class Leaderboard:
+    """
+    The players of a game, ranked by score (highest first). Players with the
+    same score are ranked in the order they joined.
+    """
+    def __init__(self):
+        # the ranking holds (-score, join order) keys; the join order is unique
+        # and tells us which player the key belongs to
+        self._ranking = IndexableSkiplist((math.inf,))
+        self._keys = {}    # player id: the player's key
+        self._players = {} # join order: player
+        self._joined = 0
+        self.version = 0   # changes whenever the order of the players does
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def add(self, player):
+        """
+        Adds a player to the leaderboard.
+        """
+        key = (-player.score, self._joined)
+        self._joined += 1
+        self._keys[player.id] = key
+        self._players[key[1]] = player
+        self._ranking.insert(key)
+        self.version += 1
+
+    def remove(self, playerid):
+        """
+        Removes a player from the leaderboard.
+        """
+        key = self._keys.pop(playerid)
+        del self._players[key[1]]
+        self._ranking.remove(key)
+        self.version += 1
+
+    def update(self, player):
+        """
+        Re-ranks a player after their score has changed.
+        """
+        key = self._keys[player.id]
+        if key[0] == -player.score:
+            return
+        new = (-player.score, key[1])
+        self._keys[player.id] = new
+        if self._ranking.replace(key, new):
+            self.version += 1
+
+    def rank(self, playerid):
+        """
+        Returns a player's rank (1 for the leader).
+        """
+        return self._ranking.index(self._keys[playerid]) + 1
+
+    def top(self, count):
+        """
+        Returns the count highest-scoring players, highest first.
+        """
+        players = self._players
+        return [players[key[1]] for key in self._ranking.slice(0, count)]
+
+    def around(self, playerid, count):
+        """
+        Returns the players ranked up to count places either side of a player
+        (and the player themselves), highest first, along with the rank of the
+        first of them.
+        """
+        position = self.rank(playerid) - 1
+        start = max(position - count, 0)
+        players = self._players
+        return [players[key[1]] for key in self._ranking.slice(start, position + count + 1 - start)], start + 1
@@ -1,67 +1,166 @@
-class Player:    
-    # id
-    @property
-    def id(self):
-        return self._id
-    @id.setter
-    def id(self, id):
-        if not isinstance(id, int):
+import json
+from colour import *
+import statecache
+
+# status bitfield, as described for the playerstate message
+INGAME = 1
+INTEAM = 2
+UP = 4
+KICKED = 8
+
+def check_count(value):
+    """
+    Returns a counter (a non-negative int), raising TypeError or ValueError if
+    it isn't one.
+    """
+    if type(value) is not int:
+        raise TypeError
+    if value < 0:
+        raise ValueError("Negative count: "+str(value))
+    return value
+
+class Player:
+    # Players are checked when they're created (or deserialised), and the
+    # attributes are plain slots after that: the counters change on every
+    # shot and hit, and a venue keeps thousands of players
+    __slots__ = ("id", "name", "teamnumber", "playernumber", "colour", "shots", "kills", "ffkills",
+        "deaths", "score", "status", "last_death", "_state")
+
+    def __init__(self, id, name, teamnumber, playernumber, colour=None):
+        """
+        Initialises the player.
+
+        id: a GUID (unique to each gun)
+        name: descriptive name for the player
+        teamnumber: the team number (0-255) used for IR codes
+        playernumber: the player number (0-255) used for IR codes
+        colour: the player's Colour, if any
+        """
+        if not isinstance(id, (int, str)) or not isinstance(name, str):
             raise TypeError
-        self._id = id
-    
-    # name
-    @property
-    def name(self):
-        return self._name
-    @name.setter
-    def name(self, name):
-        if not isinstance(name, str):
+        if type(teamnumber) is not int or type(playernumber) is not int:
             raise TypeError
-        self._name = name
-
-    # colour
-    @property
-    def colour(self):
-        return self._colour
-    @colour.setter
-    def colour(self, colour):
-        colourOK = (colour == None) or (isinstance(colour, Colour))
-        if not colourOK:
+        if not (colour == None or isinstance(colour, Colour)):
             raise TypeError
-        self._name = colour
-
-    def __init__(self, id, name, teamnumber, playernumber):
         self.id = id
-        self.name = name 
-        self.teamnumber = teamnumber 
+        self.name = name
+        self.teamnumber = teamnumber
         self.playernumber = playernumber
-        self.colour = None 
+        self.colour = colour
         self.shots = 0
         self.kills = 0
         self.ffkills = 0
         self.deaths = 0
         self.score = 0
-        # TODO initial status
-
-    # TODO properties
-    # id - a GUID (unique to each gun)
-    # name    
-    # teamnumber (0-255) used for IR code
-    # playernumber (0-255) used for IR code
-    # colour
-    # shots (int)
-    # kills (int)
-    # ffkills (int)
-    # deaths (int)
-    # score (int)
-    # status (up, down, kicked)
-    # state (MQTT state message)
-
-    # TODO methods
-    # handle_fire
-    # handle_kill
-    # handle_death
-    # serialise (JSON)
-    # deserialise (JSON)
-    
-    pass
\ No newline at end of file
+        self.status = INGAME | UP
+        self.last_death = None # when last hit (ms since the game started)
+        self._state = None     # the encoded playerstate message, until it changes
+
+    def _update_score(self):
+        """
+        Score is (kills - deaths) + (kills / shots): net kills, with accuracy
+        as the tiebreaker.
+        """
+        accuracy = self.kills / self.shots if self.shots > 0 else 0
+        self.score = (self.kills - self.deaths) + accuracy
+
+    def handle_fire(self):
+        # called for every shot, so _update_score() is inlined (shots > 0)
+        shots = self.shots + 1
+        self.shots = shots
+        self.score = (self.kills - self.deaths) + self.kills / shots
+        self._state = None
+
+    def handle_kill(self):
+        self.kills += 1
+        self._update_score()
+        self._state = None
+
+    def handle_ffkill(self):
+        self.ffkills += 1
+        self._state = None
+
+    def handle_death(self, timestamp=None):
+        self.deaths += 1
+        self.last_death = timestamp
+        self._update_score()
+        self._state = None
+
+    def changed(self):
+        """
+        Call after changing the player's attributes directly (rather than via
+        the methods above), so the playerstate message is brought up to date.
+        """
+        self._state = None
+
+    def state_message(self):
+        """
+        Returns the playerstate message (bytes), from the cache if possible.
+        """
+        if self._state != None:
+            statecache.stats.hits += 1
+        else:
+            statecache.stats.misses += 1
+            self._state = statecache.encode_state(self.state())
+        return self._state
+
+    def state(self):
+        """
+        Returns the player as a dict, ready to be JSONified for playerstate.
+        """
+        colour = self.colour
+        return {
+            "id": self.id,
+            "name": self.name,
+            "playernumber": self.playernumber,
+            "teamnumber": self.teamnumber,
+            "colour": [colour.red, colour.green, colour.blue] if colour != None else [0,0,0],
+            "shots": self.shots,
+            "kills": self.kills,
+            "ffkills": self.ffkills,
+            "deaths": self.deaths,
+            "score": self.score,
+            "status": self.status
+        }
+
+    def to_dict(self):
+        """
+        Returns everything needed to recreate the player, as a dict.
+        """
+        colour = self.colour
+        return {
+            "id": self.id,
+            "name": self.name,
+            "teamnumber": self.teamnumber,
+            "playernumber": self.playernumber,
+            "colour": colour.to_list() if colour != None else None,
+            "shots": self.shots,
+            "kills": self.kills,
+            "ffkills": self.ffkills,
+            "deaths": self.deaths,
+            "status": self.status,
+            "last_death": self.last_death
+        }
+
+    @staticmethod
+    def from_dict(data):
+        """
+        Recreates a player from the dict returned by to_dict().
+        """
+        colour = Colour.from_list(data["colour"]) if data["colour"] != None else None
+        player = Player(data["id"], data["name"], data["teamnumber"], data["playernumber"], colour)
+        player.shots = check_count(data["shots"])
+        player.kills = check_count(data["kills"])
+        player.ffkills = check_count(data["ffkills"])
+        player.deaths = check_count(data["deaths"])
+        player.status = check_count(data["status"])
+        player.last_death = data.get("last_death")
+        player._update_score()
+        return player
+
+    def serialise(self):
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @staticmethod
+    def deserialise(serialised_player):
+        return Player.from_dict(json.loads(serialised_player))
\ No newline at end of file
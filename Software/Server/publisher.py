@@ -0,0 +1,180 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# publisher.py
+# Provides the Publisher, which schedules the server's outgoing messages.
+#
+# When a lot of hits land at once, the server can announce the same thing
+# several times over in a few milliseconds - and every gun has to read each
+# message in its single-threaded check_msg() loop. So, rather than going
+# straight out, messages are held for a short window and published
+# together:
+# - control messages (gamestarted, gameended, kicked...) aren't held at all,
+#   nor are messages clearing a retained topic (the last a client is sent)
+# - a state message replaces any of the same kind still waiting for the
+#   same topic, since it supersedes it
+# - the rest wait their turn, in order
+# Each client (a player, or all the players in a game) has a token bucket
+# limiting how many messages a second it is sent; messages over the limit
+# wait for a later window. Control messages are never limited.
+# ----------------------------------------------------------------------
+import time
+
+# priorities, by the last level of the topic
+CONTROL = 0
+NORMAL = 1
+STATE = 2
+
+PRIORITIES = {
+    "gamestarted": CONTROL,
+    "gameended": CONTROL,
+    "gamedeleted": CONTROL,
+    "kicked": CONTROL,
+    "deleted": CONTROL,
+    "gamestate": STATE,
+    "teamstate": STATE,
+    "playerstate": STATE,
+    "scoreboard": STATE,
+    "snapshot": STATE,
+    "up": STATE,
+    "down": STATE
+}
+
+# state messages superseding each other, where it isn't just the same topic
+SUPERSEDES = {
+    "up": "updown",
+    "down": "updown"
+}
+
+def client_of(topic):
+    """
+    Returns the client a topic is addressed to: stramash/player/<playerid>
+    or stramash/game/<gameid>, or None for anything else.
+    """
+    levels = topic.split("/")
+    if len(levels) > 3 and levels[1] in ("player", "game"):
+        return levels[1]+"/"+levels[2]
+    return None
+
+class TokenBucket:
+    """
+    Allows rate events a second on average, in bursts of up to rate.
+    """
+    def __init__(self, rate, now):
+        self.rate = rate
+        self.tokens = rate
+        self.time = now
+
+    def take(self, now):
+        """
+        Returns True, using up a token, if there is one available.
+        """
+        self.tokens = min(self.rate, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class Publisher:
+    def __init__(self, publish, window=0, client_rate=0):
+        """
+        Initialises the publisher.
+
+        publish: callable(topic, message, retain) which actually sends messages
+        window: the time (ms) messages are held for; 0 to send everything
+        straight away
+        client_rate: the most messages a second each client is sent; 0 for
+        no limit
+        """
+        self.publish = publish
+        self.window = window
+        self.client_rate = client_rate
+        self.pending = {} # key: [topic, message, retain], in order
+        self.buckets = {} # client: TokenBucket
+        self._next = 0    # for the keys of messages which don't supersede
+        self.published = 0
+        self.superseded = 0
+        self.deferred = 0
+
+    def send(self, topic, msg, retain=False):
+        """
+        Publishes a message, or schedules it to be published by flush().
+        """
+        action = topic[topic.rfind("/") + 1:]
+        priority = PRIORITIES.get(action, NORMAL)
+        if priority == CONTROL or self.window <= 0 or (retain and len(msg) == 0):
+            self._publish(topic, msg, retain)
+            return
+        if priority == STATE:
+            key = topic[:len(topic) - len(action)] + SUPERSEDES.get(action, action)
+            if key in self.pending:
+                self.superseded += 1
+                # keep its place in the queue, with the latest message
+                self.pending[key] = [topic, msg, retain]
+                return
+        else:
+            key = self._next
+            self._next += 1
+        self.pending[key] = [topic, msg, retain]
+
+    def flush(self, now=None):
+        """
+        Publishes the messages waiting, unless their client is over its rate.
+        Called every window by the Runtime.
+
+        now: the time (time.monotonic()); now, if not given
+        """
+        if len(self.pending) == 0:
+            return
+        if now == None:
+            now = time.monotonic()
+        pending = self.pending
+        self.pending = {}
+        held = set() # clients over their rate: keep the rest of theirs in order
+        for key, (topic, msg, retain) in pending.items():
+            if self.client_rate > 0:
+                client = client_of(topic)
+                if client != None:
+                    if client in held or not self._bucket(client, now).take(now):
+                        held.add(client)
+                        self.pending[key] = [topic, msg, retain]
+                        self.deferred += 1
+                        continue
+            self._publish(topic, msg, retain)
+
+    def forget(self, client):
+        """
+        Drops the rate limit (and any waiting messages) for a client which
+        has gone, eg a deleted game.
+
+        client: as returned by client_of()
+        """
+        self.buckets.pop(client, None)
+        prefix = "stramash/"+client+"/"
+        for key in [key for key, item in self.pending.items() if item[0].startswith(prefix)]:
+            del self.pending[key]
+
+    def _bucket(self, client, now):
+        bucket = self.buckets.get(client)
+        if bucket == None:
+            bucket = self.buckets[client] = TokenBucket(self.client_rate, now)
+        return bucket
+
+    def _publish(self, topic, msg, retain):
+        self.published += 1
+        self.publish(topic, msg, retain)
@@ -0,0 +1,201 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# replay.py
+# Provides the Replay class, which reconstructs a game as it was at any
+# point in its history, for settling disputes and reviewing games.
+#
+# A game's history is read from the journal (see journal.history - the
+# server needs Server:journal_archive on to keep it all). Replaying it once
+# builds an index: the game time of each event, and a checkpoint of the
+# whole game every so many events. Seeking then only has to load the
+# nearest checkpoint and replay the few events after it. The hit log only
+# ever grows, so a checkpoint records how long it was rather than a copy of
+# it, and seeking takes that many hits from the log of the whole game.
+#
+# Usage: python replay.py <journal directory> <gameid> [interval]
+# ----------------------------------------------------------------------
+import sys
+from bisect import bisect_right
+from utils import dbg
+from game import GameError, status_names
+from gametypes import game_class
+from journal import history
+
+DEFAULT_CHECKPOINT_INTERVAL = 100
+
+def format_time(ms):
+    """
+    Returns a game time (ms) as hh:mm:ss.
+    """
+    seconds = int(ms // 1000)
+    return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+def parse_time(text):
+    """
+    Returns the game time (ms) given as [[hh:]mm:]ss.
+    """
+    seconds = 0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    return int(seconds * 1000)
+
+class Replay:
+    def __init__(self, created, events, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Initialises the replay, indexing the game's history.
+
+        created: the game as created (a Game.to_dict() dict)
+        events: the game's events since, in order (see Game.apply)
+        interval: the number of events between checkpoints
+        """
+        self.created = created
+        self.events = events
+        self.interval = interval
+        self.gameclass = game_class(created["type"])
+        self.times = []       # the game time (ms) of each event
+        self.checkpoints = [] # (the game, hits in its log) after 0, interval, 2 * interval... events
+        game = self.gameclass.from_dict(created)
+        time = 0
+        for i, event in enumerate(events):
+            if i % interval == 0:
+                self.checkpoints.append((game.to_dict(False), len(game.hitlog)))
+            self._apply(game, event)
+            time = self._event_time(game, event, time)
+            self.times.append(time)
+        if len(events) % interval == 0:
+            self.checkpoints.append((game.to_dict(False), len(game.hitlog)))
+        self.hitlog = game.hitlog # the whole game's
+
+    def __len__(self):
+        return len(self.events)
+
+    def _apply(self, game, event):
+        try:
+            game.apply(event)
+        except GameError as e:
+            dbg("replay: couldn't apply "+event["e"]+": "+repr(e))
+
+    def _event_time(self, game, event, previous):
+        """
+        Returns the game time (ms) of an event, given the game after it and
+        the time of the event before.
+        """
+        kind = event["e"]
+        if kind in ("hits", "fire") and event.get("t") != None:
+            return event["t"]
+        if kind == "start":
+            return 0
+        if kind == "end" and game.start_time != None:
+            return int((event["t"] - game.start_time) * 1000)
+        return previous
+
+    def seek(self, count):
+        """
+        Returns the Game as it was after its first count events.
+        """
+        count = max(0, min(count, len(self.events)))
+        checkpoint = count // self.interval
+        data, hits = self.checkpoints[checkpoint]
+        game = self.gameclass.from_dict(data)
+        game.hitlog = self.hitlog.head(hits)
+        for event in self.events[checkpoint * self.interval:count]:
+            self._apply(game, event)
+        return game
+
+    def time(self, count):
+        """
+        Returns the game time (ms) after the first count events.
+        """
+        return self.times[count - 1] if count > 0 else 0
+
+    def at(self, time):
+        """
+        Returns the number of events that had happened by a given game time
+        (ms). Pass it to seek() for the game as it was then.
+        """
+        return bisect_right(self.times, time)
+
+def describe(game, time):
+    """
+    Returns a description of a game at a given game time (ms), as lines of
+    text.
+    """
+    lines = ["{} ({}) {} at {}".format(game.name, game.type, status_names[game.status], format_time(time))]
+    lines.append("{:>4} {:<20} {:>4} {:>6} {:>6} {:>6} {:>8}  {}".format(
+        "rank", "player", "team", "shots", "kills", "deaths", "score", "condition"))
+    for rank, player in enumerate(game.leaderboard.top(len(game.players))):
+        lines.append("{:>4} {:<20} {:>4} {:>6} {:>6} {:>6} {:>8.3f}  {}".format(rank + 1, player.name,
+            player.teamnumber, player.shots, player.kills, player.deaths, player.score, game.condition(player, time)))
+    return lines
+
+def describe_event(event):
+    """
+    Returns a one-line description of an event.
+    """
+    details = ", ".join("{}={}".format(key, value) for key, value in event.items() if key != "e")
+    return event["e"] + ((": " + details) if details != "" else "")
+
+def main(args):
+    if len(args) < 2:
+        print("Usage: python replay.py <journal directory> <gameid> [interval]")
+        return
+    created, events = history(args[0], args[1])
+    if created == None:
+        print("No such game in the journal: "+args[1])
+        return
+    replay = Replay(created, events, int(args[2]) if len(args) > 2 else DEFAULT_CHECKPOINT_INTERVAL)
+    print("{} events, {} checkpoints".format(len(replay), len(replay.checkpoints)))
+    print("n [k]: forward k events, p [k]: back k events, g <n>: go to event n, t <[hh:]mm:ss>: go to time, q: quit")
+
+    position = 0
+    while True:
+        game = replay.seek(position)
+        time = replay.time(position)
+        print()
+        if position > 0:
+            print("event {}/{}: {}".format(position, len(replay), describe_event(events[position - 1])))
+        else:
+            print("event 0/{}: (created)".format(len(replay)))
+        for line in describe(game, time):
+            print(line)
+
+        try:
+            command = input("> ").split()
+        except EOFError:
+            return
+        if len(command) == 0:
+            command = ["n"]
+        try:
+            if command[0] == "q":
+                return
+            elif command[0] == "n":
+                position += int(command[1]) if len(command) > 1 else 1
+            elif command[0] == "p":
+                position -= int(command[1]) if len(command) > 1 else 1
+            elif command[0] == "g":
+                position = int(command[1])
+            elif command[0] == "t":
+                position = replay.at(parse_time(command[1]))
+            else:
+                print("Unknown command: "+command[0])
+        except (IndexError, ValueError):
+            print("Bad command")
+        position = max(0, min(position, len(replay)))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
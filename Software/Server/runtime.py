@@ -0,0 +1,281 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# runtime.py
+# Provides the asyncio Runtime which feeds MQTT messages to the Server.
+#
+# The MQTT client runs its network loop in its own thread and hands each
+# message to Runtime.submit(), which notes when it arrived. Messages are
+# queued per game - with hits and fires in a lane of their own - and each
+# queue is drained by its own task, so a slow handler only ever holds up
+# the queue it is working on. Hits are drained in batches, and handed to
+# the server's hit_batch() together; the fires among them are handled in
+# order, so each is recorded before the hits which follow it.
+# If the server has a journal, the runtime also has it snapshot the games
+# every so often, and it has the server publish the gamedelta stream, flush
+# its Publisher every publish window, and run its timers every tick.
+# ----------------------------------------------------------------------
+import asyncio, time
+from utils import dbg
+from hits import DEFAULT_BATCH_SIZE
+from journal import DEFAULT_SNAPSHOT_INTERVAL
+from server import DEFAULT_DELTA_INTERVAL
+
+DEFAULT_QUEUE_SIZE = 1024
+
+class GameChannel:
+    """
+    The queues, and the tasks draining them, for a single game.
+    """
+    def __init__(self, gameid, queue_size):
+        self.gameid = gameid
+        self.hits = asyncio.Queue(queue_size)
+        self.control = asyncio.Queue(queue_size)
+        self.tasks = []
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+class Runtime:
+    def __init__(self, server, queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+            snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, delta_interval=DEFAULT_DELTA_INTERVAL):
+        """
+        Initialises the runtime.
+
+        server: the Server whose handlers will process the messages
+        queue_size: the maximum number of messages waiting in each queue
+        batch_size: the maximum number of hits handled in one batch
+        snapshot_interval: the time (seconds) between snapshots of the games,
+        if the server has a journal
+        delta_interval: the time (seconds) between gamedelta messages; 0 not
+        to publish them
+        """
+        self.server = server
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.snapshot_interval = snapshot_interval
+        self.delta_interval = delta_interval
+        self.loop = None
+        self.lobby = None
+        self.channels = {}
+        self.dropped = 0
+        self._stopped = None
+
+    def start(self):
+        """
+        Creates the lobby queue and its task. Must be called from within the
+        event loop, before any messages are submitted.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self.lobby = asyncio.Queue(self.queue_size)
+        self.lobby_task = asyncio.create_task(self._worker(self.lobby, None))
+        self.snapshot_task = None
+        if self.server.journal != None:
+            self.snapshot_task = asyncio.create_task(self._snapshots())
+        self.delta_task = None
+        if self.delta_interval > 0:
+            self.delta_task = asyncio.create_task(self._deltas())
+        self.flush_task = None
+        if self.server.publisher.window > 0:
+            self.flush_task = asyncio.create_task(self._flushes())
+        self.tick_task = asyncio.create_task(self._ticks())
+
+    async def run(self):
+        """
+        Runs until stop() is called.
+        """
+        if self.loop == None:
+            self.start()
+        await self._stopped.wait()
+        for channel in list(self.channels.values()):
+            channel.close()
+        self.channels = {}
+        self.lobby_task.cancel()
+        self.tick_task.cancel()
+        if self.snapshot_task != None:
+            self.snapshot_task.cancel()
+        if self.delta_task != None:
+            self.delta_task.cancel()
+        if self.flush_task != None:
+            self.flush_task.cancel()
+            self.server.publisher.flush()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stopped.set)
+
+    def submit(self, topic, payload):
+        """
+        Queues a message for processing. Safe to call from any thread (ie the
+        MQTT network thread).
+
+        topic: the MQTT topic
+        payload: the MQTT payload (bytes)
+        """
+        self.loop.call_soon_threadsafe(self.enqueue, topic, payload)
+
+    def enqueue(self, topic, payload):
+        """
+        Queues a message for processing, noting when it arrived. Must be
+        called from the event loop. Messages are dropped if their queue is
+        full.
+
+        topic: the MQTT topic
+        payload: the MQTT payload (bytes)
+        """
+        handler, params = self.server.router.match(topic)
+        if handler == None:
+            return
+        gameid = params.get("gameid")
+        if gameid == None:
+            queue = self.lobby
+        elif gameid in self.server.games:
+            channel = self.channel(gameid)
+            fast = topic.endswith("/hit") or topic.endswith("/fire")
+            queue = channel.hits if fast else channel.control
+        else:
+            return # no such game
+        try:
+            queue.put_nowait((handler, params, payload, time.monotonic() * 1000))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            dbg("runtime: queue full, dropped "+topic)
+
+    def channel(self, gameid):
+        """
+        Returns the GameChannel for a game, creating it if needed.
+        """
+        channel = self.channels.get(gameid)
+        if channel == None:
+            channel = GameChannel(gameid, self.queue_size)
+            channel.tasks.append(asyncio.create_task(self._hit_worker(channel.hits, gameid)))
+            channel.tasks.append(asyncio.create_task(self._worker(channel.control, gameid)))
+            self.channels[gameid] = channel
+        return channel
+
+    def close_channel(self, gameid):
+        channel = self.channels.pop(gameid, None)
+        if channel != None:
+            channel.close()
+
+    async def _worker(self, queue, gameid):
+        """
+        Task which feeds the messages in one queue to the server, one at a time.
+        """
+        while True:
+            handler, params, payload, arrived = await queue.get()
+            try:
+                await self.server.dispatch(handler, params, payload)
+            except Exception as e:
+                dbg("runtime: error in "+handler.__name__+": "+repr(e))
+            finally:
+                queue.task_done()
+            if gameid != None and gameid not in self.server.games:
+                # the game has been deleted
+                self.close_channel(gameid)
+
+    async def _hit_worker(self, queue, gameid):
+        """
+        Task which feeds the hits (and fires) in a game's hit queue to the
+        server, taking everything waiting (up to batch_size) at once.
+        """
+        fire = self.server.fire
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                game = self.server.games.get(gameid)
+                if game != None:
+                    # the hits between one fire and the next go together;
+                    # each run of hits, and each fire, fails on its own
+                    hits = []
+                    arrivals = []
+                    for handler, params, payload, arrived in batch:
+                        if handler == fire:
+                            if len(hits) > 0:
+                                self._hit_batch(game, hits, arrivals)
+                                hits = []
+                                arrivals = []
+                            try:
+                                self.server.fire_at(game, payload, arrived)
+                            except Exception as e:
+                                dbg("runtime: error in fire: "+repr(e))
+                        else:
+                            hits.append(payload)
+                            arrivals.append(arrived)
+                    if len(hits) > 0:
+                        self._hit_batch(game, hits, arrivals)
+            finally:
+                for item in batch:
+                    queue.task_done()
+
+    def _hit_batch(self, game, hits, arrivals):
+        try:
+            self.server.hit_batch(game, hits, arrivals)
+        except Exception as e:
+            dbg("runtime: error in hit_batch: "+repr(e))
+
+    async def _snapshots(self):
+        """
+        Task which has the server snapshot its games every snapshot_interval.
+        """
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                self.server.snapshot()
+            except Exception as e:
+                dbg("runtime: error in snapshot: "+repr(e))
+
+    async def _deltas(self):
+        """
+        Task which has the server publish the gamedelta stream every
+        delta_interval.
+        """
+        while True:
+            await asyncio.sleep(self.delta_interval)
+            try:
+                self.server.publish_deltas()
+            except Exception as e:
+                dbg("runtime: error in publish_deltas: "+repr(e))
+
+    async def _flushes(self):
+        """
+        Task which has the server's Publisher send what's waiting, every
+        publish window.
+        """
+        window = self.server.publisher.window / 1000
+        while True:
+            await asyncio.sleep(window)
+            try:
+                self.server.publisher.flush()
+            except Exception as e:
+                dbg("runtime: error in flush: "+repr(e))
+
+    async def _ticks(self):
+        """
+        Task which runs the server's timers, every tick.
+        """
+        timers = self.server.timers
+        tick = timers.tick / 1000
+        while True:
+            await asyncio.sleep(tick)
+            try:
+                timers.advance(time.monotonic() * 1000)
+            except Exception as e:
+                dbg("runtime: error in timers: "+repr(e))
@@ -0,0 +1,183 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# schema.py
+# Provides Schema, which checks and converts JSON messages in one pass.
+#
+# A schema is described with plain Python values:
+#     str, int, float, bool  a value of that type (ints will do for floats)
+#     object                 any value at all
+#     [spec]                 a list, each item matching spec
+#     {key: spec, ...}       an object with those keys (others are ignored)
+#     Optional(spec, default) a key which may be left out
+#     Convert(spec, fn)      a value matching spec, passed through fn
+# and compiled, once, into a function which walks a parsed message,
+# checking it and converting it as it goes. Errors say exactly where the
+# problem is, eg "teams[3].players[0].gunid: expected a string".
+# ----------------------------------------------------------------------
+import json
+
+class SchemaError(ValueError):
+    """
+    Exception raised when a message doesn't match its schema.
+    """
+    def __init__(self, problem, path=""):
+        super().__init__(problem, path)
+        self.problem = problem
+        self.path = path
+
+    def within(self, level):
+        """
+        Returns the error, as seen from the level above (a key, or "[index]").
+        """
+        if self.path == "":
+            path = level
+        elif self.path.startswith("["):
+            path = level + self.path
+        else:
+            path = level + "." + self.path
+        return SchemaError(self.problem, path)
+
+    def __str__(self):
+        return (self.path + ": " if self.path != "" else "") + self.problem
+
+class Optional:
+    """
+    Marks a key which may be left out of an object, taking a default value.
+    The default is copied if it's a list or dict, so it can be changed.
+    """
+    def __init__(self, spec, default=None):
+        self.spec = spec
+        self.default = default
+
+class Convert:
+    """
+    A value matching spec, passed through fn. If fn raises ValueError or
+    TypeError, the value is rejected with the given description (or the
+    exception's message).
+    """
+    def __init__(self, spec, fn, description=None):
+        self.spec = spec
+        self.fn = fn
+        self.description = description
+
+TYPE_NAMES = {str: "a string", int: "an integer", float: "a number", bool: "true or false"}
+
+def compile_spec(spec):
+    """
+    Returns a function which checks and converts a value matching spec,
+    raising SchemaError if it doesn't.
+    """
+    if spec is object:
+        return lambda value: value
+    if isinstance(spec, type) and spec in TYPE_NAMES:
+        return _compile_type(spec)
+    if isinstance(spec, Convert):
+        return _compile_convert(spec)
+    if isinstance(spec, list):
+        return _compile_list(spec[0])
+    if isinstance(spec, dict):
+        return _compile_object(spec)
+    raise TypeError("Not a schema: "+repr(spec))
+
+def _compile_type(kind):
+    expected = "expected " + TYPE_NAMES[kind]
+    # bool is an int in Python, but not in JSON
+    allowed = (int, float) if kind is float else (kind,)
+    def check(value):
+        if type(value) not in allowed:
+            raise SchemaError(expected)
+        return value
+    return check
+
+def _compile_convert(spec):
+    inner = compile_spec(spec.spec)
+    fn = spec.fn
+    description = spec.description
+    def check(value):
+        value = inner(value)
+        try:
+            return fn(value)
+        except (TypeError, ValueError) as e:
+            raise SchemaError(description if description != None else str(e))
+    return check
+
+def _compile_list(spec):
+    item = compile_spec(spec)
+    def check(value):
+        if type(value) is not list:
+            raise SchemaError("expected a list")
+        result = []
+        append = result.append
+        for i, x in enumerate(value):
+            try:
+                append(item(x))
+            except SchemaError as e:
+                raise e.within("["+str(i)+"]")
+        return result
+    return check
+
+def _compile_object(spec):
+    required = []
+    optional = []
+    for key, value in spec.items():
+        if isinstance(value, Optional):
+            optional.append((key, compile_spec(value.spec), value.default))
+        else:
+            required.append((key, compile_spec(value)))
+    required = tuple(required)
+    optional = tuple(optional)
+    def check(value):
+        if type(value) is not dict:
+            raise SchemaError("expected an object")
+        result = {}
+        key = None
+        try:
+            for key, item in required:
+                if key not in value:
+                    raise SchemaError("missing")
+                result[key] = item(value[key])
+            for key, item, default in optional:
+                if key in value:
+                    result[key] = item(value[key])
+                elif type(default) in (list, dict):
+                    result[key] = type(default)(default)
+                else:
+                    result[key] = default
+        except SchemaError as e:
+            raise e.within(key)
+        return result
+    return check
+
+class Schema:
+    """
+    A message schema, compiled ready for use.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        self.check = compile_spec(spec)
+
+    def parse(self, message):
+        """
+        Returns a JSON message (bytes or str), checked and converted, raising
+        SchemaError if it isn't valid.
+        """
+        try:
+            value = json.loads(message)
+        except ValueError as e:
+            raise SchemaError("not valid JSON: "+str(e))
+        return self.check(value)
@@ -1,32 +1,682 @@
-from typing_extensions import ParamSpecKwargs
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# server.py
+# Provides the Server class, which handles the messages of the Stramash
+# protocol. Each handler is a coroutine, run by the Runtime.
+# ----------------------------------------------------------------------
+import json, re, time
+from utils import dbg
+from game import *
+from router import TopicRouter
+from hits import *
+from hitcodec import *
+from journal import recover
+import statecache
+from publisher import Publisher
+from gametypes import game_class
+from statedelta import DeltaEncoder, encode
+from schema import Schema, Optional, Convert
+from timers import TimingWheel
 
+# the number of players sent in a scoreboard, by default
+SCOREBOARD_TOP = 10
+SCOREBOARD_AROUND = 2
+
+# how often (seconds) the gamedelta stream is published, and how often it
+# includes a keyframe (see statedelta.py)
+DEFAULT_DELTA_INTERVAL = 1
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+def jsonify(obj):
+    """
+    Returns compact JSON for obj, as the server sends it.
+    """
+    return json.dumps(obj, separators=(",", ":"))
+
+def parse_rgb(value):
+    """
+    Returns a [red, green, blue] array, checked. The launcher has sent these
+    as strings ("[255,0,0]"), so accept that too.
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValueError("expected [red, green, blue]")
+    if type(value) is not list or len(value) != 3:
+        raise ValueError("expected [red, green, blue]")
+    for component in value:
+        if type(component) is not int or component < 0 or component > 255:
+            raise ValueError("colour components must be integers, 0-255")
+    return value
+
+def parse_gunid(value):
+    """
+    Returns a gun id, which is a string, though accept a number for one.
+    """
+    if isinstance(value, str):
+        return value
+    if type(value) is int:
+        return str(value)
+    raise ValueError("expected a gun id")
+
+GAMEID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def parse_gameid(value):
+    """
+    Returns a game id, checked: it's a level of every topic for the game, so
+    mustn't be empty, or contain / or the wildcards + and #.
+    """
+    if not isinstance(value, str) or GAMEID_PATTERN.fullmatch(value) == None:
+        raise ValueError("expected a game id (letters, digits, - and _)")
+    return value
+
+def with_colour(obj):
+    """
+    Replaces the [red, green, blue] colour of a team or player with a Colour.
+    """
+    rgb = obj["colour"]
+    if rgb != None:
+        obj["colour"] = Colour(obj["name"], rgb[0], rgb[1], rgb[2])
+    return obj
+
+# message schemas (see schema.py)
+RGB = Convert(object, parse_rgb)
+GUNID = Convert(object, parse_gunid)
+GAMEID = Convert(object, parse_gameid)
+
+NEWGAME = Schema({
+    "name": str,
+    "type": str,
+    "maxtime": str,
+    "id": Optional(GAMEID),
+    "teams": Optional([Convert({
+        "name": str,
+        "colour": RGB,
+        "players": Optional([{"name": str, "gunid": GUNID}], [])
+    }, with_colour)], []),
+    "players": Optional([Convert({"name": str, "gunid": GUNID, "colour": RGB}, with_colour)], [])
+})
+
+ADDTEAM = Schema(Convert({"name": str, "colour": RGB}, with_colour))
+
+ADDPLAYER = Schema(Convert({"id": GUNID, "name": str, "colour": Optional(RGB)}, with_colour))
+
+def parse_duration(text):
+    """
+    Returns the seconds in a duration (hh:mm:ss), or None if it isn't one.
+    """
+    fields = text.split(":")
+    if len(fields) != 3 or not all(field.isdigit() for field in fields):
+        return None
+    return int(fields[0]) * 3600 + int(fields[1]) * 60 + int(fields[2])
+
+# the messages the server handles: stramash/newgame, and these actions on
+# stramash/game/<gameid>/<action>; each is handled by the Server method of
+# the same name
+GAME_ACTIONS = ("delete", "startgame", "end", "check", "checkscores", "keyframe", "addteam", "deleteteam",
+    "checkteam", "addplayer", "deleteplayer", "checkplayer", "fire", "hit")
+
+def make_router(handler):
+    """
+    Returns a TopicRouter for the messages the server handles.
+
+    handler: callable(name) giving the handler for the message of that name
+    ("newgame", or one of GAME_ACTIONS)
+    """
+    router = TopicRouter()
+    router.add("stramash/newgame", handler("newgame"))
+    for action in GAME_ACTIONS:
+        router.add("stramash/game/<gameid>/"+action, handler(action))
+    return router
+
+def announcements():
+    """
+    Returns the retained messages describing the server, as (topic, message)
+    pairs, which clients see as soon as they subscribe.
+    """
+    # clients only send binary hit and fire messages if we list binary
+    return [("stramash/server/encodings", jsonify([JSON, BINARY]))]
+
+def parse_id(message):
+    """
+    Returns the id carried by a single-value message. Guns send their id as a
+    bare string rather than a JSON string, so accept either.
+    """
+    text = message.decode("utf-8", "ignore") if isinstance(message, bytes) else message
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
 
 class Server():
-    def __init__(self):
-        games = {}
-
-    # TODO
-    # attribs Games
-    # methods for each message
-    def newgame(self, topic, message):
-        obj = json.loads(message)
+    def __init__(self, publish=None, journal=None, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, publish_window=0,
+            client_rate=0, dedup_window=DEFAULT_DEDUP_WINDOW, fire_window=DEFAULT_FIRE_WINDOW):
+        """
+        Initialises the server.
+
+        publish: callable(topic, message, retain=False) used to send MQTT messages
+        journal: the Journal recording the games, if any
+        keyframe_interval: the time (seconds) between keyframes in the
+        gamedelta stream of an active game
+        publish_window: the time (ms) messages are held, to be merged and
+        published together (see Publisher); 0 to send them straight away
+        client_rate: the most messages a second sent to each client (see
+        Publisher); 0 for no limit
+        dedup_window: the time (ms) within which hits on the same victim from
+        the same shooter, on different sensors, are one hit (see HitDedup)
+        fire_window: the time (ms) within which a hit must follow its shooter's
+        fire message to count (see FireCorrelator); 0 to count hits without
+        one
+        """
+        self.games = {}
+        self.publish = publish
+        self.publisher = Publisher(publish, publish_window, client_rate)
+        self.journal = journal
+        self.hit_meter = HitMeter()
+        self.dedup_window = dedup_window
+        self.dedups = {}   # game id: the HitDedup for its hits
+        self.collapsed = 0 # duplicate hits collapsed, in all games
+        self.fire_window = fire_window
+        self.correlators = {} # game id: the FireCorrelator for its hits
+        self.rejected = 0  # hits without a fire, in all games
+        self.timers = TimingWheel(time.monotonic() * 1000) # run every tick by the Runtime
+        self.game_timers = {} # game id: {player id (None for the game): its Timer}
+        self.state_cache = statecache.stats
+        self.keyframe_interval = keyframe_interval
+        self.deltas = {}    # game id: the DeltaEncoder for its gamedelta stream
+        self.keyframed = {} # game id: when its last keyframe was sent
+        self.snapshotted = {} # game id: {player id: what its retained snapshot was made from}
+        self.delta_stats = statecache.DeltaStats()
+
+        # routes for the messages we handle; anything else (including our own
+        # announcements, which we also receive) is ignored
+        self.router = make_router(lambda name: getattr(self, name))
+
+    def send(self, topic, msg, retain=False):
+        """
+        Publishes an MQTT message.
+
+        topic: the topic to publish
+        msg: the message
+        retain: if True, the broker keeps the message for new subscribers
+        """
+        if self.publish != None:
+            self.publisher.send(topic, msg, retain)
+
+    def announce(self):
+        """
+        Publishes the retained messages describing the server, which clients
+        see as soon as they subscribe. Call on (re)connecting to the broker.
+        """
+        for topic, message in announcements():
+            self.send(topic, message, True)
+
+    def game_topic(self, game, action):
+        return "stramash/game/"+game.id+"/"+action
+
+    def player_topic(self, playerid, action):
+        return "stramash/player/"+playerid+"/"+action
+
+    ############################################################################
+    # Persistence
+    ############################################################################
+    def track(self, game):
+        """
+        Adds a game to the server, journalling its events from now on.
+        """
+        self.games[game.id] = game
+        if self.journal != None:
+            journal = self.journal
+            gameid = game.id
+            game.onevent = lambda event: journal.append(gameid, event)
+
+    def resume(self, journal):
+        """
+        Brings back the games recorded in a journal's directory, and starts
+        journalling to it. Call before any messages are handled.
+
+        journal: the Journal (not yet started)
+        """
+        self.journal = journal
+        self.restore(*recover(journal.directory))
+        journal.start()
+        # start the new journal from a snapshot, so the next recovery doesn't
+        # have to replay the old one
+        self.snapshot()
+
+    def snapshot(self):
+        """
+        Has the journal write a snapshot of every game.
+        """
+        if self.journal != None:
+            self.journal.snapshot({game.id: game.to_dict() for game in self.games.values()})
+
+    def restore(self, games, events):
+        """
+        Brings back the games recovered from the journal (see journal.recover).
+
+        games: the games as at the last snapshot, as Game.to_dict() dicts
+        events: the (gameid, event) records since
+        """
+        for data in games.values():
+            game = game_class(data["type"]).from_dict(data)
+            self.games[game.id] = game
+        for gameid, event in events:
+            if event["e"] == "newgame":
+                data = event["game"]
+                self.games[gameid] = game_class(data["type"]).from_dict(data)
+            elif event["e"] == "delete":
+                self.games.pop(gameid, None)
+            elif gameid in self.games:
+                try:
+                    self.games[gameid].apply(event)
+                except GameError as e:
+                    dbg("server: couldn't replay "+event["e"]+": "+repr(e))
+        for game in list(self.games.values()):
+            self.track(game)
+            if game.status == ACTIVE:
+                self.time_game(game)
+
+    async def dispatch(self, handler, params, message):
+        """
+        Invokes the handler for a message, as found by self.router.
+
+        handler: the handler for the message's topic
+        params: the parameters extracted from the topic
+        message: the raw MQTT payload
+        """
+        if "gameid" in params:
+            game = self.games.get(params["gameid"])
+            if game != None:
+                await handler(game, message)
+        else:
+            await handler(message)
+
+    ############################################################################
+    # Game-Related Messages
+    ############################################################################
+    async def newgame(self, message):
+        # checked in full before anything is created
+        obj = NEWGAME.parse(message)
         name = obj["name"]
         type = obj["type"]
         maxtime = obj["maxtime"]
-        if "teams" in obj:
-            # TODO parse
-            print("Got some teams")
-        if "players" in obj:
-            # TODO parse
-            print("Got some players")
-        
+        gameid = obj["id"] # normally chosen by us, but see ShardedServer
+        if gameid in self.games:
+            raise GameError("Game already exists: "+gameid)
+
         #  instantiate appropriate class
-        # TODO make sure this is a legit class!
-        gameclass = "Game_"+type 
-        module = __import__("game_"+type)
-        class_ = getattr(module, gameclass)
-        game = class_()
-        games["makeid"] = game
+        game = game_class(type)(gameid, name, type, maxtime)
+
+        for t in obj["teams"]:
+            team = game.addteam(t["name"], t["colour"])
+            for p in t["players"]:
+                game.addplayer(p["gunid"], p["name"], team)
+        for p in obj["players"]:
+            game.addplayer(p["gunid"], p["name"], None, p["colour"])
+
+        self.track(game)
+        if self.journal != None:
+            self.journal.append(game.id, {"e": "newgame", "game": game.to_dict()})
+        created = {"id": game.id, "name": name, "type": type, "maxtime": maxtime}
+        self.send("stramash/gamecreated", jsonify(created))
+
+    async def delete(self, game, message):
+        del self.games[game.id]
+        self.deltas.pop(game.id, None)
+        self.dedups.pop(game.id, None)
+        self.correlators.pop(game.id, None)
+        self.clear_timers(game)
+        self.keyframed.pop(game.id, None)
+        # clear the retained snapshots
+        self.send(self.game_topic(game, "snapshot"), "", True)
+        for playerid in self.snapshotted.pop(game.id, {}):
+            self.send(self.player_topic(playerid, "snapshot"), "", True)
+        if self.journal != None:
+            self.journal.append(game.id, {"e": "delete"})
+        self.send(self.game_topic(game, "gamedeleted"), "")
+        # those went straight out; drop the rate limits of the game and its
+        # players, and anything still waiting for them
+        self.publisher.forget("game/"+game.id)
+        for playerid in game.players:
+            self.publisher.forget("player/"+playerid)
+
+    async def startgame(self, game, message):
+        game.start()
+        self.time_game(game)
+        self.send(self.game_topic(game, "gamestarted"), "")
+
+    async def end(self, game, message):
+        self.end_game(game)
+
+    def end_game(self, game):
+        game.end()
+        self.clear_timers(game)
+        self.send(self.game_topic(game, "gameended"), "")
+
+    async def check(self, game, message):
+        self.send(self.game_topic(game, "gamestate"), game.state_message())
+
+    async def checkscores(self, game, message):
+        # an empty message asks for the leaders; {"top": k} for the top k, or
+        # {"player": id, "around": k} for the k either side of a player
+        obj = json.loads(message) if len(message) > 0 else {}
+        leaderboard = game.leaderboard
+        if "player" in obj:
+            players, rank = leaderboard.around(obj["player"], obj.get("around", SCOREBOARD_AROUND))
+        else:
+            players, rank = leaderboard.top(obj.get("top", SCOREBOARD_TOP)), 1
+        # with fires correlated, each player's accuracy (the proportion of
+        # their shots which hit someone) is known as the game goes on
+        correlator = self.correlators.get(game.id) if self.fire_window > 0 else None
+        scores = []
+        for player in players:
+            score = {"rank": rank, "id": player.id, "name": player.name, "score": player.score}
+            if correlator != None:
+                score["accuracy"] = round(correlator.accuracy(player.teamnumber, player.playernumber), 3)
+            scores.append(score)
+            rank += 1
+        self.send(self.game_topic(game, "scoreboard"), jsonify({"players": len(leaderboard), "scores": scores}))
+
+    async def keyframe(self, game, message):
+        self.publish_delta(game, True)
+
+    ############################################################################
+    # Game State Stream
+    ############################################################################
+    def full_state(self, game):
+        """
+        Returns everything in a game's gamedelta stream (see statedelta.py).
+        """
+        return {
+            "game": game.state(),
+            "teams": {team.id: team.state() for team in game.teams.values()},
+            "players": {player.id: player.state() for player in game.players.values()}
+        }
+
+    def publish_deltas(self, now=None):
+        """
+        Publishes a gamedelta for each game whose state has changed, with a
+        keyframe now and then for active games. Called every delta_interval
+        by the Runtime.
+
+        now: the time (time.monotonic()); now, if not given
+        """
+        if now == None:
+            now = time.monotonic()
+        for game in list(self.games.values()):
+            due = now - self.keyframed.get(game.id, now) >= self.keyframe_interval
+            self.publish_delta(game, due and game.status == ACTIVE, now)
+        rates = self.delta_stats.rates()
+        if rates != None:
+            dbg("server: gamedelta {:.0f} bytes/sec, saving {:.0f} bytes/sec".format(*rates))
+
+    def publish_delta(self, game, keyframe=False, now=None):
+        """
+        Publishes a game's state changes since its last gamedelta, if any.
+
+        game: the Game
+        keyframe: if True, publish everything (see statedelta.py)
+        now: the time (time.monotonic()); now, if not given
+        """
+        encoder = self.deltas.get(game.id)
+        if encoder == None:
+            encoder = self.deltas[game.id] = DeltaEncoder()
+        state = self.full_state(game)
+        last = encoder.last
+        if keyframe or last == None:
+            self.keyframed[game.id] = now if now != None else time.monotonic()
+        # the retained snapshots keep up with every change, except during play
+        # when they're only brought up to date with the keyframes
+        refresh = keyframe or last == None or game.status != ACTIVE or last["game"]["status"] != state["game"]["status"]
+        message = encoder.encode(state, keyframe)
+        if message == None:
+            return
+        self.send(self.game_topic(game, "gamedelta"), message)
+        if refresh:
+            self.publish_snapshots(game, state, encoder.seq)
+        # what publishing the changes as full state messages would have cost
+        full = 0
+        for section, id in encoder.changed:
+            if section == "game":
+                full += len(game.state_message())
+            elif section == "teams" and id in game.teams:
+                full += len(game.teams[id].state_message())
+            elif section == "players" and id in game.players:
+                full += len(game.players[id].state_message())
+        self.delta_stats.add(len(message), full)
+
+    def publish_snapshots(self, game, state, seq):
+        """
+        Publishes the retained snapshots of a game, which bring a client up to
+        date as soon as it subscribes: the game's on game/<gameid>/snapshot (a
+        keyframe as of gamedelta seq), and each player's on
+        player/<playerid>/snapshot, if it has changed.
+
+        game: the Game
+        state: its state, as given to the DeltaEncoder
+        seq: the sequence number of the gamedelta for that state
+        """
+        snapshot = {"seq": seq, "key": 1}
+        snapshot.update(state)
+        self.send(self.game_topic(game, "snapshot"), encode(snapshot), True)
+
+        # player snapshots are pieced together from the cached state messages,
+        # and only sent when one of those has changed
+        published = self.snapshotted.setdefault(game.id, {})
+        gamestate = game.state_message()
+        teams = {team.number: team for team in game.teams.values()}
+        now = game._hittime() if game.status == ACTIVE else 0
+        for player in game.players.values():
+            team = teams.get(player.teamnumber)
+            teamstate = team.state_message() if team != None else b"null"
+            playerstate = player.state_message()
+            # whether their gun is down or shielded, which the gun can't tell
+            # from their status
+            condition = game.condition(player, now)
+            last = published.get(player.id)
+            if (last != None and last[0] == game.status and last[1] is playerstate and last[2] is teamstate
+                    and last[3] == condition):
+                continue
+            published[player.id] = (game.status, playerstate, teamstate, condition)
+            self.send(self.player_topic(player.id, "snapshot"),
+                b'{"game":'+gamestate+b',"team":'+teamstate+b',"player":'+playerstate+b',"condition":"'+
+                condition.encode()+b'"}', True)
+        for playerid in [playerid for playerid in published if playerid not in game.players]:
+            del published[playerid]
+            self.send(self.player_topic(playerid, "snapshot"), "", True)
+
+    ############################################################################
+    # Team- and Player-Related Messages
+    ############################################################################
+    async def addteam(self, game, message):
+        obj = ADDTEAM.parse(message)
+        team = game.addteam(obj["name"], obj["colour"])
+        self.send(self.game_topic(game, "teamadded"), team.state_message())
+
+    async def deleteteam(self, game, message):
+        teamid = parse_id(message)
+        players = game.deleteteam(teamid)
+        self.send(self.game_topic(game, "teamdeleted"), teamid)
+        # the team's players have new IR addresses
+        for player in players:
+            self.send(self.game_topic(game, "playerstate"), player.state_message())
+
+    async def checkteam(self, game, message):
+        team = game.teams.get(parse_id(message))
+        if team != None:
+            self.send(self.game_topic(game, "teamstate"), team.state_message())
+
+    async def addplayer(self, game, message):
+        obj = ADDPLAYER.parse(message)
+        player = game.addplayer(obj["id"], obj["name"], None, obj["colour"])
+        self.send(self.game_topic(game, "playeradded"), player.state_message())
+
+    async def deleteplayer(self, game, message):
+        playerid = parse_id(message)
+        game.deleteplayer(playerid)
+        # they're not getting up again
+        self.clear_timer(game, playerid)
+        self.publisher.forget("player/"+playerid)
+        self.send(self.game_topic(game, "playerdeleted"), playerid)
+
+    async def checkplayer(self, game, message):
+        player = game.players.get(parse_id(message))
+        if player != None:
+            self.send(self.game_topic(game, "playerstate"), player.state_message())
+
+    ############################################################################
+    # Gameplay Messages
+    ############################################################################
+    async def fire(self, game, message):
+        self.fire_at(game, message, time.monotonic() * 1000)
+
+    def fire_at(self, game, message, arrived):
+        """
+        Handles a fire message for a game. The Runtime queues fires with the
+        game's hits, so each is recorded before the hits which follow it.
+
+        game: the Game
+        message: the fire message (bytes)
+        arrived: the time (time.monotonic(), in ms) it arrived
+        """
+        if is_binary(message):
+            try:
+                team, number, seq, timestamp = unpack_fire(message)
+            except ValueError:
+                dbg("server: dropped invalid fire "+repr(message))
+                return
+            player = game.find_player(team, number)
+            if player != None:
+                player = game.fire(player.id)
+        else:
+            player = game.fire(parse_id(message))
+        if player != None and self.fire_window > 0:
+            self.correlator(game).fire(player.teamnumber, player.playernumber, arrived)
+
+    async def hit(self, game, message):
+        self.hit_batch(game, [message])
+
+    def hit_batch(self, game, messages, arrivals=None):
+        """
+        Handles a batch of hit messages for a game, as drained from its hit
+        queue by the Runtime.
+
+        game: the Game
+        messages: the hit messages (bytes)
+        arrivals: the time (time.monotonic(), in ms) each message arrived; now,
+        if not given
+        """
+        now = time.monotonic() * 1000
+        if arrivals == None:
+            arrivals = [now] * len(messages)
+        hits, times = parse_hits(messages, arrivals)
+        count = len(hits)
+        if self.dedup_window > 0:
+            dedup = self.dedups.get(game.id)
+            if dedup == None:
+                dedup = self.dedups[game.id] = HitDedup(self.dedup_window)
+            hits, times = dedup.filter(hits, times)
+            self.collapsed += count - len(hits)
+        if self.fire_window > 0 and game.status == ACTIVE:
+            before = len(hits)
+            hits, times = self.correlator(game).filter(hits, times)
+            self.rejected += before - len(hits)
+        for shooter, victim in game.apply_hits(hits):
+            self.knock_down(game, victim)
+        rate = self.hit_meter.add(count)
+        if rate != None:
+            dbg("server: {:.1f} hits/sec, {} duplicates collapsed, {} without a fire".format(rate, self.collapsed,
+                self.rejected))
+
+    ############################################################################
+    # Timers
+    ############################################################################
+    def set_timer(self, game, playerid, when, callback, *args):
+        """
+        Sets a timer for a player (or, with playerid None, the game), replacing
+        any they already have.
+
+        when: the time (time.monotonic(), in ms) to call callback(*args)
+        """
+        timers = self.game_timers.setdefault(game.id, {})
+        timer = timers.get(playerid)
+        if timer != None:
+            self.timers.cancel(timer)
+        timers[playerid] = self.timers.schedule(when, self._expire, game, playerid, callback, args)
+
+    def _expire(self, game, playerid, callback, args):
+        timers = self.game_timers.get(game.id)
+        if timers != None:
+            timers.pop(playerid, None)
+        callback(*args)
+
+    def clear_timer(self, game, playerid):
+        """
+        Cancels a player's timer (or, with playerid None, the game's), if
+        they have one.
+        """
+        timer = self.game_timers.get(game.id, {}).pop(playerid, None)
+        if timer != None:
+            self.timers.cancel(timer)
+
+    def clear_timers(self, game):
+        """
+        Cancels a game's timers, eg when it has ended.
+        """
+        for timer in self.game_timers.pop(game.id, {}).values():
+            self.timers.cancel(timer)
+
+    def time_game(self, game):
+        """
+        Sets the timer ending an active game when its maxtime is up.
+        """
+        seconds = parse_duration(game.maxtime)
+        if seconds == None or seconds == 0:
+            return
+        remaining = game.start_time + seconds - time.time()
+        self.set_timer(game, None, (time.monotonic() + remaining) * 1000, self.end_game, game)
+
+    def knock_down(self, game, player):
+        """
+        Announces that a player has been hit, and times them back up and
+        then out of their shield (see Game.condition). The up and down
+        messages carry the player's condition.
+        """
+        if player.status & UP:
+            self.send(self.player_topic(player.id, "down"), "down")
+            up = time.monotonic() * 1000 + game.down_time
+            self.set_timer(game, player.id, up, self.get_up, game, player, up)
+        else:
+            self.send(self.player_topic(player.id, "down"), "out")
+            self.clear_timer(game, player.id)
 
+    def get_up(self, game, player, when):
+        # when: the time they were due up, which the shield runs from
+        self.send(self.player_topic(player.id, "up"), "shielded")
+        self.set_timer(game, player.id, when + game.shield_time, self.send, self.player_topic(player.id, "up"), "up")
 
-    pass 
\ No newline at end of file
+    def correlator(self, game):
+        """
+        Returns the FireCorrelator matching a game's hits to its fires.
+        """
+        correlator = self.correlators.get(game.id)
+        if correlator == None:
+            correlator = self.correlators[game.id] = FireCorrelator(self.fire_window)
+        return correlator
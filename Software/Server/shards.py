@@ -0,0 +1,228 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# shards.py
+# Provides ShardedServer, which spreads games across worker processes.
+#
+# Each game id is hashed to one of N shards. A shard is a worker process
+# running its own Server and Runtime, and owns the Game objects for its
+# games. The main process only routes: it forwards each MQTT message down
+# the owning shard's queue, and publishes whatever the shards send back.
+# ----------------------------------------------------------------------
+import asyncio, json, os, queue, threading, zlib
+import multiprocessing
+from utils import dbg, unique_id
+from server import Server, make_router, announcements, parse_gameid, DEFAULT_DELTA_INTERVAL, DEFAULT_KEYFRAME_INTERVAL
+from runtime import Runtime, DEFAULT_QUEUE_SIZE
+from journal import Journal, DEFAULT_SNAPSHOT_INTERVAL
+from hits import DEFAULT_DEDUP_WINDOW, DEFAULT_FIRE_WINDOW
+import gametypes
+
+def shard_for(gameid, shards):
+    """
+    Returns the index of the shard owning a game. Uses crc32 rather than
+    hash() so that every process agrees.
+
+    gameid: the id of the game
+    shards: the number of shards
+    """
+    return zlib.crc32(gameid.encode("utf-8")) % shards
+
+def shard_main(inbox, outbox, queue_size, journal="", snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, archive=False,
+        delta_interval=DEFAULT_DELTA_INTERVAL, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, publish_window=0,
+        client_rate=0, dedup_window=DEFAULT_DEDUP_WINDOW, fire_window=DEFAULT_FIRE_WINDOW):
+    """
+    Entry point for a shard's worker process. Runs a Server fed from inbox
+    until it receives None; messages to publish are put on outbox.
+
+    inbox: queue of (topic, payload) messages for this shard
+    outbox: queue of (topic, message, retain) to be published
+    queue_size: the Runtime's queue size
+    journal: the directory for this shard's journal ("" for none)
+    snapshot_interval: the time (seconds) between snapshots of the journal
+    archive: if True, the journal archives old segments (see Journal)
+    delta_interval: the time (seconds) between gamedelta messages
+    keyframe_interval: the time (seconds) between gamedelta keyframes
+    publish_window: the time (ms) messages are held to be merged (see Publisher)
+    client_rate: the most messages a second sent to each client (see Publisher)
+    dedup_window: the time (ms) within which hits are collapsed (see HitDedup)
+    fire_window: the time (ms) within which a hit must follow its fire (see
+    FireCorrelator); 0 to count hits without one
+    """
+    gametypes.discover(warm=True)
+    server = Server(lambda topic, msg, retain=False: outbox.put((topic, msg, retain)),
+        keyframe_interval=keyframe_interval, publish_window=publish_window, client_rate=client_rate,
+        dedup_window=dedup_window, fire_window=fire_window)
+    if journal != "":
+        server.resume(Journal(journal, archive=archive))
+    runtime = Runtime(server, queue_size, snapshot_interval=snapshot_interval, delta_interval=delta_interval)
+
+    def feed():
+        while True:
+            item = inbox.get()
+            if item == None:
+                runtime.stop()
+                return
+            runtime.submit(item[0], item[1])
+
+    async def run():
+        runtime.start()
+        threading.Thread(target=feed, daemon=True).start()
+        await runtime.run()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server.journal != None:
+            server.journal.stop()
+
+class ShardedServer:
+    def __init__(self, shards, publish, queue_size=DEFAULT_QUEUE_SIZE, journal="",
+            snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL, archive=False,
+            delta_interval=DEFAULT_DELTA_INTERVAL, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, publish_window=0,
+            client_rate=0, dedup_window=DEFAULT_DEDUP_WINDOW, fire_window=DEFAULT_FIRE_WINDOW):
+        """
+        Initialises the sharded server.
+
+        shards: the number of worker processes
+        publish: callable(topic, message, retain=False) used to send MQTT messages
+        queue_size: the queue size for each shard's Runtime
+        journal: the directory for the journals ("" for none); each shard
+        keeps its own in a subdirectory. The number of shards mustn't change
+        between runs, or games will be recovered by the wrong shard.
+        snapshot_interval: the time (seconds) between snapshots of the journals
+        archive: if True, the journals archive old segments (see Journal)
+        delta_interval: the time (seconds) between gamedelta messages
+        keyframe_interval: the time (seconds) between gamedelta keyframes
+        publish_window: the time (ms) each shard holds messages to be merged
+        (see Publisher)
+        client_rate: the most messages a second each shard sends to each
+        client (see Publisher)
+        dedup_window: the time (ms) within which each shard collapses hits
+        reported by more than one sensor (see HitDedup)
+        fire_window: the time (ms) within which a hit must follow its fire
+        (see FireCorrelator); 0 to count hits without one
+        """
+        self.shards = shards
+        self.publish = publish
+        self.queue_size = queue_size
+        self.journal = journal
+        self.snapshot_interval = snapshot_interval
+        self.archive = archive
+        self.delta_interval = delta_interval
+        self.keyframe_interval = keyframe_interval
+        self.publish_window = publish_window
+        self.client_rate = client_rate
+        self.dedup_window = dedup_window
+        self.fire_window = fire_window
+        self.inboxes = []
+        self.workers = []
+        self.outbox = None
+        self.publisher = None
+        self.dropped = 0
+        # only the routes are used here - which topics the server handles
+        # and their <gameid> - so each route's handler is just its name
+        self.router = make_router(lambda name: name)
+
+    def start(self):
+        """
+        Starts the worker processes, and the thread publishing their messages.
+        """
+        self.outbox = multiprocessing.Queue()
+        for i in range(self.shards):
+            inbox = multiprocessing.Queue(self.queue_size)
+            journal = os.path.join(self.journal, "shard"+str(i)) if self.journal != "" else ""
+            worker = multiprocessing.Process(target=shard_main,
+                args=(inbox, self.outbox, self.queue_size, journal, self.snapshot_interval, self.archive,
+                    self.delta_interval, self.keyframe_interval, self.publish_window, self.client_rate,
+                    self.dedup_window, self.fire_window), daemon=True)
+            worker.start()
+            self.inboxes.append(inbox)
+            self.workers.append(worker)
+        self.publisher = threading.Thread(target=self._publish, daemon=True)
+        self.publisher.start()
+
+    def stop(self):
+        """
+        Shuts down the worker processes and the publishing thread.
+        """
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.outbox.put(None)
+        self.publisher.join()
+        self.inboxes = []
+        self.workers = []
+
+    def announce(self):
+        """
+        Publishes the server's retained announcements (see Server.announce).
+        """
+        for topic, message in announcements():
+            self.publish(topic, message, True)
+
+    def submit(self, topic, payload):
+        """
+        Forwards a message to the shard owning its game. Safe to call from any
+        thread (ie the MQTT network thread). Messages are dropped if the
+        shard's queue is full, rather than holding up the network thread.
+
+        topic: the MQTT topic
+        payload: the MQTT payload (bytes)
+        """
+        handler, params = self.router.match(topic)
+        if handler == None:
+            return
+        gameid = params.get("gameid")
+        if gameid == None:
+            # a new game: choose its id here (unless the client has, as
+            # Server.newgame allows), so we know which shard owns it
+            try:
+                obj = json.loads(payload)
+            except ValueError:
+                obj = None
+            if not isinstance(obj, dict):
+                dbg("shards: dropped unparseable "+topic)
+                return
+            if obj.get("id") != None:
+                try:
+                    gameid = parse_gameid(obj["id"])
+                except ValueError:
+                    dbg("shards: dropped "+topic+" with a bad game id")
+                    return
+            else:
+                gameid = unique_id()
+                obj["id"] = gameid
+                payload = json.dumps(obj)
+        try:
+            self.inboxes[shard_for(gameid, self.shards)].put_nowait((topic, payload))
+        except queue.Full:
+            self.dropped += 1
+            dbg("shards: queue full, dropped "+topic)
+
+    def _publish(self):
+        """
+        Thread method which publishes the messages sent back by the shards.
+        """
+        while True:
+            item = self.outbox.get()
+            if item == None:
+                return
+            self.publish(item[0], item[1], item[2])
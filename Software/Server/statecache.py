@@ -0,0 +1,105 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# statecache.py
+# Support for caching the encoded gamestate, teamstate and playerstate
+# messages.
+#
+# Game, Team and Player each keep their state message, encoded ready to
+# publish, until something it covers changes. This module has the encoder
+# they share, and the counters showing how well the caching works - and
+# how much the gamedelta stream (see statedelta.py) saves over publishing
+# the state messages themselves.
+# ----------------------------------------------------------------------
+import json, time
+
+def encode_state(state):
+    """
+    Returns a state dict encoded as compact JSON bytes, ready to publish.
+    """
+    return json.dumps(state, separators=(",", ":")).encode("utf-8")
+
+class CacheStats:
+    """
+    Counts the state messages served from the cache (hits), and those which
+    had to be encoded (misses).
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ratio(self):
+        """
+        The proportion of requests served from the cache.
+        """
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+class DeltaStats:
+    """
+    Counts the bytes published in the gamedelta stream, against those the
+    full state messages for the same changes would have taken.
+    """
+    def __init__(self, interval=60):
+        """
+        interval: the length (seconds) of each measurement interval
+        """
+        self.interval = interval
+        self.sent = 0
+        self.full = 0
+        self._sent = 0
+        self._full = 0
+        self._start = time.monotonic()
+
+    @property
+    def saved(self):
+        return self.full - self.sent
+
+    def add(self, sent, full):
+        """
+        Counts a gamedelta message.
+
+        sent: its length (bytes)
+        full: the length of the state messages it stands in for (bytes)
+        """
+        self.sent += sent
+        self.full += full
+        self._sent += sent
+        self._full += full
+
+    def rates(self):
+        """
+        Returns (bytes/sec sent, bytes/sec saved) over the interval just
+        finished, or None if the interval isn't over yet.
+        """
+        now = time.monotonic()
+        elapsed = now - self._start
+        if elapsed < self.interval:
+            return None
+        rates = (self._sent / elapsed, (self._full - self._sent) / elapsed)
+        self._sent = 0
+        self._full = 0
+        self._start = now
+        return rates
+
+# shared by Game, Team and Player
+stats = CacheStats()
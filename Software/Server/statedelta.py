@@ -0,0 +1,173 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# statedelta.py
+# Encodes and applies the gamedelta stream.
+#
+# Rather than republishing the whole gamestate, teamstate and playerstate
+# whenever something changes, the server publishes a game's state as a
+# stream of gamedelta messages. Each carries only the fields which have
+# changed since the one before. Every so often (or when a client asks) the
+# server sends a keyframe instead, with everything in it, so that a client
+# which has just subscribed or missed a message can catch up.
+#
+# A game's state, in a keyframe, is:
+#     {"seq": n, "key": 1, "game": <gamestate>,
+#      "teams": {<teamid>: <teamstate>, ...},
+#      "players": {<playerid>: <playerstate>, ...}}
+# and in a delta, each section has only what has changed (a new team or
+# player appears in full), plus the ids of any which have gone:
+#     {"seq": n, "game": {...}, "teams": {...}, "players": {...},
+#      "gone": {"teams": [...], "players": [...]}}
+# Sections with nothing in them are left out.
+#
+# This file is shared by the server, the launcher and the gun
+# (MicroPython), so keep it to the subset of Python they all support.
+# ----------------------------------------------------------------------
+import json
+
+SECTIONS = ("teams", "players")
+REPEAT_WINDOW = 16 # a seq this far behind the last is a repeat; further is a restarted server
+
+def diff(old, new):
+    """
+    Returns the fields of new whose values differ from those in old.
+
+    old, new: state dicts
+    """
+    changed = {}
+    for key, value in new.items():
+        if key not in old or old[key] != value:
+            changed[key] = value
+    return changed
+
+def encode(message):
+    return json.dumps(message, separators=(",", ":")).encode("utf-8")
+
+class DeltaEncoder:
+    """
+    Turns successive states of a game into gamedelta messages.
+    """
+    def __init__(self):
+        self.seq = 0
+        self.last = None # the state as of the last message
+        self.changed = [] # what was in the last message: ("game", None) and
+                          # (section, id) for each team and player
+
+    def encode(self, state, keyframe=False):
+        """
+        Returns the message (bytes) taking clients from the last state to this
+        one, or None if nothing has changed. The first message is always a
+        keyframe.
+
+        state: {"game": <gamestate>, "teams": {...}, "players": {...}}
+        keyframe: if True, send everything
+        """
+        last = self.last
+        if last == None or keyframe:
+            message = {"key": 1, "game": state["game"]}
+            changed = [("game", None)]
+            for section in SECTIONS:
+                message[section] = state[section]
+                changed.extend((section, id) for id in state[section])
+        else:
+            message = {}
+            changed = []
+            fields = diff(last["game"], state["game"])
+            if len(fields) > 0:
+                message["game"] = fields
+                changed.append(("game", None))
+            gone = {}
+            for section in SECTIONS:
+                before = last[section]
+                changes = {}
+                for id, now in state[section].items():
+                    was = before.get(id)
+                    if was == None:
+                        changes[id] = now
+                    elif was != now:
+                        changes[id] = diff(was, now)
+                    else:
+                        continue
+                    changed.append((section, id))
+                if len(changes) > 0:
+                    message[section] = changes
+                ids = [id for id in before if id not in state[section]]
+                if len(ids) > 0:
+                    gone[section] = ids
+                    changed.extend((section, id) for id in ids)
+            if len(gone) > 0:
+                message["gone"] = gone
+            if len(message) == 0:
+                return None
+        self.seq += 1
+        message["seq"] = self.seq
+        self.last = state
+        self.changed = changed
+        return encode(message)
+
+class StateApplier:
+    """
+    Rebuilds a game's state from its gamedelta messages, for clients.
+    """
+    def __init__(self):
+        self.seq = None
+        self.state = None # as for DeltaEncoder.encode, once we've had a keyframe
+
+    @property
+    def synced(self):
+        return self.state != None
+
+    def apply(self, message):
+        """
+        Applies a gamedelta message. Returns True if the state is up to date,
+        or False if a message has been missed (or no keyframe received yet),
+        in which case ask the server for a keyframe.
+
+        message: the gamedelta message (bytes or str)
+        """
+        obj = json.loads(message)
+        seq = obj["seq"]
+        if "key" in obj:
+            self.state = {"game": obj["game"], "teams": obj["teams"], "players": obj["players"]}
+            self.seq = seq
+            return True
+        if self.state == None:
+            return False
+        if seq != self.seq + 1:
+            if self.seq - REPEAT_WINDOW < seq <= self.seq:
+                return True # a repeat of one we've had
+            # missed one (or the server has restarted): wait for a keyframe
+            self.state = None
+            return False
+        self.seq = seq
+        state = self.state
+        if "game" in obj:
+            state["game"].update(obj["game"])
+        for section in SECTIONS:
+            if section in obj:
+                current = state[section]
+                for id, fields in obj[section].items():
+                    if id in current:
+                        current[id].update(fields)
+                    else:
+                        current[id] = fields
+        gone = obj.get("gone", {})
+        for section in SECTIONS:
+            for id in gone.get(section, []):
+                state[section].pop(id, None)
+        return True
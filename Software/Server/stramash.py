@@ -18,62 +18,120 @@
 # stramash.py
 # Implements the Laser Stramash server
 # ----------------------------------------------------------------------
-import json
-import game
+import asyncio
 from utils import *
-from game import *
-from player import *
-from team import *
-from colour import *
+from server import *
+from runtime import *
+from shards import *
+from journal import Journal
+import gametypes
 import paho.mqtt.client as mqtt
 
-games = {}
+def welcome():
+    print('================================================================================')
+    print('Laser Stramash - Prototype')
+    print('Game Server')
+    print('================================================================================')
 
-# The callback for when the client receives a CONNACK response from the server.
-def on_connect(client, userdata, flags, rc):
-    print("Connected with result code "+str(rc))
+async def serve(config):
+    """
+    Connects to the MQTT broker and runs the server until interrupted.
+    """
+    client = mqtt.Client()
+    server = Server(lambda topic, msg, retain=False: client.publish(topic, msg, retain=retain),
+        keyframe_interval=config.get_int("Server:keyframe_interval"),
+        publish_window=config.get_int("Server:publish_window"), client_rate=config.get_int("Server:client_rate"),
+        dedup_window=config.get_int("Server:dedup_window"), fire_window=config.get_int("Server:fire_window"))
+    directory = config.get("Server:journal")
+    if directory != "":
+        server.resume(Journal(directory, archive=config.get_int("Server:journal_archive") != 0))
+    runtime = Runtime(server, config.get_int("Server:queue_size"),
+        snapshot_interval=config.get_int("Server:snapshot_interval"),
+        delta_interval=config.get_int("Server:delta_interval"))
+    runtime.start()
 
-    # Subscribing in on_connect() means that if we lose the connection and
-    # reconnect then subscriptions will be renewed.
-    client.subscribe("stramash/#")
+    # The callback for when the client receives a CONNACK response from the server.
+    def on_connect(client, userdata, flags, rc):
+        print("Connected with result code "+str(rc))
 
-# The callback for when a PUBLISH message is received from the server.
-def on_message(client, userdata, msg):
-    global games
+        # Subscribing in on_connect() means that if we lose the connection and
+        # reconnect then subscriptions will be renewed.
+        client.subscribe("stramash/#")
+        server.announce()
 
-    print(msg.topic+" "+str(msg.payload))
-    # TODO dispatch the message to the game or whatever...
-    topic = str(msg.topic)
-    data = str(msg.payload.decode("utf-8", "ignore"))
-    if topic == "stramash/newgame":
-        
+    # The callback for when a PUBLISH message is received from the server.
+    # This runs in the MQTT network thread: hand the message over to the
+    # runtime, which dispatches it to the game or whatever...
+    def on_message(client, userdata, msg):
+        runtime.submit(str(msg.topic), msg.payload)
 
-        
+    client.on_connect = on_connect
+    client.on_message = on_message
+    mqtt_broker = config.get("Network:mqtt_server_address")
+    client.connect(mqtt_broker, 1883, 60)
 
+    # Processes network traffic and handles reconnecting in a background
+    # thread, leaving this one free for the runtime.
+    client.loop_start()
+    try:
+        await runtime.run()
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        if server.journal != None:
+            server.journal.stop()
 
-def welcome():
-    print('================================================================================')
-    print('Laser Stramash - Prototype')
-    print('Game Server')
-    print('================================================================================')
+def serve_sharded(config, shards):
+    """
+    Connects to the MQTT broker and runs the server, with its games spread
+    across worker processes, until interrupted.
+
+    shards: the number of worker processes
+    """
+    client = mqtt.Client()
+    publish = lambda topic, msg, retain=False: client.publish(topic, msg, retain=retain)
+    sharded = ShardedServer(shards, publish, config.get_int("Server:queue_size"),
+        config.get("Server:journal"), config.get_int("Server:snapshot_interval"),
+        config.get_int("Server:journal_archive") != 0, config.get_int("Server:delta_interval"),
+        config.get_int("Server:keyframe_interval"), config.get_int("Server:publish_window"),
+        config.get_int("Server:client_rate"), config.get_int("Server:dedup_window"),
+        config.get_int("Server:fire_window"))
+    sharded.start()
 
-# initialise config
-config = Config("server.json")
+    def on_connect(client, userdata, flags, rc):
+        print("Connected with result code "+str(rc))
+        client.subscribe("stramash/#")
+        sharded.announce()
 
-# Get started
-welcome() 
+    # forwarding is cheap, so it's done directly in the MQTT network thread
+    def on_message(client, userdata, msg):
+        sharded.submit(str(msg.topic), msg.payload)
 
-# Connect to MQTT broker 
-client = mqtt.Client()
-client.on_connect = on_connect
-client.on_message = on_message
-mqtt_broker = config.get("Network:mqtt_server_address")
-client.connect(mqtt_broker, 1883, 60)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    mqtt_broker = config.get("Network:mqtt_server_address")
+    client.connect(mqtt_broker, 1883, 60)
+    try:
+        client.loop_forever()
+    finally:
+        client.disconnect()
+        sharded.stop()
 
-# Blocking call that processes network traffic, dispatches callbacks and
-# handles reconnecting.
-# Other loop*() functions are available that give a threaded interface and a
-# manual interface.
-client.loop_forever()
+def main():
+    # initialise config
+    config = Config("server.json")
 
+    # Get started
+    welcome()
+    gametypes.discover(warm=True)
+    shards = config.get_int("Server:shards") # 0 to run everything in one process
+    try:
+        if shards > 0:
+            serve_sharded(config, shards)
+        else:
+            asyncio.run(serve(config))
+    except KeyboardInterrupt:
+        pass
 
+if __name__ == "__main__":
+    main()
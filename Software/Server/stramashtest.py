@@ -1,7 +1,27 @@
 # stramashtest.py 
 
 import unittest
-from stramash import *
+import asyncio
+import random
+import tempfile
+import time
+from server import *
+from runtime import *
+from router import *
+from shards import *
+from hits import *
+from hitcodec import *
+from hitlog import *
+from leaderboard import *
+from journal import *
+from replay import *
+import statecache
+from statedelta import *
+from publisher import *
+from gametypes import game_class, rules
+from schema import SchemaError
+from addresses import *
+from timers import TimingWheel
 
 class StramashTests(unittest.TestCase):
     # --------------------------------------------------------------------------
@@ -68,39 +88,65 @@ class StramashTests(unittest.TestCase):
     # PLAYER TESTS
     # --------------------------------------------------------------------------
     def test_player_create(self):
-        # TODO: create a team, test properties
-        # Properties
-        # name
-        # id
-        # team
-        # colour
-        # shots (int)
-        # kills (int)
-        # deaths (int)
-        # score (int)
-        player = Player(1, "Adam")
-        self.assertEqual(1, 2)
-
-    # def test_player_serialisation(self):
-    #     # TODO: create a player, serialise, make sure the serialisation is as expected 
-    #     self.assertEqual(1, 2)
+        red = Colour("Red", 255, 0, 0)
+        player = Player(1, "Adam", 2, 3, red)
+        self.assertEqual(player.id, 1)
+        self.assertEqual(player.name, "Adam")
+        self.assertEqual(player.teamnumber, 2)
+        self.assertEqual(player.playernumber, 3)
+        self.assertIs(player.colour, red)
+        self.assertEqual((player.shots, player.kills, player.ffkills, player.deaths, player.score), (0, 0, 0, 0, 0))
+        self.assertEqual(player.status, INGAME | UP)
+        self.assertEqual(Player("gun", "Adam", 1, 1).colour, None)
 
-    # def test_player_deserialisation(self):
-    #     # TODO: deserialise from string, ensure properties as expected
-    #     self.assertEqual(1, 2)
+        with self.assertRaises(TypeError):
+            Player(1.5, "Adam", 1, 1)
+        with self.assertRaises(TypeError):
+            Player(1, None, 1, 1)
+        with self.assertRaises(TypeError):
+            Player(1, "Adam", "1", 1)
+        with self.assertRaises(TypeError):
+            Player(1, "Adam", 1, 1, "Red")
+        with self.assertRaises(AttributeError):
+            player.nickname = "Ad" # slots only
 
-    # def test_player_handle_fire(self):
-    #     # TODO invoke handle_fire and ensure shots is incremented
-    #     self.assertEqual(1, 2) 
+    def test_player_serialisation(self):
+        player = Player(1, "Adam", 2, 3, Colour("Red", 255, 0, 0))
+        player.handle_fire()
+        player.handle_kill()
+        expected = '{"id":1,"name":"Adam","teamnumber":2,"playernumber":3,"colour":["Red",255,0,0],"shots":1,"kills":1,"ffkills":0,"deaths":0,"status":5,"last_death":null}'
+        self.assertEqual(player.serialise(), expected)
+
+    def test_player_deserialisation(self):
+        player = Player.deserialise('{"id":"gun","name":"Adam","teamnumber":2,"playernumber":3,"colour":null,"shots":4,"kills":2,"ffkills":1,"deaths":1,"status":5,"last_death":1200}')
+        self.assertEqual((player.id, player.name, player.teamnumber, player.playernumber), ("gun", "Adam", 2, 3))
+        self.assertEqual((player.shots, player.kills, player.ffkills, player.deaths), (4, 2, 1, 1))
+        self.assertEqual(player.score, 1.5)
+        self.assertEqual(player.last_death, 1200)
+        with self.assertRaises(ValueError):
+            Player.deserialise('{"id":"gun","name":"Adam","teamnumber":2,"playernumber":3,"colour":null,"shots":-1,"kills":2,"ffkills":1,"deaths":1,"status":5}')
+        with self.assertRaises(ColourOutOfRange):
+            Player.deserialise('{"id":"gun","name":"Adam","teamnumber":2,"playernumber":3,"colour":["Red",256,0,0],"shots":1,"kills":2,"ffkills":1,"deaths":1,"status":5}')
 
-    # def test_player_handle_kill(self):
-    #     # TODO invoke handle_kill and ensure kills is incremented
-    #     self.assertEqual(1, 2) 
-    #     # TODO handle_kill with invalid killer id and ensure exception
+    def test_player_handle_fire(self):
+        player = Player(1, "Adam", 1, 1)
+        player.handle_fire()
+        self.assertEqual(player.shots, 1)
 
-    # def test_player_handle_death(self):
-    #     # TODO invoke handle_death and ensure deaths is incremented
-    #     self.assertEqual(1, 2) 
+    def test_player_handle_kill(self):
+        player = Player(1, "Adam", 1, 1)
+        player.handle_fire()
+        player.handle_fire()
+        player.handle_kill()
+        self.assertEqual(player.kills, 1)
+        self.assertEqual(player.score, 1.5)
+
+    def test_player_handle_death(self):
+        player = Player(1, "Adam", 1, 1)
+        player.handle_death(5000)
+        self.assertEqual(player.deaths, 1)
+        self.assertEqual(player.last_death, 5000)
+        self.assertEqual(player.score, -1)
 
     # # --------------------------------------------------------------------------
     # # TEAM TESTS
@@ -170,6 +216,835 @@ class StramashTests(unittest.TestCase):
     #     # TODO: create a game, add teams, add players, save it, load it, test it
     #     self.assertEqual(1, 2)
 
-    
+    # --------------------------------------------------------------------------
+    # RUNTIME TESTS
+    # --------------------------------------------------------------------------
+    def make_server(self):
+        sent = []
+        server = Server(lambda topic, msg, retain=False: sent.append((topic, msg)))
+        return server, sent
+
+    def test_runtime_newgame(self):
+        # a newgame message creates the game and announces it
+        server, sent = self.make_server()
+        newgame = b'{"name":"Test","type":"ffa","maxtime":"00:10:00","players":[{"name":"p1","gunid":"123","colour":[255,0,0]}]}'
+
+        async def run():
+            runtime = Runtime(server)
+            runtime.start()
+            runtime.enqueue("stramash/newgame", newgame)
+            await runtime.lobby.join()
+            return runtime
+        asyncio.run(run())
+        self.assertEqual(len(server.games), 1)
+        self.assertEqual(sent[0][0], "stramash/gamecreated")
+        game = list(server.games.values())[0]
+        self.assertEqual(game.players["123"].name, "p1")
+
+    def test_runtime_slow_handler(self):
+        # a slow control handler in one game mustn't hold up hits in another
+        server, sent = self.make_server()
+        slow = Game("slow", "Slow", "ffa")
+        fast = Game("fast", "Fast", "ffa")
+        for game in (slow, fast):
+            game.addplayer("a", "A")
+            game.addplayer("b", "B")
+            game.start()
+            server.games[game.id] = game
+        handled = []
+
+        async def slow_check(game, message):
+            await asyncio.sleep(0.5)
+            handled.append("check")
+        server.router.add("stramash/game/<gameid>/check", slow_check)
+
+        async def run():
+            runtime = Runtime(server)
+            runtime.start()
+            runtime.enqueue("stramash/game/slow/check", b"")
+            runtime.enqueue("stramash/game/fast/hit", b"[1,1,2,1,0]")
+            await runtime.channel("fast").hits.join()
+            hits_done = list(handled)
+            await runtime.channel("slow").control.join()
+            return hits_done
+        self.assertEqual(asyncio.run(run()), [])
+        self.assertEqual(fast.players["a"].kills, 1)
+        self.assertEqual(fast.players["b"].deaths, 1)
+
+    def test_runtime_fire_lane(self):
+        # fires go with the hits, so a slow control lane can't hold a fire up
+        # until after its hit
+        server, sent = self.make_server()
+        server.fire_window = 500
+        game = Game("g", "Game", "ffa")
+        game.addplayer("a", "A")
+        game.addplayer("b", "B")
+        game.start()
+        server.games[game.id] = game
+
+        async def slow_check(game, message):
+            await asyncio.sleep(0.5)
+        server.router.add("stramash/game/<gameid>/check", slow_check)
+
+        async def run():
+            runtime = Runtime(server)
+            runtime.start()
+            runtime.enqueue("stramash/game/g/check", b"")
+            runtime.enqueue("stramash/game/g/fire", b"a")
+            runtime.enqueue("stramash/game/g/hit", b"[1,1,2,1,0]")
+            await runtime.channel("g").hits.join()
+            await runtime.channel("g").control.join()
+        asyncio.run(run())
+        self.assertEqual((game.players["a"].shots, game.players["a"].kills, server.rejected), (1, 1, 0))
+
+    def test_runtime_bad_fire(self):
+        # a malformed fire is dropped on its own, not with the rest of its batch
+        server, sent = self.make_server()
+        game = Game("g", "Game", "ffa")
+        for id in "abcdef":
+            game.addplayer(id, id.upper())
+        game.start()
+        server.games[game.id] = game
+
+        async def run():
+            runtime = Runtime(server)
+            runtime.start()
+            runtime.enqueue("stramash/game/g/hit", b"[1,1,2,1,0]")
+            runtime.enqueue("stramash/game/g/fire", b"\xb2\x01\x01")
+            runtime.enqueue("stramash/game/g/hit", b"[3,1,4,1,0]")
+            runtime.enqueue("stramash/game/g/hit", b"[5,1,6,1,0]")
+            await runtime.channel("g").hits.join()
+        asyncio.run(run())
+        self.assertEqual([game.players[id].kills for id in "ace"], [1, 1, 1])
+        self.assertEqual(game.players["a"].shots, 0)
+
+    # --------------------------------------------------------------------------
+    # ROUTER TESTS
+    # --------------------------------------------------------------------------
+    def test_router_match(self):
+        router = TopicRouter()
+        router.add("stramash/newgame", "newgame")
+        router.add("stramash/game/<gameid>/hit", "hit")
+        router.add("stramash/game/<gameid>/check", "check")
+        router.add("stramash/player/<playerid>/up", "up")
+        self.assertEqual(router.match("stramash/newgame"), ("newgame", {}))
+        self.assertEqual(router.match("stramash/game/abc/hit"), ("hit", {"gameid": "abc"}))
+        self.assertEqual(router.match("stramash/player/p1/up"), ("up", {"playerid": "p1"}))
+        self.assertEqual(router.match("stramash/game/abc/gamestate"), (None, None))
+        self.assertEqual(router.match("stramash/game/abc"), (None, None))
+        self.assertEqual(router.match("stramash/game/abc/hit/extra"), (None, None))
+
+    def test_router_literal_precedence(self):
+        # literal levels win over parameters, falling back if they don't match
+        router = TopicRouter()
+        router.add("stramash/<gameid>/fire", "fire")
+        router.add("stramash/game/<gameid>/hit", "hit")
+        self.assertEqual(router.match("stramash/game/abc/hit"), ("hit", {"gameid": "abc"}))
+        self.assertEqual(router.match("stramash/game/fire"), ("fire", {"gameid": "game"}))
+
+    # --------------------------------------------------------------------------
+    # SHARD TESTS
+    # --------------------------------------------------------------------------
+    def test_shards(self):
+        # games are created on, and hits routed to, the shard owning them
+        import queue
+        sent = queue.Queue()
+        sharded = ShardedServer(2, lambda topic, msg, retain=False: sent.put((topic, msg)))
+        sharded.start()
+
+        def received():
+            # the players' up and down messages may come at any point
+            while True:
+                topic, msg = sent.get(timeout=10)
+                if not topic.startswith("stramash/player/"):
+                    return topic, msg
+        try:
+            newgame = b'{"name":"Test","type":"ffa","maxtime":"00:10:00","players":[{"name":"a","gunid":"a","colour":[255,0,0]},{"name":"b","gunid":"b","colour":[0,0,255]}]}'
+            gameids = []
+            for i in range(4):
+                sharded.submit("stramash/newgame", newgame)
+                topic, msg = sent.get(timeout=10)
+                self.assertEqual(topic, "stramash/gamecreated")
+                gameids.append(json.loads(msg)["id"])
+            for gameid in gameids:
+                sharded.submit("stramash/game/"+gameid+"/startgame", b"")
+                self.assertEqual(received()[0], "stramash/game/"+gameid+"/gamestarted")
+                sharded.submit("stramash/game/"+gameid+"/hit", b"[1,1,2,1,0]")
+                sharded.submit("stramash/game/"+gameid+"/check", b"")
+                topic, msg = received()
+                self.assertEqual(topic, "stramash/game/"+gameid+"/gamestate")
+                self.assertEqual(json.loads(msg)["status"], "active")
+        finally:
+            sharded.stop()
+
+    def test_shards_full(self):
+        # a backed-up shard drops messages rather than holding up the caller
+        import multiprocessing
+        sharded = ShardedServer(1, lambda topic, msg, retain=False: None)
+        sharded.inboxes = [multiprocessing.Queue(1)]
+        sharded.submit("stramash/game/game/hit", b"[1,1,2,1,0]")
+        sharded.submit("stramash/game/game/hit", b"[1,1,2,1,0]")
+        sharded.submit("stramash/game/game/nonsense", b"")
+        self.assertEqual(sharded.dropped, 1)
+        self.assertEqual(sharded.inboxes[0].get(timeout=10), ("stramash/game/game/hit", b"[1,1,2,1,0]"))
+        # a new game keeps a valid id the client chose, as with a single Server
+        newgame = b'{"name":"Test","type":"ffa","maxtime":"00:10:00","id":"mine"}'
+        sharded.submit("stramash/newgame", newgame)
+        self.assertEqual(sharded.inboxes[0].get(timeout=10), ("stramash/newgame", newgame))
+        sharded.submit("stramash/newgame", b'{"name":"Test","type":"ffa","maxtime":"00:10:00","id":"a/#"}')
+        sharded.submit("stramash/newgame", b'{"name":"Test","type":"ffa","maxtime":"00:10:00"}')
+        topic, payload = sharded.inboxes[0].get(timeout=10)
+        self.assertNotIn(json.loads(payload)["id"], (None, "a/#"))
+
+    # --------------------------------------------------------------------------
+    # HIT PIPELINE TESTS
+    # --------------------------------------------------------------------------
+    def test_parse_hits(self):
+        self.assertEqual(parse_hits([b"[1,1,2,1,0]", b"[2,1,1,1,3]"]), [[1,1,2,1,0], [2,1,1,1,3]])
+        # a malformed message is dropped without taking its neighbours with it
+        self.assertEqual(parse_hits([b"[1,1,2,1,0]", b"[1,2", b"3,4,5]", b"[2,1,1,1,3]"]), [[1,1,2,1,0], [2,1,1,1,3]])
+        self.assertEqual(parse_hits([b"[1,1,2,1]", b'[1,1,2,1,"0"]', b"nonsense"]), [])
+
+    def test_hit_batch(self):
+        server, sent = self.make_server()
+        server.dedup_window = 0 # see test_hit_dedup
+        game = Game("g", "Game", "ffa")
+        game.addplayer("a", "A")
+        game.addplayer("b", "B")
+        server.hit_batch(game, [b"[1,1,2,1,0]"])
+        self.assertEqual(game.players["a"].kills, 0) # not started yet
+        game.start()
+        server.hit_batch(game, [b"[1,1,2,1,0]", b"[2,1,1,1,0]", b"[1,1,2,1,1]", b"[9,9,2,1,0]"])
+        self.assertEqual(game.players["a"].kills, 2)
+        self.assertEqual(game.players["a"].deaths, 1)
+        self.assertEqual(game.players["b"].kills, 1)
+        self.assertEqual(game.players["b"].deaths, 2)
+        self.assertEqual(server.hit_meter.total, 5) # ingested, counted or not
+        # the hit log holds the hits between players in the game
+        self.assertEqual(len(game.hitlog), 3)
+        self.assertEqual(game.hitlog[1][:5], (2,1,1,1,0))
+
+    def test_hit_dedup(self):
+        dedup = HitDedup(5, size=4)
+        kept = lambda hits, now: dedup.filter(hits, [now] * len(hits))[0]
+        # the same shot seen by two sensors, and then by one of them again
+        self.assertEqual(kept([[1,1,2,1,0], [1,1,2,1,1], [1,1,2,1,1]], 1000), [[1,1,2,1,0], [1,1,2,1,1]])
+        self.assertEqual(kept([[1,1,2,1,2], [2,1,1,1,0]], 1004), [[2,1,1,1,0]])
+        self.assertEqual(dedup.collapsed, 2)
+        # once the window has passed, it's another shot
+        self.assertEqual(kept([[1,1,2,1,0], [1,1,2,1,3]], 1011), [[1,1,2,1,0]])
+        # each hit is checked against when it arrived, not when its batch did
+        self.assertEqual(dedup.filter([[4,1,2,1,0], [4,1,2,1,1], [4,1,2,1,2]], [1011, 1013, 3000]),
+            ([[4,1,2,1,0], [4,1,2,1,2]], [1011, 3000]))
+        # only so many pairs are remembered
+        kept([[3,1,t,1,0] for t in range(10)], 3001)
+        self.assertLessEqual(len(dedup.recent), 4)
+        self.assertEqual(len(dedup.order), 4)
+        # the server collapses a game's hits before they count
+        server, sent = self.make_server()
+        game = Game("g", "Game", "ffa")
+        game.addplayer("a", "A")
+        game.addplayer("b", "B")
+        game.start()
+        server.hit_batch(game, [b"[1,1,2,1,0]", b"[1,1,2,1,1]"])
+        self.assertEqual((game.players["a"].kills, server.collapsed, len(game.hitlog)), (1, 1, 1))
+        game.players["b"].status |= UP
+        now = time.monotonic() * 1000
+        server.hit_batch(game, [b"[1,1,2,1,0]", b"[1,1,2,1,1]"], [now + 5000, now + 7000])
+        self.assertEqual((game.players["a"].kills, server.collapsed), (3, 1))
+
+    def test_fire_correlation(self):
+        correlator = FireCorrelator(500, size=4)
+        kept = lambda hits, now: correlator.filter(hits, [now] * len(hits))[0]
+        correlator.fire(1, 1, 1000)
+        correlator.fire(1, 1, 1100)
+        # each hit takes the latest fire not yet matched to its victim, within
+        # the window; one shot can tag several victims
+        self.assertEqual(kept([[1,1,2,1,0], [1,1,3,1,0], [1,1,2,1,0], [1,1,2,1,0], [2,1,1,1,0]], 1200),
+            [[1,1,2,1,0], [1,1,3,1,0], [1,1,2,1,0]])
+        self.assertEqual((correlator.matched, correlator.rejected), (3, 2))
+        # but a shot counts once towards accuracy
+        self.assertEqual(correlator.accuracy(1, 1), 1)
+        correlator.fire(1, 1, 1300)
+        self.assertEqual(kept([[1,1,2,1,0]], 1900), []) # too late
+        for t in range(2000, 2006):
+            correlator.fire(1, 1, t)
+        self.assertEqual(len(kept([[1,1,2,1,0]] * 6, 2010)), 4) # only the last 4 are kept
+        self.assertEqual(correlator.accuracy(1, 1), 6 / 9)
+        # the server only counts hits following a fire, so accuracy is live
+        server, sent = self.make_server()
+        server.fire_window = 500
+        game = Game("g", "Game", "ffa")
+        game.addplayer("a", "A")
+        game.addplayer("b", "B")
+        game.start()
+        asyncio.run(server.fire(game, b"a"))
+        server.hit_batch(game, [b"[1,1,2,1,0]"])
+        server.hit_batch(game, [b"[1,1,2,1,0]", b"[2,1,1,1,0]"])
+        a = game.players["a"]
+        self.assertEqual((a.shots, a.kills, game.players["b"].kills, server.rejected), (1, 1, 0, 2))
+        self.assertEqual(a.score, 2)
+        # hits are matched on when they and their fires arrived, however late
+        # they're handled
+        game.players["b"].status |= UP
+        arrived = time.monotonic() * 1000 - 5000
+        server.fire_at(game, b"a", arrived)
+        server.hit_batch(game, [b"[1,1,2,1,0]"], [arrived + 100])
+        self.assertEqual((a.shots, a.kills, server.rejected), (2, 2, 2))
+        # and the accuracy is in the scoreboard
+        asyncio.run(server.checkscores(game, b""))
+        self.assertEqual(json.loads(sent[-1][1])["scores"][0]["accuracy"], 1.0)
+
+    def test_binary_hits(self):
+        packed = pack_hit(1, 2, 3, 4, 5, 70000, 123456789)
+        self.assertEqual(len(packed), 12)
+        self.assertTrue(is_binary(packed))
+        self.assertFalse(is_binary(b"[1,2,3,4,5]"))
+        self.assertEqual(unpack_hit(packed), (1, 2, 3, 4, 5, 70000 & 0xFFFF, 123456789))
+        with self.assertRaises(ValueError):
+            unpack_hit(packed[:-1])
+        # binary and JSON hits can be mixed in a batch, and keep their order;
+        # bad ones are dropped
+        hits = parse_hits([b"[2,1,1,1,0]", packed, b"[1,1,2,1,0]", packed[:-1], packed])
+        self.assertEqual(hits, [[2,1,1,1,0], [1,2,3,4,5], [1,1,2,1,0], [1,2,3,4,5]])
+        self.assertEqual(unpack_fire(pack_fire(7, 8, 9, 10)), (7, 8, 9, 10))
+
+    def test_hitlog(self):
+        log = HitLog(2)
+        for i in range(100):
+            log.append(1, i % 8, 2, i % 5, i % 3, 1000 * i)
+        self.assertEqual(len(log), 100)
+        self.assertTrue(log.capacity >= 100)
+        self.assertEqual(log[10], (1, 2, 2, 0, 1, 10000))
+        self.assertEqual(log[-1], (1, 3, 2, 4, 0, 99000))
+        with self.assertRaises(IndexError):
+            log[100]
+        victims = log.view("victim")
+        self.assertEqual(len(victims), 100)
+        self.assertEqual(sum(victims), sum(i % 5 for i in range(100)))
+        victims.release()
+        data = log.serialise()
+        self.assertEqual(len(data), 9 + 100 * 9)
+        copy = HitLog.deserialise(data)
+        self.assertEqual([copy[i] for i in range(100)], [log[i] for i in range(100)])
+        copy.append(3, 3, 3, 3, 3, 3) # still growable
+        self.assertEqual(copy[100], (3, 3, 3, 3, 3, 3))
+        self.assertEqual(len(HitLog.deserialise(HitLog().serialise())), 0)
+        with self.assertRaises(ValueError):
+            HitLog.deserialise(data[:-1])
+
+    # --------------------------------------------------------------------------
+    # LEADERBOARD TESTS
+    # --------------------------------------------------------------------------
+    def test_leaderboard(self):
+        game = Game("g", "Game", "ffa")
+        for i in range(20):
+            game.addplayer("p"+str(i), "P"+str(i))
+        game.start()
+        players = list(game.players.values())
+        random.seed(7)
+        for i in range(500):
+            shooter, victim = random.sample(players, 2)
+            game.fire(shooter.id)
+            game.hit(shooter.teamnumber, shooter.playernumber, victim.teamnumber, victim.playernumber, 0)
+        game.deleteplayer("p3")
+        # the same order as sorting by score, ties in the order players joined
+        expected = sorted(game.players.values(), key=lambda player: -player.score)
+        self.assertEqual(game.leaderboard.top(100), expected)
+        self.assertEqual(game.leaderboard.top(3), expected[:3])
+        for i, player in enumerate(expected):
+            self.assertEqual(game.leaderboard.rank(player.id), i + 1)
+        around, rank = game.leaderboard.around(expected[1].id, 2)
+        self.assertEqual((around, rank), (expected[:4], 1))
+        self.assertEqual(game.state()["leaders"], [player.id for player in expected[:3]])
+
+    def test_checkscores(self):
+        server, sent = self.make_server()
+        asyncio.run(server.newgame(b'{"name":"Test","type":"ffa","maxtime":"00:10:00","players":[{"name":"a","gunid":"a","colour":[255,0,0]},{"name":"b","gunid":"b","colour":[0,0,255]}]}'))
+        game = list(server.games.values())[0]
+        game.start()
+        server.hit_batch(game, [b"[2,1,1,1,0]"])
+        asyncio.run(server.checkscores(game, b""))
+        topic, msg = sent[-1]
+        self.assertEqual(topic, "stramash/game/"+game.id+"/scoreboard")
+        scoreboard = json.loads(msg)
+        self.assertEqual(scoreboard["players"], 2)
+        self.assertEqual([(s["rank"], s["id"], s["score"]) for s in scoreboard["scores"]], [(1, "b", 1), (2, "a", -1)])
+        asyncio.run(server.checkscores(game, b'{"player":"a","around":0}'))
+        self.assertEqual([s["id"] for s in json.loads(sent[-1][1])["scores"]], ["a"])
+
+    def test_statecache(self):
+        stats = statecache.stats
+        stats.reset()
+        game = Game("g", "Game", "ffa", "00:10:00")
+        red = game.addteam("Red", Colour("Red", 255, 0, 0))
+        a = game.addplayer("a", "A", red)
+        b = game.addplayer("b", "B", None, Colour("Blue", 0, 0, 255))
+        message = a.state_message()
+        self.assertEqual(json.loads(message), a.state())
+        self.assertIs(a.state_message(), message)
+        self.assertEqual((stats.hits, stats.misses), (1, 1))
+        # anything the message covers changing encodes it again
+        game.start()
+        game.fire("a")
+        self.assertEqual(json.loads(a.state_message())["shots"], 1)
+        self.assertEqual(json.loads(red.state_message())["players"], ["a"])
+        state = game.state_message()
+        self.assertIs(game.state_message(), state)
+        game.hit(b.teamnumber, b.playernumber, a.teamnumber, a.playernumber, 0)
+        self.assertEqual(json.loads(game.state_message())["leaders"], ["b", "a"])
+        game.deleteteam(red.id)
+        self.assertEqual(json.loads(a.state_message())["teamnumber"], a.teamnumber)
+        self.assertEqual(stats.hits, 2)
+
+    def test_deleteteam(self):
+        server, sent = self.make_server()
+        asyncio.run(server.newgame(b'{"name":"Test","type":"teams","maxtime":"00:10:00","teams":['
+            b'{"name":"Red","colour":[255,0,0],"players":[{"name":"A","gunid":"a"},{"name":"B","gunid":"b"}]}]}'))
+        game = list(server.games.values())[0]
+        team = list(game.teams.values())[0]
+        asyncio.run(server.deleteteam(game, team.id.encode("utf-8")))
+        self.assertEqual(game.teams, {})
+        self.assertEqual(sent[-3], ("stramash/game/"+game.id+"/teamdeleted", team.id))
+        states = [json.loads(message) for topic, message in sent[-2:]]
+        self.assertEqual([state["id"] for state in states], ["a", "b"])
+        self.assertEqual(sorted(state["teamnumber"] for state in states), [2, 3])
+        for state in states:
+            self.assertIs(game.find_player(state["teamnumber"], state["playernumber"]), game.players[state["id"]])
+        # and keep their new addresses when the game is restored
+        restored = game_class("teams").from_dict(game.to_dict())
+        self.assertEqual([(p.teamnumber, p.playernumber) for p in restored.players.values()], [(2, 1), (3, 1)])
+
+    def test_checkstate(self):
+        server, sent = self.make_server()
+        asyncio.run(server.newgame(b'{"name":"Test","type":"ffa","maxtime":"00:10:00","teams":[{"name":"Red","colour":[255,0,0],"players":[{"name":"a","gunid":"a"}]}]}'))
+        game = list(server.games.values())[0]
+        team = list(game.teams.values())[0]
+        asyncio.run(server.checkteam(game, team.id.encode("utf-8")))
+        self.assertEqual(sent[-1], ("stramash/game/"+game.id+"/teamstate", team.state_message()))
+        asyncio.run(server.checkplayer(game, b"a"))
+        self.assertEqual(json.loads(sent[-1][1]), game.players["a"].state())
+        count = len(sent)
+        asyncio.run(server.checkplayer(game, b"nobody"))
+        self.assertEqual(len(sent), count)
+
+    def test_statedelta(self):
+        encoder = DeltaEncoder()
+        applier = StateApplier()
+        state = {"game": {"status": "active", "runtime": "00:00:01"}, "teams": {},
+            "players": {"a": {"shots": 0, "kills": 0}, "b": {"shots": 0, "kills": 0}}}
+        self.assertFalse(applier.apply(b'{"seq":1,"players":{}}')) # no keyframe yet
+        self.assertTrue(applier.apply(encoder.encode(state)))
+        self.assertEqual(applier.state, state)
+        self.assertEqual(encoder.encode(json.loads(json.dumps(state))), None)
+        later = {"game": {"status": "active", "runtime": "00:00:02"}, "teams": {},
+            "players": {"a": {"shots": 1, "kills": 0}, "c": {"shots": 0, "kills": 0}}}
+        message = encoder.encode(json.loads(json.dumps(later)))
+        self.assertEqual(json.loads(message), {"seq": 2, "game": {"runtime": "00:00:02"},
+            "players": {"a": {"shots": 1}, "c": {"shots": 0, "kills": 0}}, "gone": {"players": ["b"]}})
+        self.assertEqual(sorted(encoder.changed, key=str), [("game", None), ("players", "a"), ("players", "b"), ("players", "c")])
+        self.assertTrue(applier.apply(message))
+        self.assertEqual(applier.state, later)
+        # a missed message means waiting for a keyframe
+        later["game"]["status"] = "finished"
+        encoder.encode(json.loads(json.dumps(later)))
+        later["players"]["a"]["kills"] = 1
+        self.assertFalse(applier.apply(encoder.encode(json.loads(json.dumps(later)))))
+        self.assertFalse(applier.synced)
+        self.assertTrue(applier.apply(encoder.encode(json.loads(json.dumps(later)), True)))
+        self.assertEqual(applier.state, later)
+        # a repeat is ignored, but a seq starting again (the server has
+        # restarted) means waiting for a keyframe
+        self.assertTrue(applier.apply(b'{"seq":3,"players":{"a":{"kills":5}}}'))
+        self.assertEqual(applier.state, later)
+        applier.seq = 100 # well into the stream
+        self.assertFalse(applier.apply(b'{"seq":1,"players":{"a":{"kills":5}}}'))
+        self.assertFalse(applier.synced)
+
+    def test_publish_deltas(self):
+        server, sent = self.make_server()
+        asyncio.run(server.newgame(b'{"name":"Test","type":"ffa","maxtime":"00:10:00","players":[{"name":"a","gunid":"a","colour":[255,0,0]},{"name":"b","gunid":"b","colour":[0,0,255]}]}'))
+        game = list(server.games.values())[0]
+        topic = "stramash/game/"+game.id+"/gamedelta"
+        deltas = lambda: [msg for t, msg in sent if t == topic]
+        applier = StateApplier()
+        server.publish_deltas(0)
+        self.assertTrue(applier.apply(deltas()[-1]))
+        count = len(sent)
+        server.publish_deltas(1)
+        self.assertEqual(len(sent), count) # nothing has changed
+        game.start()
+        server.hit_batch(game, [b"[2,1,1,1,0]"])
+        server.publish_deltas(2)
+        self.assertTrue(applier.apply(deltas()[-1]))
+        self.assertEqual(applier.state, server.full_state(game))
+        self.assertNotIn("key", json.loads(deltas()[-1]))
+        self.assertGreater(server.delta_stats.saved, 0)
+        # keyframes on request, and every keyframe_interval while active
+        asyncio.run(server.keyframe(game, b""))
+        self.assertIn("key", json.loads(deltas()[-1]))
+        count = len(deltas())
+        server.publish_deltas(time.monotonic() + server.keyframe_interval)
+        self.assertEqual(len(deltas()), count + 1)
+        self.assertIn("key", json.loads(deltas()[-1]))
+
+    def test_snapshots(self):
+        retained = {}
+        server = Server(lambda topic, msg, retain=False: retained.__setitem__(topic, msg) if retain else None)
+        asyncio.run(server.newgame(b'{"name":"Test","type":"ffa","maxtime":"00:10:00","teams":[{"name":"Red","colour":[255,0,0],"players":[{"name":"a","gunid":"a"}]}],"players":[{"name":"b","gunid":"b","colour":[0,0,255]}]}'))
+        game = list(server.games.values())[0]
+        server.publish_deltas(0)
+        # one subscribe brings a late client up to date
+        applier = StateApplier()
+        self.assertTrue(applier.apply(retained["stramash/game/"+game.id+"/snapshot"]))
+        self.assertEqual(applier.state, server.full_state(game))
+        snapshot = json.loads(retained["stramash/player/a/snapshot"])
+        self.assertEqual((snapshot["game"]["id"], snapshot["team"]["name"], snapshot["player"]["id"]), (game.id, "Red", "a"))
+        self.assertEqual(json.loads(retained["stramash/player/b/snapshot"])["team"], None)
+        # snapshots follow the deltas, so the stream carries on from them
+        game.start()
+        server.publish_deltas(1)
+        self.assertEqual(json.loads(retained["stramash/player/a/snapshot"])["game"]["status"], "active")
+        server.hit_batch(game, [b"[2,1,1,1,0]"])
+        server.publish_deltas(2)
+        self.assertEqual(json.loads(retained["stramash/player/b/snapshot"])["player"]["kills"], 0)
+        asyncio.run(server.keyframe(game, b""))
+        self.assertEqual(json.loads(retained["stramash/player/b/snapshot"])["player"]["kills"], 1)
+        # with the gun's condition, which the gun rejoins in
+        self.assertEqual(json.loads(retained["stramash/player/a/snapshot"])["condition"], "down")
+        self.assertEqual(json.loads(retained["stramash/player/b/snapshot"])["condition"], "up")
+        # and are cleared when the game is deleted
+        asyncio.run(server.delete(game, b""))
+        self.assertEqual([topic for topic, msg in retained.items() if msg != ""], [])
+
+    def test_publisher(self):
+        sent = []
+        publisher = Publisher(lambda topic, msg, retain: sent.append((topic, msg)), window=50, client_rate=2)
+        publisher.send("stramash/game/g/gamestate", "1")
+        publisher.send("stramash/game/g/teamadded", "red")
+        publisher.send("stramash/game/g/teamadded", "blue")
+        publisher.send("stramash/game/g/gamestate", "2")
+        publisher.send("stramash/player/p/down", "")
+        publisher.send("stramash/player/p/up", "")
+        publisher.send("stramash/game/g/gamestarted", "")
+        # control messages go straight out; superseded state is merged
+        self.assertEqual(sent, [("stramash/game/g/gamestarted", "")])
+        self.assertEqual(publisher.superseded, 2)
+        publisher.flush(0)
+        self.assertEqual(sent[1:], [("stramash/game/g/gamestate", "2"), ("stramash/game/g/teamadded", "red"),
+            ("stramash/player/p/up", "")])
+        # the game is over its rate now: the rest waits, in order
+        self.assertEqual(publisher.deferred, 1)
+        publisher.flush(1)
+        self.assertEqual(sent[4:], [("stramash/game/g/teamadded", "blue")])
+        publisher.send("stramash/game/g/gamestate", "3")
+        publisher.forget("game/g")
+        publisher.flush(2)
+        self.assertEqual(len(sent), 5)
+        # clearing a retained topic goes straight out, so it can be forgotten
+        publisher.send("stramash/game/g/snapshot", "", True)
+        self.assertEqual(sent[-1], ("stramash/game/g/snapshot", ""))
+        self.assertNotIn("game/g", publisher.buckets)
+
+    def test_gametypes(self):
+        import sys
+        self.assertIs(game_class("ffa"), sys.modules["game_ffa"].Game_ffa)
+        self.assertEqual(rules("royale")["lives"], 1)
+        self.assertEqual(rules("teams")["lives"], 0)
+        # types are only ever looked up, never imported on demand
+        for type in ("os", "../utils", "", None):
+            with self.assertRaises(GameError):
+                game_class(type)
+        self.assertNotIn("game_os", sys.modules)
+        server, sent = self.make_server()
+        with self.assertRaises(GameError):
+            asyncio.run(server.newgame(b'{"name":"Test","type":"os","maxtime":"00:10:00"}'))
+        self.assertEqual(server.games, {})
+
+    def test_game_teams(self):
+        game = game_class("teams")("g", "Game", "teams", "00:10:00")
+        red = game.addteam("Red", Colour("Red", 255, 0, 0))
+        game.addplayer("a", "A", red)
+        with self.assertRaises(GameError):
+            game.addplayer("b", "B", None, Colour("Blue", 0, 0, 255))
+
+    def test_game_royale(self):
+        game = game_class("royale")("g", "Game", "royale", "00:10:00")
+        for id in ("a", "b", "c"):
+            game.addplayer(id, id.upper(), None, Colour("Red", 255, 0, 0))
+        a, b, c = (game.players[id] for id in ("a", "b", "c"))
+        game.start()
+        game.apply_hits([[a.teamnumber, a.playernumber, b.teamnumber, b.playernumber, 0]], 1000)
+        self.assertEqual(game.condition(b, 1000), "out")
+        # once out, a player can't hit or be hit
+        self.assertEqual(game.apply_hits([[b.teamnumber, b.playernumber, c.teamnumber, c.playernumber, 0],
+            [c.teamnumber, c.playernumber, b.teamnumber, b.playernumber, 0]], 2000), [])
+        self.assertEqual((b.deaths, c.deaths, c.kills), (1, 0, 0))
+        self.assertEqual(game.condition(a, 2000), "up")
+
+    def test_addresses(self):
+        pool = NumberPool()
+        self.assertEqual([pool.allocate() for i in range(3)], [1, 2, 3])
+        pool.release(2)
+        self.assertEqual(pool.allocate(), 2)
+        with self.assertRaises(AddressError):
+            pool.claim(3)
+        with self.assertRaises(AddressError):
+            pool.claim(256)
+        for i in range(252):
+            pool.allocate()
+        with self.assertRaises(AddressError):
+            pool.allocate()
+        # numbers are reused once players and teams have gone
+        game = game_class("ffa")("g", "Game", "ffa", "00:10:00")
+        red = game.addteam("Red", Colour("Red", 255, 0, 0))
+        a, b, c = (game.addplayer(id, id.upper(), red) for id in ("a", "b", "c"))
+        d = game.addplayer("d", "D", None, Colour("Blue", 0, 0, 255))
+        self.assertEqual([(p.teamnumber, p.playernumber) for p in (a, b, c, d)], [(1, 1), (1, 2), (1, 3), (2, 1)])
+        game.deleteplayer("b")
+        game.deleteplayer("d")
+        e, f = game.addplayer("e", "E", red), game.addplayer("f", "F")
+        self.assertEqual((e.playernumber, f.teamnumber), (2, 2))
+        self.assertIs(game.find_player(1, 3), c)
+        self.assertEqual(game.find_player(2, 2), None)
+        self.assertEqual(game.deleteteam(red.id), [a, c, e])
+        # its players are re-homed, and only then is its number given back
+        self.assertEqual([(p.teamnumber, p.playernumber) for p in (a, c, e)], [(3, 1), (4, 1), (5, 1)])
+        self.assertEqual([p.colour.to_list() for p in (a, c, e)], [["Red", 255, 0, 0]] * 3)
+        self.assertEqual([p.status & INTEAM for p in (a, c, e)], [0, 0, 0])
+        self.assertIs(game.find_player(4, 1), c)
+        self.assertEqual((game.find_player(1, 1), game.addteam("Blue", None).number), (None, 1))
+        # a restored game is checked for two players at the same address
+        data = game.to_dict()
+        self.assertEqual(game_class("ffa").from_dict(data).find_player(2, 1).id, "f")
+        data["players"][-1]["teamnumber"] = 1
+        with self.assertRaises(GameError):
+            game_class("ffa").from_dict(data)
+        data["players"][-1]["teamnumber"] = -1
+        with self.assertRaises(GameError):
+            game_class("ffa").from_dict(data)
+
+    def test_schema(self):
+        server, sent = self.make_server()
+        # teams, with the launcher's string colours
+        asyncio.run(server.newgame(b'{"name":"Test","type":"teams","maxtime":"00:10:00","teams":['
+            b'{"name":"Red","colour":"[255,0,0]","players":[{"name":"A","gunid":"a"},{"name":"B","gunid":7}]},'
+            b'{"name":"Blue","colour":[0,0,255]}]}'))
+        game = list(server.games.values())[0]
+        self.assertEqual(game.players["7"].colour.to_list(), ["Red", 255, 0, 0])
+        self.assertEqual([team.name for team in game.teams.values()], ["Red", "Blue"])
+        # errors say where they are, and nothing is created
+        for message, error in (
+                (b'{"name":"T","type":"teams","maxtime":"00:10:00","teams":[{"name":"Red","colour":[255,0,0],'
+                    b'"players":[{"name":"A","gunid":"a"},{"name":"B"}]}]}', "teams[0].players[1].gunid: missing"),
+                (b'{"name":"T","type":"ffa","maxtime":"00:10:00","players":[{"name":"A","gunid":"a",'
+                    b'"colour":[256,0,0]}]}', "players[0].colour: colour components must be integers, 0-255"),
+                (b'{"name":"T","type":"ffa","maxtime":600}', "maxtime: expected a string"),
+                (b'{"name":"T","type":"ffa","maxtime":"00:10:00","players":{}}', "players: expected a list"),
+                (b'["T"]', "expected an object"),
+                (b'{"name":"T","type":"ffa","maxtime":"00:10:00","id":"a/+/#"}',
+                    "id: expected a game id (letters, digits, - and _)"),
+                (b'{"name":"T","type":"ffa","maxtime":"00:10:00","id":""}',
+                    "id: expected a game id (letters, digits, - and _)"),
+                (b'{"name":', None)):
+            with self.assertRaises(SchemaError) as raised:
+                asyncio.run(server.newgame(message))
+            if error != None:
+                self.assertEqual(str(raised.exception), error)
+        self.assertEqual(len(server.games), 1)
+        with self.assertRaises(SchemaError):
+            asyncio.run(server.addteam(game, b'{"name":"Green","colour":[0,255]}'))
+        ffa = game_class("ffa")("f", "Game", "ffa", "00:10:00")
+        asyncio.run(server.addplayer(ffa, b'{"id":"c","name":"C"}'))
+        self.assertEqual(ffa.players["c"].colour, None)
+
+    # --------------------------------------------------------------------------
+    # TIMER TESTS
+    # --------------------------------------------------------------------------
+    def test_timing_wheel(self):
+        wheel = TimingWheel(0, tick=10)
+        ran = []
+        # near and far (moved inwards as the wheel turns), out of order
+        for when in (5000000, 25, 3000, 20, 700000, 20, 2560):
+            wheel.schedule(when, ran.append, when)
+        cancelled = wheel.schedule(40, ran.append, 40)
+        wheel.schedule(0, ran.append, 0) # already due
+        self.assertEqual(len(wheel), 9)
+        wheel.cancel(cancelled)
+        wheel.cancel(cancelled)
+        wheel.advance(19)
+        self.assertEqual(ran, [0])
+        wheel.advance(3000)
+        self.assertEqual(ran, [0, 20, 20, 25, 2560, 3000])
+        wheel.advance(4999999)
+        self.assertEqual(ran, [0, 20, 20, 25, 2560, 3000, 700000])
+        wheel.advance(5000000)
+        self.assertEqual((ran[-1], len(wheel), cancelled.pending), (5000000, 0, False))
+        # a callback can set the next timer
+        wheel.schedule(5000100, lambda: wheel.schedule(5000200, ran.append, "again"))
+        wheel.advance(6000000)
+        self.assertEqual(ran[-1], "again")
+        # one failing callback doesn't stop the rest of its bucket
+        wheel.schedule(6000100, lambda: 1 / 0)
+        wheel.schedule(6000100, ran.append, "after")
+        wheel.advance(6000200)
+        self.assertEqual((ran[-1], len(wheel)), ("after", 0))
+
+    def test_server_timers(self):
+        server, sent = self.make_server()
+        game = Game("g", "Game", "ffa", "00:01:00")
+        game.addplayer("a", "A")
+        game.addplayer("b", "B")
+        asyncio.run(server.startgame(game, b""))
+        server.hit_batch(game, [b"[1,1,2,1,0]"])
+        self.assertEqual(sent[-1], ("stramash/player/b/down", "down"))
+        # hit again while down: the timer starts over, rather than adding another
+        server.hit_batch(game, [b"[1,1,2,1,0]"])
+        self.assertEqual(len(server.timers), 2) # and the game's
+        server.timers.advance(time.monotonic() * 1000 + game.down_time + 100)
+        self.assertEqual(sent[-1], ("stramash/player/b/up", "shielded"))
+        server.timers.advance(time.monotonic() * 1000 + game.down_time + game.shield_time + 200)
+        self.assertEqual(sent[-1], ("stramash/player/b/up", "up"))
+        # and the game ends when its time is up
+        self.assertEqual(game.status, ACTIVE)
+        server.timers.advance(time.monotonic() * 1000 + 61000)
+        self.assertEqual((game.status, sent[-1][0]), (FINISHED, "stramash/game/g/gameended"))
+        self.assertEqual((len(server.timers), server.game_timers), (0, {}))
+
+    def test_delete_forgets_clients(self):
+        # a deleted game's (and player's) rate limits don't outlive them
+        sent = []
+        server = Server(lambda topic, msg, retain=False: sent.append((topic, msg)), publish_window=10, client_rate=5)
+        game = Game("g", "Game", "ffa", "00:01:00")
+        for id in "abc":
+            game.addplayer(id, id.upper())
+        server.games[game.id] = game
+        asyncio.run(server.startgame(game, b""))
+        server.hit_batch(game, [b"[1,1,2,1,0]", b"[1,1,3,1,0]"])
+        server.publish_deltas(0)
+        server.publisher.flush()
+        self.assertIn("player/b", server.publisher.buckets)
+        asyncio.run(server.deleteplayer(game, b"b"))
+        self.assertNotIn("player/b", server.publisher.buckets)
+        asyncio.run(server.delete(game, b""))
+        server.publisher.flush()
+        self.assertEqual((server.publisher.buckets, server.publisher.pending), ({}, {}))
+        self.assertIn(("stramash/player/c/snapshot", ""), sent)
+
+    def test_deleteplayer_timers(self):
+        server, sent = self.make_server()
+        game = Game("g", "Game", "ffa", "00:01:00")
+        game.addplayer("a", "A")
+        game.addplayer("b", "B")
+        asyncio.run(server.startgame(game, b""))
+        server.hit_batch(game, [b"[1,1,2,1,0]"])
+        self.assertEqual(len(server.timers), 2)
+        # deleting a player who's down cancels their getting up
+        asyncio.run(server.deleteplayer(game, b"b"))
+        self.assertEqual(sent[-1], ("stramash/game/g/playerdeleted", "b"))
+        self.assertEqual((len(server.timers), list(server.game_timers["g"])), (1, [None]))
+        server.timers.advance(time.monotonic() * 1000 + game.down_time + game.shield_time + 200)
+        self.assertNotIn("stramash/player/b/up", [topic for topic, message in sent])
+
+    # --------------------------------------------------------------------------
+    # JOURNAL TESTS
+    # --------------------------------------------------------------------------
+    def test_game_todict(self):
+        game = Game("g", "Game", "ffa", "00:10:00")
+        red = game.addteam("Red", Colour("Red", 255, 0, 0))
+        game.addplayer("a", "A", red)
+        game.addplayer("b", "B", red)
+        game.addplayer("c", "C", None, Colour("Blue", 0, 0, 255))
+        game.start()
+        game.fire("a")
+        game.hit(1, 1, 2, 1, 0)
+        copy = Game.deserialise(game.serialise())
+        self.assertEqual(copy.to_dict(), game.to_dict())
+        self.assertEqual(copy.teams[red.id].players["b"], copy.players["b"])
+        self.assertEqual(copy.leaderboard.top(3), [copy.players[id] for id in ("a", "b", "c")])
+        self.assertEqual(copy.players["c"].score, -1)
+        self.assertEqual(copy.hitlog[0][:5], (1, 1, 2, 1, 0))
+
+    def test_journal(self):
+        newgame = b'{"name":"Test","type":"ffa","maxtime":"00:10:00","players":[{"name":"a","gunid":"a","colour":[255,0,0]},{"name":"b","gunid":"b","colour":[0,0,255]}]}'
+        with tempfile.TemporaryDirectory() as directory:
+            server, sent = self.make_server()
+            server.resume(Journal(directory))
+            asyncio.run(server.newgame(newgame))
+            game = list(server.games.values())[0]
+            asyncio.run(server.startgame(game, b""))
+            asyncio.run(server.fire(game, b"a"))
+            server.hit_batch(game, [b"[1,1,2,1,0]", b"[2,1,1,1,0]"])
+            server.journal.stop()
+
+            # everything is replayed from the journal
+            recovered, sent = self.make_server()
+            recovered.resume(Journal(directory))
+            self.assertEqual(recovered.games[game.id].to_dict(), game.to_dict())
+
+            # after a snapshot, only the events since are replayed
+            recovered.hit_batch(recovered.games[game.id], [b"[1,1,2,1,0]"])
+            recovered.snapshot()
+            asyncio.run(recovered.fire(recovered.games[game.id], b"b"))
+            recovered.journal.stop()
+            games, events = recover(directory)
+            self.assertEqual(games[game.id]["players"][0]["kills"], 2)
+            self.assertEqual([event["e"] for gameid, event in events], ["fire"])
+            self.assertEqual(len(segment_numbers(directory)), 1)
+
+            # a damaged record (eg a write cut short by a crash) ends the journal
+            path = os.path.join(directory, segment_name(segment_numbers(directory)[0]))
+            with open(path, "r+b") as f:
+                f.seek(RECORD_HEADER_SIZE)
+                f.write(b"X")
+            again, sent = self.make_server()
+            again.restore(*recover(directory))
+            self.assertEqual(again.games[game.id].players["b"].shots, 0)
+            self.assertEqual(again.games[game.id].players["a"].kills, 2)
+
+    # --------------------------------------------------------------------------
+    # REPLAY TESTS
+    # --------------------------------------------------------------------------
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            server, sent = self.make_server()
+            server.resume(Journal(directory, archive=True))
+            asyncio.run(server.newgame(b'{"name":"Test","type":"ffa","maxtime":"00:10:00","players":[{"name":"a","gunid":"a","colour":[255,0,0]},{"name":"b","gunid":"b","colour":[0,0,255]},{"name":"c","gunid":"c","colour":[0,255,0]}]}'))
+            game = list(server.games.values())[0]
+            game.start()
+            random.seed(9)
+            for i in range(50):
+                if i == 20:
+                    server.snapshot() # the history spans the archive
+                game.apply_hits([[random.randint(1, 3), 1, random.randint(1, 3), 1, 0]], i * 1000)
+                game.fire(random.choice("abc"), i * 1000 + 500)
+            game.end()
+            server.journal.stop()
+
+            created, events = history(directory, game.id)
+            self.assertEqual(len(events), 102)
+            replay = Replay(created, events, 8)
+            self.assertEqual(replay.seek(len(replay)).to_dict(), game.to_dict())
+            # the checkpoints share the one hit log, rather than copying it
+            self.assertNotIn("hitlog", replay.checkpoints[-1][0])
+            # seeking to any point is the same as replaying up to it
+            expected = Game.from_dict(created)
+            for count in range(len(events) + 1):
+                if count > 0:
+                    expected.apply(events[count - 1])
+                self.assertEqual(replay.seek(count).to_dict(), expected.to_dict())
+            # 20.5 seconds in: after the start, 21 hits and 21 fires
+            count = replay.at(20500)
+            self.assertEqual(count, 43)
+            self.assertEqual(replay.time(count), 20500)
+            past = replay.seek(count)
+            self.assertEqual(sum(player.shots for player in past.players.values()), 21)
+            for player in past.players.values():
+                condition = past.condition(player, 20500)
+                if player.last_death == None or player.last_death <= 20500 - DOWN_TIME - SHIELD_TIME:
+                    self.assertEqual(condition, "up")
+                else:
+                    self.assertIn(condition, ("down", "shielded"))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
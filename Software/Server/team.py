@@ -1,15 +1,130 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# team.py
+# Provides the Team class.
+# ----------------------------------------------------------------------
+import json
+from utils import unique_id
+from colour import Colour
+import statecache
+
 class Team:
-    # TODO properties
-    # name
-    # id
-    # colour
-    # players
-    # state (MQTT state message)
-
-    # TODO methods
-    # addplayer
-    # deleteplayer
-    # serialise (JSON)
-    # deserialise (JSON)
-
-    pass
\ No newline at end of file
+    __slots__ = ("id", "name", "colour", "number", "players", "_state")
+
+    def __init__(self, name, colour, number, id=None):
+        """
+        Initialises the team.
+
+        name: descriptive name for the team
+        colour: the team Colour
+        number: the team number (0-255) used for IR codes
+        id: unique identifier for the team (generated if not given)
+        """
+        if not isinstance(name, str) or type(number) is not int:
+            raise TypeError
+        if not (colour == None or isinstance(colour, Colour)):
+            raise TypeError
+        if not (id == None or isinstance(id, str)):
+            raise TypeError
+        self.id = id if id != None else unique_id()
+        self.name = name
+        self.colour = colour
+        self.number = number
+        self.players = {}
+        self._state = None # the encoded teamstate message, until it changes
+
+    def addplayer(self, player):
+        """
+        Adds a player to the team.
+
+        player: the Player being added
+        """
+        self.players[player.id] = player
+        player.teamnumber = self.number
+        player.colour = self.colour
+        player.changed()
+        self._state = None
+
+    def deleteplayer(self, playerid):
+        """
+        Removes a player from the team.
+
+        playerid: the id of the player being removed
+        """
+        del self.players[playerid]
+        self._state = None
+
+    def state(self):
+        """
+        Returns the team as a dict, ready to be JSONified for teamstate.
+        """
+        colour = self.colour
+        return {
+            "id": self.id,
+            "name": self.name,
+            "number": self.number,
+            "colour": [colour.red, colour.green, colour.blue] if colour != None else [0,0,0],
+            "players": list(self.players.keys())
+        }
+
+    def state_message(self):
+        """
+        Returns the teamstate message (bytes), from the cache if possible.
+        """
+        if self._state != None:
+            statecache.stats.hits += 1
+        else:
+            statecache.stats.misses += 1
+            self._state = statecache.encode_state(self.state())
+        return self._state
+
+    def to_dict(self):
+        """
+        Returns everything needed to recreate the team (less its Players,
+        which are listed by id), as a dict.
+        """
+        colour = self.colour
+        return {
+            "id": self.id,
+            "name": self.name,
+            "number": self.number,
+            "colour": colour.to_list() if colour != None else None,
+            "players": list(self.players.keys())
+        }
+
+    @staticmethod
+    def from_dict(data, players={}):
+        """
+        Recreates a team from the dict returned by to_dict().
+
+        data: the dict
+        players: the game's Players, by id, to put back in the team
+        """
+        colour = Colour.from_list(data["colour"]) if data["colour"] != None else None
+        team = Team(data["name"], colour, data["number"], data["id"])
+        for playerid in data["players"]:
+            if playerid in players:
+                team.players[playerid] = players[playerid]
+        return team
+
+    def serialise(self):
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @staticmethod
+    def deserialise(serialised_team, players={}):
+        return Team.from_dict(json.loads(serialised_team), players)
@@ -0,0 +1,152 @@
+# Laser Stramash: weapons-grade Free Software laser tag system.
+# Copyright (C) 2021 Adam Oellermann
+# adam@oellermann.com
+# ----------------------------------------------------------------------
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# ----------------------------------------------------------------------
+# timers.py
+# Provides the TimingWheel, which runs the server's timers: putting players
+# back up after they're hit, ending their shields, and ending games.
+#
+# There can be a timer or two for every player in every game, and most are
+# cancelled (a player hit again while down starts over), so scheduling and
+# cancelling have to be cheap. The wheel is a hierarchy of LEVELS rings of
+# SLOTS buckets. A timer goes in the bucket for its tick in the innermost
+# ring if it's due within SLOTS ticks, or else in the bucket covering its
+# time in an outer ring, to be moved inwards when the inner rings come
+# round to it. Each bucket is a dict, so scheduling and cancelling are a
+# dict insert and delete, and advancing a tick looks at one bucket.
+# ----------------------------------------------------------------------
+
+from utils import dbg
+
+DEFAULT_TICK = 10 # ms
+BITS = 8
+SLOTS = 1 << BITS
+MASK = SLOTS - 1
+LEVELS = 4 # with 10ms ticks, timers can be up to 497 days ahead
+
+class Timer:
+    """
+    A callback due at a given time. Cancel it with TimingWheel.cancel().
+    """
+    __slots__ = ("tick", "callback", "args", "bucket")
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick         # the tick it's due at
+        self.callback = callback
+        self.args = args
+        self.bucket = None       # the bucket it's in; None once run or cancelled
+
+    @property
+    def pending(self):
+        return self.bucket != None
+
+class TimingWheel:
+    def __init__(self, now, tick=DEFAULT_TICK):
+        """
+        Initialises the wheel.
+
+        now: the current time (ms), eg time.monotonic() * 1000
+        tick: the resolution (ms) of the timers
+        """
+        self.tick = tick
+        self.current = int(now // tick) # the last tick run
+        self.wheels = [[{} for slot in range(SLOTS)] for level in range(LEVELS)]
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, when, callback, *args):
+        """
+        Schedules callback(*args) to run at a given time, and returns its
+        Timer. Times already past run at the next tick.
+
+        when: the time (ms) to run it, as passed to advance()
+        """
+        tick = int(-(-when // self.tick)) # rounding up
+        if tick <= self.current:
+            tick = self.current + 1
+        timer = Timer(tick, callback, args)
+        self._place(timer)
+        self.count += 1
+        return timer
+
+    def cancel(self, timer):
+        """
+        Cancels a timer, if it hasn't run yet.
+        """
+        bucket = timer.bucket
+        if bucket != None:
+            del bucket[timer]
+            timer.bucket = None
+            self.count -= 1
+
+    def advance(self, now):
+        """
+        Runs the timers which are due by now, in order. Called every tick by
+        the Runtime.
+
+        now: the current time (ms)
+        """
+        target = int(now // self.tick)
+        if self.count == 0:
+            # nothing to do, however far we've come
+            self.current = max(self.current, target)
+            return
+        wheel = self.wheels[0]
+        while self.current < target:
+            self.current += 1
+            tick = self.current
+            if tick & MASK == 0:
+                self._cascade(tick)
+            bucket = wheel[tick & MASK]
+            if len(bucket) > 0:
+                for timer in list(bucket):
+                    if timer.bucket is bucket: # unless an earlier one cancelled it
+                        del bucket[timer]
+                        timer.bucket = None
+                        self.count -= 1
+                        try:
+                            timer.callback(*timer.args)
+                        except Exception as e:
+                            # the rest of the bucket still has to run
+                            dbg("timers: error in "+getattr(timer.callback, "__name__", "timer")+": "+repr(e))
+            if self.count == 0:
+                self.current = target
+                return
+
+    def _place(self, timer):
+        tick = timer.tick
+        level = (((tick - self.current) | 1).bit_length() - 1) // BITS
+        if level >= LEVELS:
+            raise ValueError("Timer too far ahead")
+        bucket = self.wheels[level][(tick >> (BITS * level)) & MASK]
+        bucket[timer] = None
+        timer.bucket = bucket
+
+    def _cascade(self, tick):
+        # the inner ring has come round: move the timers in the outer rings'
+        # buckets for this time inwards
+        for level in range(1, LEVELS):
+            index = (tick >> (BITS * level)) & MASK
+            bucket = self.wheels[level][index]
+            if len(bucket) > 0:
+                timers = list(bucket)
+                bucket.clear()
+                for timer in timers:
+                    self._place(timer)
+            if index != 0:
+                break